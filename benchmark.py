@@ -0,0 +1,369 @@
+import argparse
+import functools
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import chunker
+from fakes import RecordingDriver, MemoryIndex, FakeOpenAI, FakeTagger, FakeExtractor, WordEncoding
+
+# Offline ingest benchmark. Runs the ingest pipelines of process.py and
+# process_scotus.py against the in-memory stand-ins in fakes.py, on synthetic
+# emails and cases, and reports throughput, per-stage and per-function
+# latency and peak RSS. The `search` workload times queries against a
+# LocalIndex instead.
+#
+#   python benchmark.py --output benchmark_baseline.json
+#   python benchmark.py --compare benchmark_baseline.json
+
+WORDS = ("the court held that petitioner respondent statute review judgment appeal claim "
+         "federal state evidence trial counsel motion order opinion argument record").split()
+NAMES = ["Smith", "Jones", "Garcia", "Miller", "Davis", "Lopez", "Wilson", "Taylor", "Thomas", "Moore"]
+PLACES = ["Texas", "Ohio", "Washington", "Georgia", "Virginia", "California"]
+
+
+###########################
+# Synthetic inputs        #
+###########################
+
+def synthetic_sentence(rng, words=18):
+    tokens = [rng.choice(WORDS) for _ in range(words)]
+    for _ in range(rng.randint(0, 3)):
+        tokens[rng.randrange(1, words)] = rng.choice(NAMES + PLACES)
+    tokens[0] = tokens[0].capitalize()
+    return " ".join(tokens)
+
+def synthetic_text(rng, sentences):
+    return ". ".join(synthetic_sentence(rng) for _ in range(sentences)) + "."
+
+def synthetic_email(i, rng):
+    sender, recipient = rng.sample(NAMES, 2)
+    return {
+        "email_from": f"{sender.lower()}@enron.com",
+        "email_to": f"{recipient.lower()}@enron.com",
+        "email_subject": synthetic_sentence(rng, 6),
+        "email_body": synthetic_text(rng, rng.randint(2, 40)),
+        "email_sent_date": f"2001-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "transaction_id": f"email-{i}",
+    }
+
+def synthetic_case(i, rng, opinions=2, opinion_sentences=60):
+    """Returns (case data in the Oyez shape, opinion records for the document store)."""
+    justices = [{"ID": 100 + j, "name": f"Justice {NAMES[j]}"} for j in range(9)]
+    first_party, second_party = rng.sample(NAMES + PLACES, 2)
+    written_opinion = [
+        {"id": i * 10 + k, "title": f"Opinion {k} in case {i}", "type": {"value": "majority", "label": "Majority"}}
+        for k in range(opinions)
+    ]
+    case = {
+        "ID": i,
+        "name": f"{first_party} v. {second_party}",
+        "href": f"https://example.invalid/cases/{i}",
+        "docket_number": f"{i}-{rng.randint(1, 999)}",
+        "first_party": first_party,
+        "first_party_label": "Petitioner",
+        "second_party": second_party,
+        "second_party_label": "Respondent",
+        "timeline": [{"dates": [rng.randint(0, 1_600_000_000)]}],
+        "citation": {"volume": rng.randint(300, 600), "page": rng.randint(1, 999), "year": rng.randint(1950, 2020)},
+        "advocates": [{"advocate": {"name": f"Counsel {rng.choice(NAMES)}"}, "advocate_description": "for the petitioner"}],
+        "decisions": [{
+            "description": "Reversed",
+            "winning_party": first_party,
+            "decision_type": "majority opinion",
+            "votes": [{"member": justice, "vote": "majority", "opinion_type": "none"} for justice in justices],
+        }],
+        "decided_by": {"name": "Court", "members": justices},
+        "term": str(rng.randint(1950, 2020)),
+        "written_opinion": written_opinion,
+    }
+    records = [{"id": opinion["id"], "content": synthetic_text(rng, opinion_sentences)} for opinion in written_opinion]
+    return case, records
+
+
+###########################
+# Measurement             #
+###########################
+
+class LatencyRecorder:
+    """Collects per-call durations for the functions it wraps."""
+
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def wrap(self, module, name):
+        # Patch the module global, so calls from inside the module are timed too
+        fn = getattr(module, name)
+
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self.lock:
+                    self.samples.setdefault(name, []).append(elapsed)
+
+        setattr(module, name, timed)
+        return fn
+
+    def summary(self):
+        return {name: latency_summary(samples) for name, samples in self.samples.items()}
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def latency_summary(samples):
+    ordered = sorted(samples)
+    return {
+        "calls": len(ordered),
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p90_ms": round(percentile(ordered, 0.90) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS; it is the peak of
+    # the whole process, so later runs report at least the earlier runs' peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def instrumented(module, names):
+    recorder = LatencyRecorder()
+    originals = {name: recorder.wrap(module, name) for name in names}
+    return recorder, originals
+
+def restore(module, originals):
+    for name, fn in originals.items():
+        setattr(module, name, fn)
+
+
+###########################
+# Workloads               #
+###########################
+
+def fakes_for(args):
+    return (
+        RecordingDriver(latency=args.graph_latency, keep_statements=False),
+        MemoryIndex(latency=args.index_latency),
+        FakeOpenAI(latency=args.embed_latency),
+    )
+
+def run_enron(size, args, workdir):
+    import process
+    driver, index, client = fakes_for(args)
+    process.init(driver, index, client,
+                 manifest_path=os.path.join(workdir, "enron.manifest.sqlite"),
+                 embedding_cache_path=os.path.join(workdir, "embeddings.cache.sqlite"),
+                 near_duplicates_path=os.path.join(workdir, "near_duplicates.sqlite"))
+    process.upsert_sink.on_upserted = process.record_upserted_chunks
+    rng = random.Random(args.seed)
+    emails = [synthetic_email(i, rng) for i in range(size)]
+
+    # Stages are looked up when the pipeline is built, so they are wrapped first
+    recorder, originals = instrumented(process, [
+        "graph_stage", "embed_stage", "upsert_stage", "save_transaction_graph", "transaction_chunk_vectors",
+    ])
+    started = time.perf_counter()
+    try:
+        stages = process.email_pipeline().run_sync(emails)
+        process.close()
+    finally:
+        restore(process, originals)
+    elapsed = time.perf_counter() - started
+    return result(size, elapsed, recorder, driver, index, client, stages)
+
+def run_scotus(size, args, workdir):
+    import process_scotus
+    driver, index, client = fakes_for(args)
+    process_scotus.init(driver, index, client,
+                        ner_models=(FakeTagger(args.ner_latency), FakeExtractor()),
+                        doc_store_path=os.path.join(workdir, "scotus.sqlite"),
+                        manifest_path=os.path.join(workdir, "scotus.manifest.sqlite"),
+                        embedding_cache_path=os.path.join(workdir, "embeddings.cache.sqlite"),
+                        near_duplicates_path=os.path.join(workdir, "near_duplicates.sqlite"),
+                        entity_index_path=os.path.join(workdir, "entities.sqlite"),
+                        # Only the synthetic cases; real exports in the working directory aren't imported
+                        tinydb_paths={})
+    rng = random.Random(args.seed)
+    cases = []
+    for i in range(size):
+        case, records = synthetic_case(i, rng, opinion_sentences=args.opinion_sentences)
+        process_scotus.opinions_db.put_many(records)
+        cases.append(case)
+
+    recorder, originals = instrumented(process_scotus, [
+        "load_case_stage", "case_graph_stage", "embed_stage", "upsert_stage", "ner_stage", "entity_graph_stage",
+        "save_case_graph", "opinion_chunk_vectors", "save_opinion_entities",
+    ])
+    started = time.perf_counter()
+    try:
+        stages = process_scotus.scotus_pipeline().run_sync(cases)
+        process_scotus.close()
+    finally:
+        restore(process_scotus, originals)
+    elapsed = time.perf_counter() - started
+    return result(size, elapsed, recorder, driver, index, client, stages)
+
+def run_ner(size, args, workdir):
+    import ner
+    tagger, extractor = FakeTagger(args.ner_latency), FakeExtractor()
+    rng = random.Random(args.seed)
+    sentences = [synthetic_sentence(rng) for _ in range(size)]
+
+    # Sentences go through the models an opinion at a time, as in the pipeline's NER stage
+    recorder, originals = instrumented(ner, ["extract_batch"])
+    started = time.perf_counter()
+    try:
+        for start in range(0, size, args.opinion_sentences):
+            ner.extract_batch(sentences[start:start + args.opinion_sentences], tagger, extractor)
+    finally:
+        restore(ner, originals)
+    elapsed = time.perf_counter() - started
+    return result(size, elapsed, recorder)
+
+def run_search(size, args, workdir):
+    # Exact and IVF top-10 queries over `size` clustered vectors in a LocalIndex, with IVF recall
+    import types
+    import numpy as np
+    from local_index import LocalIndex
+    rng = np.random.default_rng(args.seed)
+    centers = rng.normal(size=(max(1, size // 100), args.search_dimensions))
+    def clustered(n):
+        return (centers[rng.integers(0, len(centers), n)] + rng.normal(scale=0.5, size=(n, args.search_dimensions))).astype(np.float32)
+
+    index = LocalIndex(os.path.join(workdir, "index"))
+    for start in range(0, size, 1000):
+        values = clustered(min(1000, size - start))
+        index.upsert([(f"chunk-{start + i}", vector, {"case_id": str((start + i) % 1000)}) for i, vector in enumerate(values)])
+    queries = clustered(args.search_queries)
+
+    search = types.SimpleNamespace(exact_query=lambda vector: index.query(vector=vector, top_k=10),
+                                   ivf_query=lambda vector: index.query(vector=vector, top_k=10))
+    recorder, _ = instrumented(search, ["exact_query", "ivf_query"])
+    started = time.perf_counter()
+    exact = [{match["id"] for match in search.exact_query(vector)["matches"]} for vector in queries]
+    elapsed = time.perf_counter() - started
+    index.build_ivf()
+    started = time.perf_counter()
+    approximate = [{match["id"] for match in search.ivf_query(vector)["matches"]} for vector in queries]
+    ivf_elapsed = time.perf_counter() - started
+    index.close()
+
+    summary = result(len(queries), elapsed, recorder)
+    summary["vectors"] = size
+    summary["ivf_queries_per_second"] = round(len(queries) / ivf_elapsed, 2) if ivf_elapsed else None
+    summary["ivf_recall_at_10"] = round(sum(len(a & e) / max(1, len(e)) for a, e in zip(approximate, exact)) / len(queries), 4)
+    return summary
+
+def result(size, elapsed, recorder, driver=None, index=None, client=None, stages=None):
+    summary = {
+        "items": size,
+        "seconds": round(elapsed, 3),
+        "items_per_second": round(size / elapsed, 2) if elapsed else None,
+        "latency": recorder.summary(),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if stages is not None:
+        summary["stages"] = stages
+    if driver is not None:
+        summary["cypher_statements"] = driver.statement_count
+        summary["cypher_rows"] = driver.rows
+    if index is not None:
+        summary["vectors_upserted"] = len(index)
+        summary["upsert_calls"] = index.upsert_calls
+    if client is not None:
+        summary["embedding_requests"] = client.requests
+        summary["embedding_inputs"] = client.inputs
+    return summary
+
+WORKLOADS = {
+    "enron": run_enron,
+    "scotus": run_scotus,
+    "ner": run_ner,
+    "search": run_search,
+}
+
+
+###########################
+# Main                    #
+###########################
+
+def sizes(value):
+    return [int(size) for size in value.split(",") if size]
+
+def compare(results, baseline):
+    for workload, runs in results.items():
+        for size, run in runs.items():
+            before = baseline.get("results", {}).get(workload, {}).get(size)
+            if not before or not before.get("items_per_second"):
+                continue
+            change = run["items_per_second"] / before["items_per_second"] - 1
+            print(f"{workload:>8} {size:>6}: {before['items_per_second']:>10} -> {run['items_per_second']:>10} items/s ({change:+.1%})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest throughput against local stand-ins for Neo4j, Pinecone and OpenAI")
+    parser.add_argument("--workloads", default="enron,scotus,ner", help="comma-separated subset of: " + ", ".join(WORKLOADS))
+    parser.add_argument("--enron-sizes", type=sizes, default=[100, 1000, 5000])
+    parser.add_argument("--scotus-sizes", type=sizes, default=[10, 50, 200])
+    parser.add_argument("--ner-sizes", type=sizes, default=[100, 1000])
+    parser.add_argument("--search-sizes", type=sizes, default=[10000, 100000], help="vectors in the local index")
+    parser.add_argument("--search-dimensions", type=int, default=256)
+    parser.add_argument("--search-queries", type=int, default=200)
+    parser.add_argument("--opinion-sentences", type=int, default=60)
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="seconds per embeddings request")
+    parser.add_argument("--graph-latency", type=float, default=0.002, help="seconds per Cypher statement")
+    parser.add_argument("--index-latency", type=float, default=0.01, help="seconds per upsert request")
+    parser.add_argument("--ner-latency", type=float, default=0.0, help="seconds per sentence tagged")
+    parser.add_argument("--tokenizer", choices=["cl100k_base", "words"], default="cl100k_base",
+                        help="chunk with tiktoken (downloaded unless in TIKTOKEN_CACHE_DIR) or with a word tokenizer that runs offline")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON, e.g. benchmark_baseline.json")
+    parser.add_argument("--compare", help="baseline JSON to compare items/sec against")
+    args = parser.parse_args()
+    if args.tokenizer == "words":
+        chunker.set_encoding(WordEncoding())
+
+    size_options = {"enron": args.enron_sizes, "scotus": args.scotus_sizes, "ner": args.ner_sizes, "search": args.search_sizes}
+    results = {}
+    for workload in args.workloads.split(","):
+        results[workload] = {}
+        for size in size_options[workload]:
+            # Fresh manifest, cache and document store per run, so nothing is skipped as already done
+            with tempfile.TemporaryDirectory() as workdir:
+                run = WORKLOADS[workload](size, args, workdir)
+            results[workload][str(size)] = run
+            print(f"{workload:>8} {size:>6}: {run['items_per_second']} items/s, peak RSS {run['peak_rss_mb']} MB")
+            if "ivf_recall_at_10" in run:
+                print(f"{'':>17}IVF: {run['ivf_queries_per_second']} queries/s, recall@10 {run['ivf_recall_at_10']}")
+            for name, latency in run["latency"].items():
+                print(f"{'':>17}{name}: p50 {latency['p50_ms']} ms, p90 {latency['p90_ms']} ms, p99 {latency['p99_ms']} ms")
+            for name, stats in run.get("stages", {}).items():
+                if stats["failed"]:
+                    print(f"{'':>17}{name}: {stats['failed']} items failed")
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import csv
+import json
+import os
+import re
+import sqlite3
+import threading
+
+IMPORT_SCRIPT = "import.sh"
+# Deduplication state lives on disk next to the CSVs, so memory stays flat on a full corpus
+STATE_FILE = ".export-state.sqlite"
+
+
+def csv_type(value):
+    if isinstance(value, bool):
+        return ":boolean"
+    if isinstance(value, int):
+        return ":long"
+    if isinstance(value, float):
+        return ":double"
+    return ""
+
+
+def file_part(name):
+    return re.sub(r"\W+", "_", str(name)).strip("_") or "unnamed"
+
+
+class CsvGraphExporter:
+    """Writes the graph as CSV files for `neo4j-admin database import full`.
+
+    A drop-in for GraphWriter (`add_node`, `add_edge`, `after_flush`, `flush`,
+    `close`). Every label is its own ID space, matching the per-label
+    uniqueness on id used by the transactional path. Node rows are streamed to
+    one file per (label, property keys) the first time an id is seen; edges
+    are counted in an on-disk table keyed by (endpoints, type, properties) and
+    written out on close, each with its summed count. `import.sh` with the
+    matching neo4j-admin command is written alongside.
+
+    `id_properties` maps a label to the property that holds its id (e.g.
+    {"EmailAddress": "address"}); other labels use `id`.
+    """
+
+    def __init__(self, directory, id_properties=None, database="neo4j"):
+        self.directory = directory
+        self.id_properties = id_properties or {}
+        self.database = database
+        os.makedirs(directory, exist_ok=True)
+        self.node_files = {}
+        self.edge_groups = {}
+        self.callbacks = []
+        self.nodes_written = 0
+        self.skipped_nodes = 0
+        self.edges_added = 0
+        self.merged_edges = 0
+        self.lock = threading.RLock()
+
+        state_path = os.path.join(directory, STATE_FILE)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        self.state = sqlite3.connect(state_path, check_same_thread=False)
+        self.state.execute("PRAGMA journal_mode=OFF")
+        self.state.execute("PRAGMA synchronous=OFF")
+        self.state.execute("CREATE TABLE nodes (label TEXT, id TEXT, PRIMARY KEY (label, id)) WITHOUT ROWID")
+        self.state.execute(
+            "CREATE TABLE edges (grp INTEGER, from_id TEXT, to_id TEXT, properties TEXT, count INTEGER, "
+            "PRIMARY KEY (grp, from_id, to_id, properties)) WITHOUT ROWID"
+        )
+
+    def id_property(self, label):
+        return self.id_properties.get(label, "id")
+
+    def _node_file(self, label, properties):
+        key = (label, tuple(sorted(properties.keys())))
+        entry = self.node_files.get(key)
+        if entry is None:
+            path = f"nodes-{file_part(label)}-{len(self.node_files)}.csv"
+            f = open(os.path.join(self.directory, path), "w", newline="")
+            writer = csv.writer(f)
+            id_property = self.id_property(label)
+            keys = [name for name in key[1] if name != id_property]
+            writer.writerow([f"{id_property}:ID({label})", ":LABEL"] + [f"{name}{csv_type(properties[name])}" for name in keys])
+            entry = self.node_files[key] = (path, f, writer, keys)
+        return entry
+
+    def write_node(self, label, id, properties):
+        if not id or not label or any(value is None for value in properties.values()):
+            return
+        with self.lock:
+            inserted = self.state.execute("INSERT OR IGNORE INTO nodes VALUES (?, ?)", (label, str(id))).rowcount
+            if not inserted:
+                self.skipped_nodes += 1
+                return
+            _, _, writer, keys = self._node_file(label, properties)
+            writer.writerow([str(id), label] + [properties[name] for name in keys])
+            self.nodes_written += 1
+
+    def write_edge(self, relationship_type, from_label, from_id, to_label, to_id, properties, increment_property="count"):
+        if from_id is None or to_id is None or not relationship_type:
+            return
+        if any(value is None for value in properties.values()):
+            return
+        if not from_label or not to_label:
+            raise ValueError(f"Edge {relationship_type} needs both endpoint labels for a bulk import")
+        key = (relationship_type, tuple(sorted(properties.keys())), increment_property, from_label, to_label)
+        with self.lock:
+            group = self.edge_groups.setdefault(key, len(self.edge_groups))
+            self.state.execute(
+                "INSERT INTO edges VALUES (?, ?, ?, ?, 1) "
+                "ON CONFLICT (grp, from_id, to_id, properties) DO UPDATE SET count = count + 1",
+                (group, str(from_id), str(to_id), json.dumps(properties, sort_keys=True)),
+            )
+            self.edges_added += 1
+
+    def add_node(self, node):
+        self.write_node(node.label, node.id, node.properties)
+
+    def add_edge(self, edge):
+        self.write_edge(edge.relationship_type, edge.from_label, edge.from_node_id, edge.to_label, edge.to_node_id,
+                        edge.properties, edge.increment_property)
+
+    def after_flush(self, callback):
+        # Nothing is final until the edge files are written, so callbacks wait for close()
+        with self.lock:
+            self.callbacks.append(callback)
+
+    def flush(self):
+        with self.lock:
+            for _, f, _, _ in self.node_files.values():
+                f.flush()
+        return 0
+
+    def _write_edges(self):
+        paths = []
+        for (relationship_type, property_keys, increment_property, from_label, to_label), group in self.edge_groups.items():
+            path = f"rels-{file_part(relationship_type)}-{group}.csv"
+            rows = self.state.execute("SELECT from_id, to_id, properties, count FROM edges WHERE grp = ?", (group,))
+            with open(os.path.join(self.directory, path), "w", newline="") as f:
+                writer = csv.writer(f)
+                header = [f":START_ID({from_label})", f":END_ID({to_label})", ":TYPE"]
+                first = True
+                for from_id, to_id, properties, count in rows:
+                    properties = json.loads(properties)
+                    if first:
+                        writer.writerow(header + [f"{name}{csv_type(properties[name])}" for name in property_keys]
+                                        + [f"{increment_property}:long"])
+                        first = False
+                    writer.writerow([from_id, to_id, relationship_type] + [properties[name] for name in property_keys] + [count])
+            paths.append(path)
+        return paths
+
+    def _write_import_script(self, node_paths, edge_paths):
+        arguments = [f"--nodes={path}" for path in node_paths] + [f"--relationships={path}" for path in edge_paths]
+        lines = [
+            "#!/bin/sh",
+            "# Generated by bulk_export.py; run from this directory with the database stopped",
+            "neo4j-admin database import full --overwrite-destination --multiline-fields=true \\",
+            "  --skip-bad-relationships=true \\",
+        ] + [f"  {argument} \\" for argument in arguments] + [f"  {self.database}"]
+        path = os.path.join(self.directory, IMPORT_SCRIPT)
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.chmod(path, 0o755)
+
+    def close(self):
+        with self.lock:
+            node_paths = []
+            for path, f, _, _ in self.node_files.values():
+                f.close()
+                node_paths.append(path)
+            edge_paths = self._write_edges()
+            self.merged_edges = self.edges_added - self.state.execute("SELECT COUNT(*) FROM edges").fetchone()[0]
+            self._write_import_script(node_paths, edge_paths)
+            self.state.close()
+            os.remove(os.path.join(self.directory, STATE_FILE))
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,77 @@
+import re
+from bisect import bisect_left, bisect_right
+
+import tiktoken
+
+# text-embedding-3-small uses the cl100k_base tokenizer
+ENCODING_NAME = "cl100k_base"
+MAX_CHUNK_TOKENS = 128
+
+# Matches the end of a sentence (after any closing quotes/brackets) or of a paragraph
+SENTENCE_END = re.compile(r"[.!?][\"')\]]*(?=\s)|(?<=\S)(?=\n[ \t]*\n)")
+
+_encoding = None
+
+
+def get_encoding():
+    # tiktoken downloads the encoding on first use and caches it in
+    # TIKTOKEN_CACHE_DIR (a temp dir by default); point it at a directory
+    # holding the cached file to chunk without network access
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding(ENCODING_NAME)
+    return _encoding
+
+
+def set_encoding(encoding):
+    """Uses `encoding` (anything with tiktoken's encode/decode_with_offsets) wherever no encoding is passed."""
+    global _encoding
+    _encoding = encoding
+
+
+def iter_chunks(text, max_tokens=MAX_CHUNK_TOKENS, overlap_tokens=0, snap_to_sentences=True, encoding=None):
+    """Yields (ordinal, start_offset, chunk_text) for consecutive chunks of `text`.
+
+    The document is tokenized once and cut into windows of at most
+    `max_tokens` model tokens, each starting `overlap_tokens` before the end
+    of the previous one. With `snap_to_sentences`, a window is shortened to
+    end at the last sentence boundary in its second half, if there is one.
+    `start_offset` is the character offset of the chunk in `text`.
+    """
+    if not text:
+        return
+    if overlap_tokens >= max_tokens:
+        raise ValueError("overlap_tokens must be smaller than max_tokens")
+
+    encoding = encoding or get_encoding()
+    tokens = encoding.encode(text, disallowed_special=())
+    if not tokens:
+        return
+    _, token_offsets = encoding.decode_with_offsets(tokens)
+    boundaries = [match.end() for match in SENTENCE_END.finditer(text)] if snap_to_sentences else []
+
+    ordinal = 0
+    start = 0
+    while start < len(tokens):
+        end = min(start + max_tokens, len(tokens))
+        start_char = token_offsets[start]
+        end_char = token_offsets[end] if end < len(tokens) else len(text)
+
+        if boundaries and end < len(tokens):
+            # Last sentence boundary inside the window, as long as it keeps at least half of it
+            i = bisect_right(boundaries, end_char) - 1
+            if i >= 0 and boundaries[i] > token_offsets[start + max_tokens // 2]:
+                snapped = bisect_left(token_offsets, boundaries[i], start, end)
+                if start < snapped < end:
+                    end = snapped
+                    end_char = token_offsets[end]
+
+        chunk = text[start_char:end_char]
+        stripped = chunk.lstrip()
+        if stripped.strip():
+            yield ordinal, start_char + len(chunk) - len(stripped), stripped.rstrip()
+            ordinal += 1
+
+        if end >= len(tokens):
+            break
+        start = max(end - overlap_tokens, start + 1)
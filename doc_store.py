@@ -0,0 +1,269 @@
+import argparse
+import json
+import math
+import os
+import random
+import sqlite3
+import threading
+from itertools import islice
+
+# SQLite caps the number of host parameters per statement
+LOOKUP_BATCH = 500
+# Bytes read at a time by the streaming TinyDB reader
+READ_CHUNK = 1 << 20
+
+
+def _open_unit(rng):
+    # Uniform in (0, 1), so its log is finite and negative
+    while True:
+        u = rng.random()
+        if u > 0.0:
+            return u
+
+
+def reservoir_sample(iterable, n, seed=None):
+    """Picks `n` items uniformly at random from a stream in one pass.
+
+    Uses Algorithm L, which jumps over the items it won't keep instead of
+    drawing a random number for each one. Only the reservoir is held in
+    memory, and the same seed over the same stream gives the same sample.
+    """
+    rng = random.Random(seed)
+    iterator = iter(iterable)
+    reservoir = list(islice(iterator, n))
+    if n <= 0 or len(reservoir) < n:
+        return reservoir
+    w = math.exp(math.log(_open_unit(rng)) / n)
+    while True:
+        skip = math.floor(math.log(_open_unit(rng)) / math.log(1 - w))
+        item = next(islice(iterator, skip, None), reservoir)
+        if item is reservoir:
+            return reservoir
+        reservoir[rng.randrange(n)] = item
+        w *= math.exp(math.log(_open_unit(rng)) / n)
+
+
+class Collection:
+    """A table of JSON documents indexed by their id field."""
+
+    def __init__(self, conn, name, key, lock):
+        self.conn = conn
+        self.name = name
+        self.key = key
+        self.lock = lock
+        with self.lock:
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {name} (id PRIMARY KEY, data TEXT NOT NULL)")
+            self.conn.commit()
+
+    def get(self, id):
+        with self.lock:
+            row = self.conn.execute(f"SELECT data FROM {self.name} WHERE id = ?", (id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, ids):
+        """Returns {id: record} for every id that exists."""
+        ids = list(dict.fromkeys(ids))
+        found = {}
+        for start in range(0, len(ids), LOOKUP_BATCH):
+            batch = ids[start:start + LOOKUP_BATCH]
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT id, data FROM {self.name} WHERE id IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+            for id, data in rows:
+                found[id] = json.loads(data)
+        return found
+
+    def put_many(self, records):
+        rows = [(record.get(self.key), json.dumps(record)) for record in records]
+        rows = [row for row in rows if row[0] is not None]
+        with self.lock:
+            self.conn.executemany(f"INSERT OR REPLACE INTO {self.name} (id, data) VALUES (?, ?)", rows)
+            self.conn.commit()
+        return len(rows)
+
+    def sample(self, n, seed=None):
+        """Returns up to `n` random records; row ids are streamed through a reservoir to pick them."""
+        with self.lock:
+            rowids = (row[0] for row in self.conn.execute(f"SELECT rowid FROM {self.name} ORDER BY rowid"))
+            picked = reservoir_sample(rowids, n, seed)
+        records = {}
+        for start in range(0, len(picked), LOOKUP_BATCH):
+            batch = picked[start:start + LOOKUP_BATCH]
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT rowid, data FROM {self.name} WHERE rowid IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+            for rowid, data in rows:
+                records[rowid] = json.loads(data)
+        return [records[rowid] for rowid in picked]
+
+    def __iter__(self):
+        # Pages by rowid so the lock isn't held while the caller works on a record
+        last = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT rowid, data FROM {self.name} WHERE rowid > ? ORDER BY rowid LIMIT ?", (last, LOOKUP_BATCH)
+                ).fetchall()
+            if not rows:
+                return
+            for last, data in rows:
+                yield json.loads(data)
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM {self.name}").fetchone()[0]
+
+    def _imports_table(self):
+        self.conn.execute("CREATE TABLE IF NOT EXISTS imports (collection TEXT NOT NULL, source TEXT NOT NULL, "
+                          "signature TEXT NOT NULL, PRIMARY KEY (collection, source))")
+
+    def imported(self, source):
+        """True if the file at `source` was imported completely and hasn't changed since."""
+        with self.lock:
+            self._imports_table()
+            row = self.conn.execute("SELECT signature FROM imports WHERE collection = ? AND source = ?",
+                                    (self.name, os.path.abspath(source))).fetchone()
+        return row is not None and row[0] == file_signature(source)
+
+    def mark_imported(self, source):
+        with self.lock:
+            self._imports_table()
+            self.conn.execute("INSERT OR REPLACE INTO imports VALUES (?, ?, ?)",
+                              (self.name, os.path.abspath(source), file_signature(source)))
+            self.conn.commit()
+
+
+class DocumentStore:
+    """SQLite-backed replacement for the TinyDB case/opinion files.
+
+    Each collection is a table keyed by the record's id, so point lookups and
+    batch lookups hit the primary key index instead of scanning the corpus.
+    The connection is shared between threads behind a lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+
+    def collection(self, name, key='id'):
+        return Collection(self.conn, name, key, self.lock)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class _StreamReader:
+    # Just enough of a JSON tokenizer to walk TinyDB's {table: {doc_id: doc}}
+    # layout while decoding one document at a time
+    def __init__(self, f):
+        self.f = f
+        self.buffer = ""
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.f.read(READ_CHUNK)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos} of the TinyDB file")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # The value may continue past the buffered text
+                if not self._fill():
+                    raise
+                continue
+            # A number could have been cut off at the end of the buffer
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def members(self):
+        """Yields the keys of the object starting here; the caller reads each value."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+
+def iter_tinydb(json_path):
+    """Streams (table, doc_id, document) from a TinyDB JSON file without loading it whole."""
+    with open(json_path) as f:
+        reader = _StreamReader(f)
+        for table in reader.members():
+            for doc_id in reader.members():
+                yield table, doc_id, reader.value()
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def import_tinydb(json_path, collection, batch_size=1000):
+    """Copies every document of a TinyDB JSON file into `collection`.
+
+    Documents are upserted by key, so an interrupted import can simply be
+    run again; the collection records the file once all of it is in (see
+    Collection.imported).
+    """
+    imported = 0
+    batch = []
+    for _, _, record in iter_tinydb(json_path):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            imported += collection.put_many(batch)
+            batch = []
+    if batch:
+        imported += collection.put_many(batch)
+    collection.mark_imported(json_path)
+    return imported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import a TinyDB JSON file into the document store")
+    parser.add_argument("json_path", help="TinyDB file, e.g. opinions.db.json")
+    parser.add_argument("collection", help="collection name, e.g. opinions")
+    parser.add_argument("--key", default="id", help="record field used as the document id")
+    parser.add_argument("--store", default="scotus.sqlite", help="document store path")
+    args = parser.parse_args()
+
+    store = DocumentStore(args.store)
+    count = import_tinydb(args.json_path, store.collection(args.collection, args.key))
+    print(f"Imported {count} documents into {args.collection}")
+    store.close()
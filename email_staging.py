@@ -0,0 +1,180 @@
+import email
+import hashlib
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from email.utils import getaddresses, parsedate_to_datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+EMAIL_SCHEMA = pa.schema([
+    ("file", pa.string()),
+    ("transaction_id", pa.string()),
+    ("email_from", pa.string()),
+    ("email_to", pa.string()),
+    ("email_to_list", pa.list_(pa.string())),
+    ("email_subject", pa.string()),
+    ("email_sent_date", pa.string()),
+    ("sent_at", pa.timestamp("us", tz="UTC")),
+    ("email_body", pa.string()),
+    ("bucket", pa.int32()),
+])
+
+# Each email is hashed into one of a fixed number of buckets when staged, and
+# a shard reads a contiguous range of buckets. Parts are sorted by bucket and
+# written in small row groups, so the scan skips the other shards' row groups
+# from their statistics instead of reading the whole dataset.
+STAGING_BUCKETS = 4096
+ROW_GROUP_SIZE = 1024
+
+
+def transaction_id_for(email_from, email_to, email_subject, email_sent_date):
+    hash_input = f"{email_from}{email_to}{email_subject}{email_sent_date}"
+    return hashlib.sha256(hash_input.encode()).hexdigest()
+
+
+def bucket_for(transaction_id):
+    # transaction_id is a SHA-256 hex digest, so its leading bits are already uniform
+    return int(transaction_id[:16], 16) % STAGING_BUCKETS
+
+
+def shard_for(transaction_id, shards):
+    return bucket_for(transaction_id) * shards // STAGING_BUCKETS
+
+
+def shard_filter(shard, shards):
+    # The buckets b with shard * STAGING_BUCKETS <= b * shards < (shard + 1) * STAGING_BUCKETS
+    low = -(-shard * STAGING_BUCKETS // shards)
+    high = -(-(shard + 1) * STAGING_BUCKETS // shards)
+    return (ds.field("bucket") >= low) & (ds.field("bucket") < high)
+
+
+def parse_sent_at(value):
+    try:
+        return parsedate_to_datetime(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def message_body(msg):
+    if not msg.is_multipart():
+        return msg.get_payload()
+    return "\n".join(part.get_payload() for part in msg.walk() if not part.is_multipart())
+
+
+def transaction_id_of(raw_message):
+    # For logging a message that failed to parse; None if even its headers can't be read
+    try:
+        msg = email.message_from_string(raw_message)
+        return transaction_id_for(msg['From'], msg['To'], msg['Subject'], msg['Date'])
+    except Exception:
+        return None
+
+
+def parse_message(raw_message, file=None):
+    """Parses one raw message from emails.csv into the staging columns."""
+    msg = email.message_from_string(raw_message)
+    email_from = msg['From']
+    email_to = msg['To']
+    email_subject = msg['Subject']
+    email_sent_date = msg['Date']
+    transaction_id = transaction_id_for(email_from, email_to, email_subject, email_sent_date)
+    return {
+        "file": file,
+        "transaction_id": transaction_id,
+        "email_from": email_from,
+        "email_to": email_to,
+        "email_to_list": [address for _, address in getaddresses([email_to])] if email_to else [],
+        "email_subject": email_subject,
+        "email_sent_date": email_sent_date,
+        "sent_at": parse_sent_at(email_sent_date),
+        "email_body": message_body(msg),
+        "bucket": bucket_for(transaction_id),
+    }
+
+
+# Written once every part is in place, so a half-staged dataset isn't mistaken for a complete one.
+# It holds the staging format, so a dataset staged before the bucket column existed is staged again.
+STAGED_MARKER = "_SUCCESS"
+STAGING_FORMAT = "bucketed-1"
+
+
+def is_staged(dataset_dir):
+    try:
+        with open(os.path.join(dataset_dir, STAGED_MARKER)) as marker:
+            return marker.read().strip() == STAGING_FORMAT
+    except FileNotFoundError:
+        return False
+
+
+def _stage_part(dataset_dir, part, messages, files):
+    rows = []
+    for message, file in zip(messages, files):
+        if not isinstance(message, str):
+            continue
+        try:
+            rows.append(parse_message(message, file))
+        except Exception as e:
+            # One malformed message shouldn't lose the rest of its chunk
+            logging.warning(f"Skipping message {transaction_id_of(message)} (file {file}, part {part}): {e}")
+    rows.sort(key=lambda row: row["bucket"])
+    table = pa.Table.from_pylist(rows, schema=EMAIL_SCHEMA)
+    # Written under a dot-prefixed name (which the dataset reader skips) and renamed when complete
+    name = f"part-{part:05d}.parquet"
+    pq.write_table(table, os.path.join(dataset_dir, "." + name), row_group_size=ROW_GROUP_SIZE)
+    os.replace(os.path.join(dataset_dir, "." + name), os.path.join(dataset_dir, name))
+    return len(rows)
+
+
+def stage_emails(csv_path, dataset_dir, chunksize=10000, workers=1, **read_csv_kwargs):
+    """Streams emails.csv in chunks and writes each parsed chunk as one Parquet part file.
+
+    With `workers` > 1 the chunks are parsed and written by a process pool,
+    with at most two chunks per worker in flight; otherwise only one chunk of
+    raw messages is held in memory at a time. Extra keyword arguments (e.g.
+    nrows, skiprows) are passed through to `pd.read_csv`. Returns the number
+    of staged messages.
+    """
+    os.makedirs(dataset_dir, exist_ok=True)
+    for name in os.listdir(dataset_dir):
+        if name.endswith(".parquet") or name == STAGED_MARKER:
+            os.remove(os.path.join(dataset_dir, name))
+    chunks = pd.read_csv(csv_path, chunksize=chunksize, **read_csv_kwargs)
+    staged = 0
+    if workers <= 1:
+        for part, chunk in enumerate(chunks):
+            files = chunk['file'] if 'file' in chunk else [None] * len(chunk)
+            staged += _stage_part(dataset_dir, part, chunk['message'], files)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            for part, chunk in enumerate(chunks):
+                files = list(chunk['file']) if 'file' in chunk else [None] * len(chunk)
+                pending.add(pool.submit(_stage_part, dataset_dir, part, list(chunk['message']), files))
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    staged += sum(future.result() for future in done)
+            staged += sum(future.result() for future in pending)
+    with open(os.path.join(dataset_dir, STAGED_MARKER), "w") as marker:
+        marker.write(STAGING_FORMAT)
+    return staged
+
+
+def iter_staged_batches(dataset_dir, batch_size=1000, columns=None, filter=None):
+    """Yields pyarrow RecordBatches from the staging dataset, optionally only the rows matching `filter`."""
+    dataset = ds.dataset(dataset_dir, format="parquet", schema=EMAIL_SCHEMA)
+    yield from dataset.to_batches(batch_size=batch_size, columns=columns, filter=filter)
+
+
+def iter_staged_emails(dataset_dir, batch_size=1000, columns=None, shard=None, shards=1):
+    """Yields one dict per staged email, reading the dataset a record batch at a time.
+
+    With `shard`, only the emails whose transaction_id falls in that shard
+    (see shard_for) are read, through a filter on the staged bucket column.
+    """
+    filter = shard_filter(shard, shards) if shard is not None else None
+    for batch in iter_staged_batches(dataset_dir, batch_size, columns, filter):
+        yield from batch.to_pylist()
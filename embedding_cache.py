@@ -0,0 +1,138 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+
+# SQLite caps the number of host parameters per statement
+LOOKUP_BATCH = 500
+# Recency updates from reads are held until the next write, or until this many are pending
+TOUCH_BATCH = 10000
+
+
+def cache_key(model, text):
+    return hashlib.sha256(f"{model}\0{text}".encode()).hexdigest()
+
+
+def pack_vector(values):
+    return array('f', values).tobytes()
+
+
+def unpack_vector(blob):
+    values = array('f')
+    values.frombytes(blob)
+    return values.tolist()
+
+
+class EmbeddingCache:
+    """On-disk embedding cache keyed by a hash of (model, text).
+
+    Vectors are stored as float32 blobs in SQLite. Once the stored vectors
+    exceed `max_bytes`, the least recently used entries are evicted until the
+    cache is back under `evict_to` of the cap. Reads don't write: the keys
+    they hit are marked recently used along with the next `put_many` (before
+    anything is evicted), or on close.
+
+    The stored size is kept in the database next to the vectors, so sharded
+    worker processes sharing the file hold it to one `max_bytes` between them.
+    """
+
+    def __init__(self, path, max_bytes=1024 ** 3, evict_to=0.9):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evict_to = evict_to
+        self.lock = threading.Lock()
+        self.touched = {}
+        # The timeout lets sharded worker processes wait for each other's writes
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        # One row holding SUM(size), updated in the same transaction as the vectors
+        self.conn.execute("CREATE TABLE IF NOT EXISTS stored_bytes (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL)")
+        self.conn.execute("INSERT OR IGNORE INTO stored_bytes SELECT 0, COALESCE(SUM(size), 0) FROM embeddings")
+        self.conn.commit()
+        self.total_bytes = self._stored_bytes()
+
+    def get_many(self, keys):
+        """Returns {key: vector} for every key found, and marks them as recently used."""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        now = time.time()
+        with self.lock:
+            for start in range(0, len(keys), LOOKUP_BATCH):
+                batch = keys[start:start + LOOKUP_BATCH]
+                placeholders = ','.join('?' * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = unpack_vector(blob)
+                    self.touched[key] = now
+            if len(self.touched) >= TOUCH_BATCH:
+                self._write_touched()
+                self.conn.commit()
+        return found
+
+    def _stored_bytes(self):
+        return self.conn.execute("SELECT total FROM stored_bytes").fetchone()[0]
+
+    def _write_touched(self):
+        self.conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                              [(used, key) for key, used in self.touched.items()])
+        self.touched = {}
+
+    def put_many(self, items):
+        """Stores an iterable of (key, vector) pairs."""
+        now = time.time()
+        rows = [(key, pack_vector(vector), now) for key, vector in dict(items).items()]
+        if not rows:
+            return
+        with self.lock:
+            # Taking the write lock first keeps other processes from changing the size until the commit
+            if not self.conn.in_transaction:
+                self.conn.execute("BEGIN IMMEDIATE")
+            self._write_touched()
+            keys = [key for key, _, _ in rows]
+            replaced = 0
+            for start in range(0, len(keys), LOOKUP_BATCH):
+                batch = keys[start:start + LOOKUP_BATCH]
+                replaced += self.conn.execute(
+                    f"SELECT COALESCE(SUM(size), 0) FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchone()[0]
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, size, last_used) VALUES (?, ?, ?, ?)",
+                [(key, blob, len(blob), used) for key, blob, used in rows],
+            )
+            self.conn.execute("UPDATE stored_bytes SET total = total + ?",
+                              (sum(len(blob) for _, blob, _ in rows) - replaced,))
+            self.total_bytes = self._stored_bytes()
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        target = self.max_bytes * self.evict_to
+        cursor = self.conn.execute("SELECT key, size FROM embeddings ORDER BY last_used")
+        evicted = []
+        for key, size in cursor:
+            if self.total_bytes <= target:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+        cursor.close()
+        self.conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+        self.conn.execute("UPDATE stored_bytes SET total = ?", (self.total_bytes,))
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self._write_touched()
+            self.conn.commit()
+            self.conn.close()
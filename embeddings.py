@@ -0,0 +1,110 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+from embedding_cache import cache_key
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+
+def is_retryable(error):
+    # Rate limits, timeouts, dropped connections and server errors can pass;
+    # a bad request (e.g. an input over the token limit) fails the same way every time
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def estimate_tokens(text):
+    # Rough count (~4 characters per token) that is good enough for packing requests
+    return max(1, (len(text) + 3) // 4)
+
+
+class EmbeddingBatcher:
+    """Embeds many texts with as few `client.embeddings.create` calls as possible.
+
+    Texts are packed in order into requests of at most `max_inputs` inputs and
+    `max_tokens` estimated tokens. Up to `max_concurrency` requests run at once,
+    across every thread calling `embed`, and a request failing with a rate limit, timeout or server error is retried
+    on its own with exponential backoff, so one bad batch doesn't resend the
+    others; other errors are raised right away. Results come back in input order.
+
+    With a `cache` (see EmbeddingCache), all texts are looked up in bulk first
+    and only the misses are sent to the API.
+    """
+
+    def __init__(self, client, model=EMBEDDING_MODEL, max_inputs=512, max_tokens=100_000,
+                 max_concurrency=4, max_retries=5, backoff=1.0, count_tokens=estimate_tokens, cache=None):
+        self.client = client
+        self.model = model
+        self.max_inputs = max_inputs
+        self.max_tokens = max_tokens
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.count_tokens = count_tokens
+        self.cache = cache
+        # Shared by all callers, so concurrent embed() calls stay under max_concurrency requests together
+        self.slots = threading.BoundedSemaphore(max(1, max_concurrency))
+
+    def pack(self, texts):
+        """Splits `texts` into consecutive (start, end) ranges that fit one request."""
+        batches = []
+        start = 0
+        tokens = 0
+        for i, text in enumerate(texts):
+            text_tokens = self.count_tokens(text)
+            if i > start and (i - start >= self.max_inputs or tokens + text_tokens > self.max_tokens):
+                batches.append((start, i))
+                start = i
+                tokens = 0
+            tokens += text_tokens
+        if start < len(texts):
+            batches.append((start, len(texts)))
+        return batches
+
+    def _embed_batch(self, texts):
+        attempt = 0
+        while True:
+            try:
+                # The slot is held for the request only, not while backing off
+                with self.slots:
+                    response = self.client.embeddings.create(input=texts, model=self.model)
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries or not is_retryable(e):
+                    raise
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+    def embed(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        if self.cache is None:
+            return self._embed_all(texts)
+
+        keys = [cache_key(self.model, text) for text in texts]
+        cached = self.cache.get_many(keys)
+        # Embed each missing text once, even if it repeats within the input
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            embedded = self._embed_all(list(missing.values()))
+            fresh = dict(zip(missing.keys(), embedded))
+            self.cache.put_many(fresh.items())
+            cached.update(fresh)
+        return [cached[key] for key in keys]
+
+    def _embed_all(self, texts):
+        batches = self.pack(texts)
+        if len(batches) == 1 or self.max_concurrency <= 1:
+            results = [self._embed_batch(texts[start:end]) for start, end in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as pool:
+                results = list(pool.map(lambda batch: self._embed_batch(texts[batch[0]:batch[1]]), batches))
+        return [embedding for batch in results for embedding in batch]
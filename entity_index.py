@@ -0,0 +1,172 @@
+import functools
+import re
+import sqlite3
+import threading
+import unicodedata
+
+# Maps the surface forms NER finds ("Justice Scalia", "SCALIA, J.", "Antonin
+# Scalia's") onto one canonical entity per label, so each becomes a single
+# graph node. Exact forms are found with one dict lookup on the normalized
+# key; a bare or partial name ("Scalia", "Day O'Connor") is matched against
+# the known names ending in the same tokens, through a trie over reversed
+# name tokens, and only merged when exactly one entity matches.
+
+WORD = re.compile(r"[^\W_]+(?:['’][^\W_]+)*")
+POSSESSIVE = re.compile(r"['’]s\b", re.IGNORECASE)
+# Dropped from the front of person names, and "J."/"JJ."/"C. J." from the end
+PERSON_TITLES = {"justice", "justices", "chief", "associate", "judge", "mr", "mrs", "ms", "dr", "hon", "honorable",
+                 "the", "senator", "sen", "governor", "gov", "president", "professor", "prof"}
+PERSON_SUFFIXES = {"j", "jj", "c"}
+ORG_SUFFIXES = {"inc", "corp", "corporation", "co", "company", "llc", "ltd"}
+FLUSH_EVERY = 500
+
+
+def name_tokens(text, label):
+    """Returns the tokens of `text` that identify the entity, in their original case."""
+    tokens = WORD.findall(POSSESSIVE.sub("", unicodedata.normalize("NFKC", text)))
+    lowered = [token.casefold() for token in tokens]
+    start, end = 0, len(tokens)
+    if label == "PER":
+        while start < end - 1 and lowered[start] in PERSON_TITLES:
+            start += 1
+        while end > start + 1 and lowered[end - 1] in PERSON_SUFFIXES:
+            end -= 1
+    else:
+        if start < end - 1 and lowered[start] == "the":
+            start += 1
+        if label == "ORG":
+            while end > start + 1 and lowered[end - 1] in ORG_SUFFIXES:
+                end -= 1
+    return tokens[start:end]
+
+
+# Mentions repeat heavily across opinions, so normalized forms are cached
+@functools.lru_cache(maxsize=1 << 16)
+def normalize(text, label):
+    return " ".join(token.casefold() for token in name_tokens(text, label))
+
+
+def display_name(text, label):
+    # The text as written, unless titles, suffixes or a possessive were dropped from it
+    tokens = name_tokens(text, label)
+    name = " ".join(text.split()) if tokens == WORD.findall(unicodedata.normalize("NFKC", text)) else " ".join(tokens)
+    return name.title() if name.isupper() else name
+
+
+class SuffixTrie:
+    """Trie over reversed name tokens; each node holds the ids of the names ending in its path."""
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, tokens, entity_id):
+        node = self.root
+        for token in reversed(tokens):
+            node = node.setdefault(token, {})
+            # None can't collide with a token, so it holds the node's ids
+            node.setdefault(None, set()).add(entity_id)
+
+    def matches(self, tokens):
+        node = self.root
+        for token in reversed(tokens):
+            node = node.get(token)
+            if node is None:
+                return set()
+        return node.get(None, set())
+
+
+class EntityIndex:
+    """Persistent dictionary from (label, surface form) to a canonical entity id and name.
+
+    Every normalized form seen is stored in SQLite with the entity it
+    resolved to, so later runs resolve the same way. A new person name is
+    merged into an existing entity when its tokens end a single known name
+    ("Scalia" into "Antonin Scalia"), or when it extends a bare surname that
+    hasn't been extended before ("Antonin Scalia" into an earlier "Scalia").
+    Other labels merge only on equal normalized forms.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.canonical_keys = {}
+        self.extended = set()
+        self.tries = {}
+        self.pending = []
+        self.lookups = 0
+        self.aliased = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entities ("
+            "label TEXT NOT NULL, key TEXT NOT NULL, entity_id TEXT NOT NULL, name TEXT NOT NULL, "
+            "PRIMARY KEY (label, key))"
+        )
+        self.conn.commit()
+        for label, key, entity_id, name in self.conn.execute("SELECT label, key, entity_id, name FROM entities"):
+            self._remember(label, key, entity_id, name)
+        for (label, key), (entity_id, _) in self.entries.items():
+            # Bare surnames that a full name was already merged into
+            if len(key.split()) > 1 and len(self.canonical_keys.get((label, entity_id), key).split()) == 1:
+                self.extended.add((label, entity_id))
+
+    def _remember(self, label, key, entity_id, name):
+        self.entries[(label, key)] = (entity_id, name)
+        if label == "PER":
+            self.tries.setdefault(label, SuffixTrie()).add(key.split(), entity_id)
+        if normalize(name, label) == key:
+            self.canonical_keys[(label, entity_id)] = key
+
+    def _resolve(self, label, key):
+        tokens = key.split()
+        if label == "PER":
+            trie = self.tries.setdefault(label, SuffixTrie())
+            found = trie.matches(tokens)
+            if len(found) == 1:
+                return self._entry(label, next(iter(found)))
+            surname = self.entries.get((label, tokens[-1]))
+            if not found and len(tokens) > 1 and surname and (label, surname[0]) not in self.extended \
+                    and len(trie.matches(tokens[-1:])) == 1:
+                self.extended.add((label, surname[0]))
+                return surname
+        return None
+
+    def _entry(self, label, entity_id):
+        return entity_id, self.entries[(label, self.canonical_keys[(label, entity_id)])][1]
+
+    def canonical(self, text, label):
+        """Returns (entity id, display name) for a surface form of an entity with the given NER label."""
+        key = normalize(text, label)
+        if not key:
+            return text, text
+        with self.lock:
+            self.lookups += 1
+            entry = self.entries.get((label, key))
+            if entry is not None:
+                return entry
+            entry = self._resolve(label, key)
+            if entry is None:
+                name = display_name(text, label)
+                entry = (name, name)
+            else:
+                self.aliased += 1
+            self._remember(label, key, *entry)
+            self.pending.append((label, key) + entry)
+            if len(self.pending) >= FLUSH_EVERY:
+                self._flush()
+            return entry
+
+    def _flush(self):
+        self.conn.executemany("INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?)", self.pending)
+        self.conn.commit()
+        self.pending = []
+
+    def __len__(self):
+        with self.lock:
+            return len(self.canonical_keys)
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.conn.close()
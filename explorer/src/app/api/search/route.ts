@@ -65,7 +65,12 @@ export async function POST(req: NextRequest) {
   });
 
 
-  const caseIds = matches.map((match: ScoredPineconeRecord<MatchMetadata>) => match.metadata?.case_id !== undefined ? parseInt(match.metadata.case_id) : undefined);  
+  // A match stands in for its near duplicates too, so their cases follow the match's own case
+  const caseIds = [...new Set(matches.flatMap((match: ScoredPineconeRecord<MatchMetadata>) =>
+    match.metadata?.case_id !== undefined
+      ? [match.metadata.case_id, ...(match.metadata.duplicate_case_ids ?? [])].map((caseId) => parseInt(caseId))
+      : []
+  ))];
 
   let cases;
   try {
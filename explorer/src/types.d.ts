@@ -1,6 +1,8 @@
 export type MatchMetadata = {
   case_id: string;
   chunk: string;
+  // Cases with a near-duplicate chunk that was not embedded separately
+  duplicate_case_ids?: string[];
 };
 
 
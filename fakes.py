@@ -0,0 +1,430 @@
+import hashlib
+import math
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+# In-memory stand-ins for the Neo4j driver, a Pinecone index, the OpenAI
+# client and tokenizer, the flair models, Mongo and the Oyez/Justia sites, so
+# the ingest and fetch code can run without any of the live services (see
+# benchmark.py).
+
+EMBEDDING_DIMENSIONS = 1536
+
+
+class RecordingResult:
+    def __init__(self, records=None):
+        self.records = records or []
+
+    def consume(self):
+        return self
+
+    def single(self):
+        return self.records[0] if self.records else None
+
+    def data(self):
+        return list(self.records)
+
+
+class RecordingSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def run(self, query, parameters=None, **kwargs):
+        return self.driver.record(query, {**(parameters or {}), **kwargs})
+
+    def execute_write(self, fn, *args, **kwargs):
+        return fn(self, *args, **kwargs)
+
+    execute_read = execute_write
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class RecordingDriver:
+    """Neo4j driver stand-in that records every statement instead of running it.
+
+    `statements` holds (query, parameters) pairs; `rows` counts UNWIND rows so
+    batched and single-row writes can be compared. Every statement sleeps for
+    `latency` seconds plus `row_latency` per row.
+    """
+
+    def __init__(self, latency=0.0, row_latency=0.0, keep_statements=True):
+        self.latency = latency
+        self.row_latency = row_latency
+        self.keep_statements = keep_statements
+        self.statements = []
+        self.statement_count = 0
+        self.rows = 0
+        self.lock = threading.Lock()
+
+    def record(self, query, parameters):
+        rows = len(parameters.get("rows", [])) or 1
+        if self.latency or self.row_latency:
+            time.sleep(self.latency + self.row_latency * rows)
+        with self.lock:
+            self.statement_count += 1
+            self.rows += rows
+            if self.keep_statements:
+                self.statements.append((query, parameters))
+        if query.strip() == "RETURN 1":
+            return RecordingResult([[1]])
+        return RecordingResult()
+
+    def session(self, **kwargs):
+        return RecordingSession(self)
+
+    def close(self):
+        pass
+
+
+class MemoryIndex:
+    """Pinecone index stand-in holding vectors in a dict.
+
+    Supports `upsert`, `update`, `fetch` and a brute-force `query`, which is enough for
+    UpsertSink and for reading results back after a run.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.vectors = {}
+        self.upsert_calls = 0
+        self.lock = threading.Lock()
+
+    def upsert(self, vectors, namespace=None):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.upsert_calls += 1
+            for vector_id, values, metadata in vectors:
+                self.vectors[vector_id] = (list(values), dict(metadata or {}))
+        return {"upserted_count": len(vectors)}
+
+    def update(self, id, set_metadata=None, values=None, namespace=None):
+        with self.lock:
+            if id not in self.vectors:
+                return {}
+            stored_values, metadata = self.vectors[id]
+            metadata.update(set_metadata or {})
+            self.vectors[id] = (list(values) if values is not None else stored_values, metadata)
+        return {}
+
+    def fetch(self, ids, namespace=None):
+        with self.lock:
+            found = {vector_id: self.vectors[vector_id] for vector_id in ids if vector_id in self.vectors}
+        return {"vectors": {vector_id: {"id": vector_id, "values": values, "metadata": metadata}
+                            for vector_id, (values, metadata) in found.items()}}
+
+    def query(self, vector, top_k=10, filter=None, include_metadata=False, include_values=False, namespace=None):
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        with self.lock:
+            items = list(self.vectors.items())
+        scored = []
+        for vector_id, (values, metadata) in items:
+            if filter and any(metadata.get(key) != value for key, value in filter.items()):
+                continue
+            other = math.sqrt(sum(value * value for value in values)) or 1.0
+            score = sum(a * b for a, b in zip(vector, values)) / (norm * other)
+            scored.append((score, vector_id, values, metadata))
+        scored.sort(key=lambda match: match[0], reverse=True)
+        return {"matches": [
+            {"id": vector_id, "score": score,
+             **({"metadata": metadata} if include_metadata else {}),
+             **({"values": values} if include_values else {})}
+            for score, vector_id, values, metadata in scored[:top_k]
+        ]}
+
+    def __len__(self):
+        return len(self.vectors)
+
+
+def fake_embedding(text, dimensions=EMBEDDING_DIMENSIONS):
+    # Deterministic per text, so cache hits and repeated runs behave like the real API
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "big")
+    rng = random.Random(seed)
+    return [rng.uniform(-1.0, 1.0) for _ in range(dimensions)]
+
+
+class FakeEmbeddings:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, input, model=None):
+        texts = [input] if isinstance(input, str) else list(input)
+        with self.owner.lock:
+            self.owner.requests += 1
+            self.owner.inputs += len(texts)
+        delay = self.owner.latency + self.owner.input_latency * len(texts)
+        if delay:
+            time.sleep(delay)
+        return SimpleNamespace(data=[
+            SimpleNamespace(index=i, embedding=fake_embedding(text, self.owner.dimensions))
+            for i, text in enumerate(texts)
+        ])
+
+
+class FakeOpenAI:
+    """OpenAI client stand-in whose `embeddings.create` returns deterministic vectors.
+
+    Each request sleeps `latency` seconds plus `input_latency` per input.
+    """
+
+    def __init__(self, latency=0.0, input_latency=0.0, dimensions=EMBEDDING_DIMENSIONS):
+        self.latency = latency
+        self.input_latency = input_latency
+        self.dimensions = dimensions
+        self.requests = 0
+        self.inputs = 0
+        self.lock = threading.Lock()
+        self.embeddings = FakeEmbeddings(self)
+
+
+class WordEncoding:
+    """tiktoken stand-in that makes every word, with the whitespace before it, one token.
+
+    It needs no download, so chunking can run offline; as cl100k_base
+    splits longer words into several tokens, its chunks hold a little less text.
+    """
+
+    PIECE = re.compile(r"\s*\S+|\s+")
+
+    def __init__(self):
+        self.pieces = []
+        self.ids = {}
+        self.lock = threading.Lock()
+
+    def encode(self, text, disallowed_special=()):
+        tokens = []
+        with self.lock:
+            for piece in self.PIECE.findall(text):
+                if piece not in self.ids:
+                    self.ids[piece] = len(self.pieces)
+                    self.pieces.append(piece)
+                tokens.append(self.ids[piece])
+        return tokens
+
+    def decode_with_offsets(self, tokens):
+        pieces = [self.pieces[token] for token in tokens]
+        offsets = []
+        position = 0
+        for piece in pieces:
+            offsets.append(position)
+            position += len(piece)
+        return "".join(pieces), offsets
+
+
+class FakeTagger:
+    """NER tagger stand-in: tags every capitalized token after the first as a PER/ORG/LOC span."""
+
+    LABELS = ("PER", "ORG", "LOC")
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def predict(self, sentences, mini_batch_size=32):
+        if self.latency:
+            time.sleep(self.latency * len(sentences))
+        for sentence in sentences:
+            for i, token in enumerate(sentence):
+                if i and token.text[:1].isupper():
+                    label = self.LABELS[len(token.text) % len(self.LABELS)]
+                    sentence[i:i + 1].add_label('ner', label)
+
+
+class FakeExtractor:
+    """Relation extractor stand-in: relates consecutive entities of each sentence."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def predict(self, sentences, mini_batch_size=32):
+        from flair.data import Relation
+        if self.latency:
+            time.sleep(self.latency * len(sentences))
+        for sentence in sentences:
+            spans = sentence.get_spans('ner')
+            for first, second in zip(spans, spans[1:]):
+                Relation(first, second).add_label('relation', 'related_to')
+
+
+class MemoryCollection:
+    """Mongo collection stand-in with the calls the fetcher uses.
+
+    Filters support plain equality and {"$exists": bool}; updates support
+    "$set". bulk_write applies InsertOne and UpdateOne operations, and also
+    records them in `bulk_operations`, in order, to compare with `==`.
+    """
+
+    def __init__(self):
+        self.documents = []
+        self.bulk_operations = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _matches(document, filter):
+        for key, condition in (filter or {}).items():
+            if isinstance(condition, dict) and "$exists" in condition:
+                if (key in document) != bool(condition["$exists"]):
+                    return False
+            elif document.get(key) != condition:
+                return False
+        return True
+
+    @staticmethod
+    def _project(document, projection):
+        if not projection:
+            return dict(document)
+        included = {key for key, value in projection.items() if value}
+        projected = {key: value for key, value in document.items() if key in included}
+        if projection.get("_id", 1) and "_id" in document:
+            projected["_id"] = document["_id"]
+        return projected
+
+    def insert_many(self, documents, ordered=True):
+        with self.lock:
+            for document in documents:
+                document.setdefault("_id", len(self.documents) + 1)
+                self.documents.append(dict(document))
+        return SimpleNamespace(inserted_ids=[document["_id"] for document in documents])
+
+    def insert_one(self, document):
+        return self.insert_many([document])
+
+    def _update_one(self, filter, update, upsert):
+        fields = update["$set"]
+        for document in self.documents:
+            if self._matches(document, filter):
+                document.update(fields)
+                return
+        if upsert:
+            document = {key: value for key, value in filter.items() if not isinstance(value, dict)}
+            document.update(fields)
+            document.setdefault("_id", len(self.documents) + 1)
+            self.documents.append(document)
+
+    def update_one(self, filter, update, upsert=False):
+        with self.lock:
+            self._update_one(filter, update, upsert)
+
+    def bulk_write(self, operations, ordered=True):
+        # pymongo's write models keep their fields private and hand them to a
+        # bulk object through add_insert/add_update, as Collection.bulk_write does
+        collection = self
+
+        class Bulk:
+            def add_insert(self, document):
+                document.setdefault("_id", len(collection.documents) + 1)
+                collection.documents.append(dict(document))
+
+            def add_update(self, filter, update, multi, upsert, **kwargs):
+                if multi:
+                    raise NotImplementedError("MemoryCollection applies UpdateOne only")
+                collection._update_one(filter, update, upsert)
+
+        with self.lock:
+            for operation in operations:
+                operation._add_to_bulk(Bulk())
+                self.bulk_operations.append(operation)
+        return SimpleNamespace(acknowledged=True)
+
+    def find(self, filter=None, projection=None):
+        with self.lock:
+            matched = [document for document in self.documents if self._matches(document, filter)]
+        return iter([self._project(document, projection) for document in matched])
+
+    def find_one(self, filter=None, projection=None):
+        return next(self.find(filter, projection), None)
+
+    def count_documents(self, filter):
+        return sum(1 for _ in self.find(filter))
+
+
+class MemoryDatabase:
+    """Mongo database stand-in; collections are created on first access."""
+
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = MemoryCollection()
+        return self.collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+
+class StubHTTPServer:
+    """Local HTTP server serving fixed pages, for exercising the fetcher offline.
+
+    `pages` maps a path (with query string) to (body bytes, etag). Requests
+    carrying a matching If-None-Match get a 304; `headers` holds the headers
+    of every request, alongside its path in `requests`. `failures` maps a path to the
+    number of 503s to return before serving it. Served on 127.0.0.1 at a free
+    port; `url(path)` builds the full address.
+    """
+
+    def __init__(self, pages, failures=None):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        stub = self
+        self.pages = pages
+        self.failures = dict(failures or {})
+        self.requests = []
+        self.headers = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests.append(self.path)
+                stub.headers.append(dict(self.headers))
+                if stub.failures.get(self.path, 0) > 0:
+                    stub.failures[self.path] -= 1
+                    self.send_response(503)
+                    self.send_header("Retry-After", "0")
+                    self.end_headers()
+                    return
+                if self.path not in stub.pages:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body, etag = stub.pages[self.path]
+                if etag and self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                if etag:
+                    self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server.server_address[1]}{path}"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,393 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+import aiohttp
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+from pipeline import Pipeline, Stage
+from html_markdown import html_to_markdown, convert_many
+
+# Fetches the raw Oyez/Justia data into Mongo (what process_raw.ipynb does
+# one request at a time): case lists per term, case details and opinion pages.
+
+OYEZ_TERM_URL = "https://api.oyez.org/cases?per_page=0&filter=term:{year}"
+# Statuses worth retrying; anything else is returned to the caller as is
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class FetchResult:
+    __slots__ = ('url', 'status', 'body', 'etag', 'last_modified')
+
+    def __init__(self, url, status, body, etag=None, last_modified=None):
+        self.url = url
+        self.status = status
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def ok(self):
+        return self.status == 200
+
+    @property
+    def not_modified(self):
+        return self.status == 304
+
+    def text(self):
+        return self.body.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` requests per second with bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Fetcher:
+    """Async HTTP GETs over one pooled session, rate-limited per host.
+
+    At most `concurrency` connections are open, `per_host` to any one host,
+    and each host gets its own `rate` requests/second. Connection errors,
+    timeouts and RETRY_STATUSES are retried up to `max_retries` times with
+    jittered exponential backoff, honouring Retry-After. Passing the `etag` /
+    `last_modified` of a previous fetch makes the request conditional, and an
+    unchanged page comes back as a 304 result without a body.
+    """
+
+    def __init__(self, concurrency=16, per_host=8, rate=10.0, max_retries=5, backoff=1.0, timeout=60.0):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.rate = rate
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiters = {}
+        self.session = None
+        self.requests = 0
+        self.retries = 0
+        self.not_modified = 0
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.session.close()
+
+    def limiter(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.limiters:
+            self.limiters[host] = RateLimiter(self.rate)
+        return self.limiters[host]
+
+    def _delay(self, attempt, retry_after=None):
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
+    async def fetch(self, url, etag=None, last_modified=None):
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        attempt = 0
+        while True:
+            await self.limiter(url).acquire()
+            self.requests += 1
+            try:
+                async with self.session.get(url, headers=headers) as response:
+                    if response.status == 304:
+                        self.not_modified += 1
+                        return FetchResult(url, 304, None, etag, last_modified)
+                    if response.status in RETRY_STATUSES and attempt < self.max_retries:
+                        delay = self._delay(attempt, response.headers.get("Retry-After"))
+                    else:
+                        body = await response.read()
+                        return FetchResult(url, response.status, body,
+                                           response.headers.get("ETag"), response.headers.get("Last-Modified"))
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._delay(attempt)
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+
+class MongoBuffer:
+    """Buffers documents and writes them `batch_size` at a time.
+
+    With a `key`, documents are upserted on that field through one unordered
+    bulk_write; without one they go through insert_many. Safe to share
+    between threads.
+    """
+
+    def __init__(self, collection, key=None, batch_size=500):
+        self.collection = collection
+        self.key = key
+        self.batch_size = batch_size
+        self.documents = []
+        self.written = 0
+        self.lock = threading.Lock()
+
+    def add(self, document):
+        with self.lock:
+            self.documents.append(document)
+            if len(self.documents) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        documents, self.documents = self.documents, []
+        if not documents:
+            return
+        if self.key:
+            self.collection.bulk_write(
+                [UpdateOne({self.key: document[self.key]}, {"$set": document}, upsert=True) for document in documents],
+                ordered=False,
+            )
+        else:
+            self.collection.insert_many(documents, ordered=False)
+        self.written += len(documents)
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+
+def known_validators(collection, key):
+    """Returns {key value: (etag, last_modified)} for documents fetched before."""
+    cursor = collection.find({key: {"$exists": True}}, {key: 1, "etag": 1, "last_modified": 1, "_id": 0})
+    return {document[key]: (document.get("etag"), document.get("last_modified")) for document in cursor}
+
+
+###########################
+# Crawls                  #
+###########################
+# Each crawl is a Pipeline: an async fetch stage with `concurrency` workers
+# feeding a store stage that buffers the Mongo writes.
+
+async def run_crawl(fetch, store, source, fetcher, buffers):
+    pipeline = Pipeline([
+        Stage("fetch", fetch, concurrency=fetcher.concurrency),
+        Stage("store", store),
+    ], queue_size=fetcher.concurrency * 4)
+    stats = await pipeline.run(source)
+    for buffer in buffers:
+        buffer.flush()
+    return stats
+
+
+async def crawl_terms(fetcher, db, years):
+    """Fetches the case list of every term in `years` into db.cases, upserted on ID."""
+    cases = MongoBuffer(db.cases, key="ID")
+
+    async def fetch(year):
+        result = await fetcher.fetch(OYEZ_TERM_URL.format(year=year))
+        if not result.ok:
+            logging.warning(f"Failed to fetch data for year {year}: {result.status}")
+            return None
+        return result
+
+    def store(result):
+        for case in result.json():
+            cases.add(case)
+
+    return await run_crawl(fetch, store, years, fetcher, [cases])
+
+
+async def crawl_cases(fetcher, db):
+    """Fetches every case href into db.expanded_cases and its parsed JSON into db.processed_cases.
+
+    Both are upserted on href; a case whose page hasn't changed since the
+    last crawl is skipped.
+    """
+    validators = known_validators(db.expanded_cases, "href")
+    expanded = MongoBuffer(db.expanded_cases, key="href")
+    processed = MongoBuffer(db.processed_cases, key="href")
+
+    def source():
+        for document in db.cases.find({}, {"href": 1}):
+            if document.get("href"):
+                yield document
+
+    async def fetch(document):
+        href = document["href"]
+        result = await fetcher.fetch(href, *validators.get(href, (None, None)))
+        if not result.ok:
+            if not result.not_modified:
+                logging.warning(f"Failed to fetch href {href}: {result.status}")
+            return None
+        return document, result
+
+    def store(item):
+        document, result = item
+        data = result.text()
+        expanded.add({
+            "href": result.url,
+            "data": data,
+            "original_id": document.get("_id"),
+            "etag": result.etag,
+            "last_modified": result.last_modified,
+        })
+        try:
+            parsed_data = json.loads(data)
+        except json.JSONDecodeError as e:
+            logging.warning(f"Error parsing data for href {result.url}: {e}")
+            return
+        parsed_data["href"] = result.url
+        processed.add(parsed_data)
+
+    return await run_crawl(fetch, store, source(), fetcher, [expanded, processed])
+
+
+def opinion_document(page, content):
+    return {key: page[key] for key in ("id", "case_id", "title", "url")} | {"content": content}
+
+
+async def crawl_opinions(fetcher, db, convert=html_to_markdown):
+    """Fetches every Justia opinion of db.processed_cases.
+
+    The raw page goes to db.opinion_pages, so it can be reconverted later
+    without refetching (see convert_pages), and its markdown to db.opinions;
+    both are upserted on id. With `convert=None` only the pages are stored.
+    """
+    validators = known_validators(db.opinion_pages, "url")
+    pages = MongoBuffer(db.opinion_pages, key="id")
+    opinions = MongoBuffer(db.opinions, key="id")
+
+    def source():
+        for document in db.processed_cases.find({}, {"ID": 1, "written_opinion": 1}):
+            for opinion in document.get("written_opinion") or []:
+                if opinion and opinion.get("justia_opinion_url") and opinion.get("id") and opinion.get("title"):
+                    yield {
+                        "id": opinion["id"],
+                        "case_id": document.get("ID"),
+                        "title": opinion["title"],
+                        "url": opinion["justia_opinion_url"],
+                    }
+
+    async def fetch(opinion):
+        result = await fetcher.fetch(opinion["url"], *validators.get(opinion["url"], (None, None)))
+        if not result.ok:
+            if not result.not_modified:
+                logging.warning(f"Failed to fetch the URL {opinion['url']}: {result.status}")
+            return None
+        return opinion, result
+
+    def store(item):
+        opinion, result = item
+        page = {**opinion, "html": result.text(), "etag": result.etag, "last_modified": result.last_modified}
+        pages.add(page)
+        if convert is None:
+            return
+        content = convert(page["html"])
+        if content is None:
+            logging.warning(f"No primary content found in {opinion['url']}")
+            return
+        opinions.add(opinion_document(page, content))
+
+    return await run_crawl(fetch, store, source(), fetcher, [pages, opinions])
+
+
+def convert_pages(db, workers=None, batch_size=32):
+    """Reconverts every stored page in db.opinion_pages into db.opinions over a process pool."""
+    opinions = MongoBuffer(db.opinions, key="id")
+    # Only the html crosses into the workers; the rest of each page stays here
+    pending = {}
+
+    def html_pages():
+        for page in db.opinion_pages.find({}, {"id": 1, "case_id": 1, "title": 1, "url": 1, "html": 1}):
+            html = page.pop("html", None)
+            pending[page["id"]] = page
+            yield page["id"], html
+
+    converted = 0
+    for opinion_id, content in convert_many(html_pages(), workers, batch_size):
+        page = pending.pop(opinion_id)
+        if content is None:
+            logging.warning(f"No primary content found in {page['url']}")
+            continue
+        opinions.add(opinion_document(page, content))
+        converted += 1
+    opinions.flush()
+    return converted
+
+
+###########################
+# Main                    #
+###########################
+
+def mongo_database():
+    load_dotenv()
+    MONGODB_USERNAME = os.getenv('MONGODB_USERNAME')
+    MONGODB_PASSWORD = os.getenv('MONGODB_PASSWORD')
+    MONGODB_HOST = os.getenv('MONGODB_HOST')
+    MONGODB_DATABASE = os.getenv('MONGODB_DATABASE')
+
+    mongo_uri = f"mongodb+srv://{MONGODB_USERNAME}:{MONGODB_PASSWORD}@{MONGODB_HOST}/{MONGODB_DATABASE}?authSource=admin&replicaSet=db-mongo-graph-explorer"
+    client = MongoClient(mongo_uri)
+    return client, client[MONGODB_DATABASE]
+
+
+async def crawl(args, db):
+    async with Fetcher(args.concurrency, args.per_host, args.rate, args.max_retries) as fetcher:
+        if args.step == "terms":
+            stats = await crawl_terms(fetcher, db, range(args.start_year, args.end_year + 1))
+        elif args.step == "cases":
+            stats = await crawl_cases(fetcher, db)
+        else:
+            stats = await crawl_opinions(fetcher, db, None if args.no_convert else html_to_markdown)
+    logging.info(f"{args.step}: {stats}; {fetcher.requests} requests, {fetcher.retries} retries, "
+                 f"{fetcher.not_modified} not modified")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch raw Oyez/Justia data into Mongo")
+    parser.add_argument("step", choices=["terms", "cases", "opinions", "convert"],
+                        help="convert reconverts stored opinion pages without fetching")
+    parser.add_argument("--start-year", type=int, default=1990)
+    parser.add_argument("--end-year", type=int, default=2024)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--per-host", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=10.0, help="requests per second per host")
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--no-convert", action="store_true", help="opinions: only store the fetched pages")
+    parser.add_argument("--workers", type=int, help="convert: worker processes (default: one per core)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    client, db = mongo_database()
+    if args.step == "convert":
+        logging.info(f"Converted {convert_pages(db, args.workers)} opinion pages")
+    else:
+        asyncio.run(crawl(args, db))
+    client.close()
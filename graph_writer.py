@@ -0,0 +1,215 @@
+import logging
+import threading
+import time
+from functools import lru_cache
+
+from neo4j.exceptions import Neo4jError
+
+
+def quote_identifier(name):
+    # Labels, relationship types and property keys can't be passed as
+    # parameters, so they are backtick-quoted instead of being inlined raw.
+    return "`" + str(name).replace("`", "``") + "`"
+
+
+# Queries only depend on the labels, relationship type and property keys, so
+# they are built once per combination and Neo4j can reuse the cached plan.
+@lru_cache(maxsize=None)
+def node_rows_query(label, property_keys):
+    # MERGE on id alone so it agrees with the uniqueness constraint on id
+    sets = ''.join([f" SET n.{quote_identifier(key)} = row.properties.{quote_identifier(key)}" for key in property_keys])
+    return (f"UNWIND $rows AS row "
+            f"MERGE (n:{quote_identifier(label)} {{id: row.id}}){sets}")
+
+
+def endpoint_pattern(variable, label, id_param):
+    label = f":{quote_identifier(label)}" if label else ""
+    return f"({variable}{label} {{id: row.{id_param}}})"
+
+
+@lru_cache(maxsize=None)
+def edge_rows_query(relationship_type, property_keys, increment_property, from_label=None, to_label=None):
+    props = ', '.join([f"{quote_identifier(key)}: row.properties.{quote_identifier(key)}" for key in property_keys])
+    counter = f"r.{quote_identifier(increment_property)}"
+    return (f"UNWIND $rows AS row "
+            f"MATCH {endpoint_pattern('a', from_label, 'from_id')} "
+            f"MATCH {endpoint_pattern('b', to_label, 'to_id')} "
+            f"MERGE (a)-[r:{quote_identifier(relationship_type)} {{{props}}}]->(b) "
+            f"ON CREATE SET {counter} = row.delta "
+            f"ON MATCH SET {counter} = {counter} + row.delta")
+
+
+def dedup_query(label, property_key):
+    # Keeps the first node of each duplicated value and moves the others' relationships onto it
+    return (f"MATCH (n:{quote_identifier(label)}) WITH n.{quote_identifier(property_key)} AS value, collect(n) AS nodes "
+            f"WHERE size(nodes) > 1 CALL apoc.refactor.mergeNodes(nodes, {{properties: 'discard', mergeRels: true}}) "
+            f"YIELD node RETURN count(node)")
+
+
+def ensure_constraints(driver, constraints):
+    """Creates a uniqueness constraint (and its backing index) for each (label, property) pair.
+
+    A constraint Neo4j refuses to create, usually because a graph written
+    before it existed already has duplicate nodes, is logged with the query
+    that merges them and skipped; writes still work, only without the index.
+    Returns the (label, property) pairs that are in place.
+    """
+    created = []
+    with driver.session() as session:
+        for label, property_key in constraints:
+            name = f"{label}_{property_key}_unique".lower()
+            try:
+                session.run(
+                    f"CREATE CONSTRAINT {quote_identifier(name)} IF NOT EXISTS "
+                    f"FOR (n:{quote_identifier(label)}) REQUIRE n.{quote_identifier(property_key)} IS UNIQUE"
+                ).consume()
+            except Neo4jError as e:
+                logging.warning(f"Could not create the uniqueness constraint on :{label}({property_key}): {e}. "
+                                f"If the graph has duplicate nodes, merge them (needs APOC) and run again: "
+                                f"{dedup_query(label, property_key)}")
+                continue
+            created.append((label, property_key))
+    return created
+
+
+def properties_key(properties):
+    return tuple(sorted((key, repr(value)) for key, value in properties.items()))
+
+
+def node_key(node):
+    return (node.label, node.id, properties_key(node.properties))
+
+
+class GraphWriter:
+    """Buffers Node/Edge writes and flushes them as batched UNWIND statements.
+
+    Nodes are grouped by (label, property keys) and edges by (relationship
+    type, property keys, endpoint labels), so every group becomes a single
+    parameterized statement. A flush happens once `max_rows` distinct rows are
+    buffered or `max_delay` seconds have passed since the oldest buffered item,
+    and all groups are written in one explicit write transaction. Nodes are
+    always written before edges so the edge MATCH can find them.
+
+    Writes are aggregated before they reach Neo4j: a node that was already
+    written in this run with the same properties is skipped (up to
+    `max_seen_nodes` remembered keys), and repeats of the same edge are summed
+    into one row whose `delta` is added to the counter property.
+
+    Callbacks registered with `after_flush` run once everything buffered
+    before them has been committed. The writer can be shared between threads.
+    """
+
+    def __init__(self, driver, max_rows=5000, max_delay=5.0, statement_rows=1000, max_seen_nodes=1_000_000):
+        self.driver = driver
+        self.max_rows = max_rows
+        self.max_seen_nodes = max_seen_nodes
+        self.seen_nodes = set()
+        self.skipped_nodes = 0
+        self.merged_edges = 0
+        self.max_delay = max_delay
+        self.statement_rows = statement_rows
+        self.node_groups = {}
+        self.edge_groups = {}
+        self.buffered = 0
+        self.first_buffered_at = None
+        self.callbacks = []
+        self.lock = threading.RLock()
+
+    def after_flush(self, callback):
+        with self.lock:
+            self.callbacks.append(callback)
+
+    def _run_callbacks(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_node(self, node):
+        if not node.id or not node.label or any(value is None for value in node.properties.values()):
+            return
+        key = (node.label, tuple(sorted(node.properties.keys())))
+        seen_key = node_key(node)
+        with self.lock:
+            group = self.node_groups.setdefault(key, {})
+            if seen_key in self.seen_nodes or seen_key in group:
+                self.skipped_nodes += 1
+                return
+            group[seen_key] = node.row()
+            self._buffered_one()
+
+    def add_edge(self, edge):
+        if edge.from_node_id is None or edge.to_node_id is None or not edge.relationship_type:
+            return
+        if any(value is None for value in edge.properties.values()):
+            return
+        key = (edge.relationship_type, tuple(sorted(edge.properties.keys())), edge.increment_property,
+               edge.from_label, edge.to_label)
+        row_key = (edge.from_node_id, edge.to_node_id, properties_key(edge.properties))
+        with self.lock:
+            group = self.edge_groups.setdefault(key, {})
+            if row_key in group:
+                group[row_key]["delta"] += 1
+                self.merged_edges += 1
+                return
+            group[row_key] = edge.row()
+            self._buffered_one()
+
+    def _buffered_one(self):
+        self.buffered += 1
+        if self.first_buffered_at is None:
+            self.first_buffered_at = time.monotonic()
+        if self.buffered >= self.max_rows or time.monotonic() - self.first_buffered_at >= self.max_delay:
+            self.flush()
+
+    def statements(self):
+        """Yields (query, rows) pairs for everything currently buffered."""
+        for (label, property_keys), group in self.node_groups.items():
+            query = node_rows_query(label, property_keys)
+            rows = list(group.values())
+            for start in range(0, len(rows), self.statement_rows):
+                yield query, rows[start:start + self.statement_rows]
+        for key, group in self.edge_groups.items():
+            query = edge_rows_query(*key)
+            rows = list(group.values())
+            for start in range(0, len(rows), self.statement_rows):
+                yield query, rows[start:start + self.statement_rows]
+
+    def flush(self):
+        with self.lock:
+            if not self.buffered:
+                self._run_callbacks()
+                return 0
+            statements = list(self.statements())
+
+            def write_batches(tx):
+                for query, rows in statements:
+                    tx.run(query, rows=rows).consume()
+
+            with self.driver.session() as session:
+                session.execute_write(write_batches)
+
+            flushed = self.buffered
+            self._remember_nodes()
+            self.node_groups = {}
+            self.edge_groups = {}
+            self.buffered = 0
+            self.first_buffered_at = None
+            self._run_callbacks()
+            return flushed
+
+    def _remember_nodes(self):
+        # Only committed nodes count as seen; the set is dropped when it grows
+        # past its cap, which at worst re-MERGEs a node that already exists
+        for group in self.node_groups.values():
+            self.seen_nodes.update(group.keys())
+        if len(self.seen_nodes) > self.max_seen_nodes:
+            self.seen_nodes = set()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,115 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+import lxml.html
+
+# Converts Justia opinion pages to the markdown stored as opinion content.
+# lxml does the parsing in C, and the page is walked once with the output
+# collected in a list, so long opinions convert in linear time.
+
+PRIMARY_CONTENT = "//div[contains(concat(' ', normalize-space(@class), ' '), ' primary-content ')]"
+HEADINGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+LISTS = {"ul", "ol"}
+# Elements whose text never belongs in the output
+SKIPPED = {"script", "style", "noscript", "template"}
+# lxml refuses a str carrying an XML encoding declaration (XHTML pages), so
+# pages are parsed as UTF-8 bytes, whatever encoding they declare
+PARSER = lxml.html.HTMLParser(encoding="utf-8")
+
+
+def _text(element):
+    return " ".join(element.text_content().split())
+
+
+def _text_without_lists(element):
+    # The element's own text, leaving out nested lists (they're emitted on their own lines)
+    parts = [element.text or ""]
+    for child in element:
+        if isinstance(child.tag, str) and child.tag not in LISTS and child.tag not in SKIPPED:
+            parts.append(_text_without_lists(child))
+        parts.append(child.tail or "")
+    return "".join(parts)
+
+
+def _emit_list(element, out, depth):
+    indent = "  " * depth
+    number = 0
+    for item in element:
+        if item.tag != "li":
+            continue
+        number += 1
+        marker = f"{number}." if element.tag == "ol" else "-"
+        text = " ".join(_text_without_lists(item).split())
+        if text:
+            out.append(f"{indent}{marker} {text}\n")
+        for nested in item.iter("ul", "ol"):
+            # Only lists belonging to this item; deeper ones are handled by the recursion
+            if _closest_list_item(nested) is item:
+                _emit_list(nested, out, depth + 1)
+    if depth == 0:
+        out.append("\n")
+
+
+def _closest_list_item(element):
+    parent = element.getparent()
+    while parent is not None and parent.tag != "li":
+        parent = parent.getparent()
+    return parent
+
+
+def _walk(element, out):
+    for child in element:
+        tag = child.tag
+        if not isinstance(tag, str) or tag in SKIPPED:
+            continue
+        if tag in HEADINGS:
+            out.append(f"{'#' * int(tag[1])} {_text(child)}\n\n")
+        elif tag == "p":
+            out.append(f"{_text(child)}\n\n")
+        elif tag in LISTS:
+            _emit_list(child, out, 0)
+        else:
+            _walk(child, out)
+
+
+def html_to_markdown(html):
+    """Returns the markdown of the page's primary-content div, or None if it has none."""
+    if not html or not html.strip():
+        return None
+    if isinstance(html, str):
+        html = html.encode("utf-8")
+    root = lxml.html.fromstring(html, parser=PARSER)
+    found = root.xpath(PRIMARY_CONTENT)
+    if not found:
+        return None
+    out = []
+    _walk(found[0], out)
+    return "".join(out)
+
+
+def _convert_batch(batch):
+    return [(key, html_to_markdown(html)) for key, html in batch]
+
+
+def convert_many(pages, workers=None, batch_size=32, max_pending=None):
+    """Converts (key, html) pairs across a process pool, yielding (key, markdown) as batches finish.
+
+    Pages are sent `batch_size` at a time to keep pickling overhead low, and
+    at most `max_pending` batches are in flight, so a long stream of stored
+    pages is never held in memory all at once.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 2
+    pages = iter(pages)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        while True:
+            batch = list(islice(pages, batch_size))
+            if batch:
+                pending.add(pool.submit(_convert_batch, batch))
+            if pending and (len(pending) >= max_pending or not batch):
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+            if not batch and not pending:
+                return
@@ -0,0 +1,463 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+
+# A local, on-disk stand-in for a Pinecone index, for offline runs, CI and
+# recall checks. Vectors are appended as float32 rows to one file that is
+# memory-mapped for search; ids, metadata and IVF list assignments live in
+# SQLite next to it.
+#
+#   LOCAL_INDEX_DIR=scotus_index python process_scotus.py
+#   python local_index.py build-ivf scotus_index
+#   python local_index.py stats scotus_index
+
+VECTORS_FILE = "vectors.f32"
+METADATA_FILE = "metadata.sqlite"
+CENTROIDS_FILE = "centroids.npy"
+# Rows scored per matrix product, which bounds the temporary score matrix
+SCAN_ROWS = 65536
+# SQLite caps the number of host parameters per statement
+LOOKUP_BATCH = 500
+METRICS = ("cosine", "dotproduct")
+FIELD = re.compile(r"^\w+$")
+
+
+def _as_record(vector):
+    # Pinecone accepts (id, values), (id, values, metadata) or {"id", "values", "metadata"}
+    if isinstance(vector, dict):
+        return str(vector["id"]), vector["values"], vector.get("metadata")
+    vector_id, values, *rest = vector
+    return str(vector_id), values, rest[0] if rest else None
+
+
+def _filter_clause(filter):
+    """Turns a Pinecone metadata filter ($eq, $ne, $in, $nin per field) into a SQL condition."""
+    clauses, params = [], []
+    for key, condition in filter.items():
+        if not FIELD.match(key):
+            raise ValueError(f"Unsupported filter field: {key}")
+        field = f"json_extract(metadata, '$.{key}')"
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, value in condition.items():
+            if op in ("$eq", "$ne"):
+                clauses.append(f"{field} {'=' if op == '$eq' else '!='} ?")
+                params.append(value)
+            elif op in ("$in", "$nin"):
+                clauses.append(f"{field} {'IN' if op == '$in' else 'NOT IN'} ({','.join('?' * len(value))})")
+                params.extend(value)
+            else:
+                raise ValueError(f"Unsupported filter operator: {op}")
+    return " AND ".join(clauses) or "1", params
+
+
+def _grow(array, size, fill):
+    if size <= len(array):
+        return array
+    grown = np.full(max(size, 2 * len(array), 1024), fill, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class LocalIndex:
+    """Pinecone-compatible vector index on local disk.
+
+    Supports `upsert`, `update`, `fetch`, `delete`, `query` and
+    `describe_index_stats` with the same arguments and result shapes as a
+    Pinecone index (namespaces are accepted and ignored), plus `query_many`
+    for scoring a batch of queries with one matrix product per block.
+
+    Re-upserting an id appends a new row and leaves the old one dead until
+    `compact`. Search is exact by default; after `build_ivf` each query only
+    scores the rows in its `nprobe` nearest k-means lists (rows added later
+    are assigned to a list as they arrive). Filtered queries that leave at
+    most SCAN_ROWS candidates are always exact; `case_id` filters are backed
+    by an index on the metadata.
+
+    One process writes to an index at a time; threads may share it.
+    """
+
+    def __init__(self, directory, metric="cosine", nprobe=8):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
+        self.directory = directory
+        self.nprobe = nprobe
+        self.vectors_path = os.path.join(directory, VECTORS_FILE)
+        self.centroids_path = os.path.join(directory, CENTROIDS_FILE)
+        self.lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(directory, METADATA_FILE), check_same_thread=False, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            "id TEXT PRIMARY KEY, row INTEGER NOT NULL, list INTEGER NOT NULL DEFAULT -1, metadata TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS records_row ON records (row)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS records_case_id ON records (json_extract(metadata, '$.case_id'))")
+        self.conn.execute("INSERT OR IGNORE INTO settings VALUES ('metric', ?)", (metric,))
+        self.conn.commit()
+        self._load()
+
+    def _setting(self, name):
+        row = self.conn.execute("SELECT value FROM settings WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def _load(self):
+        self.metric = self._setting("metric")
+        dimension = self._setting("dimension")
+        self.dimension = int(dimension) if dimension else None
+        self.rows = self.conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM records").fetchone()[0]
+        if self.dimension and os.path.exists(self.vectors_path):
+            # Rows appended by a run that stopped before committing their metadata are dropped
+            with open(self.vectors_path, "r+b") as f:
+                f.truncate(self.rows * self.dimension * 4)
+        self.row_ids = [None] * self.rows
+        self.alive = np.zeros(self.rows, dtype=bool)
+        self.lists = np.full(self.rows, -1, dtype=np.int32)
+        for vector_id, row, list_number in self.conn.execute("SELECT id, row, list FROM records"):
+            self.row_ids[row] = vector_id
+            self.alive[row] = True
+            self.lists[row] = list_number
+        self.centroids = np.load(self.centroids_path) if os.path.exists(self.centroids_path) else None
+        self.matrix = None
+        self.inverted = None
+        self.norms = np.zeros(0, dtype=np.float32)
+        if self.rows:
+            matrix = self._matrix()
+            self.norms = np.concatenate([np.linalg.norm(matrix[start:start + SCAN_ROWS], axis=1)
+                                         for start in range(0, self.rows, SCAN_ROWS)]).astype(np.float32)
+
+    def _matrix(self):
+        # Remapped lazily after appends; the OS page cache keeps hot rows in memory
+        if self.matrix is None or len(self.matrix) != self.rows:
+            self.matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.rows, self.dimension))
+        return self.matrix
+
+    def _nearest_lists(self, values, count):
+        unit = values / np.maximum(np.linalg.norm(values, axis=1, keepdims=True), 1e-12)
+        scores = unit @ self.centroids.T
+        if count == 1:
+            return scores.argmax(axis=1).astype(np.int32)[:, None]
+        return np.argsort(-scores, axis=1)[:, :count].astype(np.int32)
+
+    ###########################
+    # Writes                  #
+    ###########################
+
+    def upsert(self, vectors, namespace=None):
+        records = {}
+        for vector_id, values, metadata in map(_as_record, vectors):
+            # Within one call the last copy of an id wins
+            records[vector_id] = (values, metadata or {})
+        if not records:
+            return {"upserted_count": 0}
+        values = np.asarray([values for values, _ in records.values()], dtype=np.float32)
+        if values.ndim != 2:
+            raise ValueError("Vectors must all have the same dimension")
+
+        with self.lock:
+            if self.dimension is None:
+                self.dimension = values.shape[1]
+                self.conn.execute("INSERT INTO settings VALUES ('dimension', ?)", (str(self.dimension),))
+            elif values.shape[1] != self.dimension:
+                raise ValueError(f"Vector dimension {values.shape[1]} does not match the index dimension {self.dimension}")
+            ids = list(records)
+            replaced = self._rows_of(ids)
+            start = self.rows
+            lists = self._nearest_lists(values, 1)[:, 0] if self.centroids is not None else np.full(len(ids), -1, np.int32)
+            with open(self.vectors_path, "ab") as f:
+                f.write(values.tobytes())
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO records (id, row, list, metadata) VALUES (?, ?, ?, ?)",
+                [(vector_id, start + i, int(lists[i]), json.dumps(records[vector_id][1]))
+                 for i, vector_id in enumerate(ids)],
+            )
+            self.conn.commit()
+
+            self.rows += len(ids)
+            self.alive = _grow(self.alive, self.rows, False)
+            self.lists = _grow(self.lists, self.rows, -1)
+            self.norms = _grow(self.norms, self.rows, 0)
+            self.alive[list(replaced.values())] = False
+            self.alive[start:self.rows] = True
+            self.lists[start:self.rows] = lists
+            self.norms[start:self.rows] = np.linalg.norm(values, axis=1)
+            self.row_ids.extend(ids)
+            for row in replaced.values():
+                self.row_ids[row] = None
+            self.inverted = None
+        return {"upserted_count": len(ids)}
+
+    def _rows_of(self, ids):
+        found = {}
+        for start in range(0, len(ids), LOOKUP_BATCH):
+            batch = ids[start:start + LOOKUP_BATCH]
+            found.update(self.conn.execute(
+                f"SELECT id, row FROM records WHERE id IN ({','.join('?' * len(batch))})", batch))
+        return found
+
+    def update(self, id, values=None, set_metadata=None, namespace=None):
+        with self.lock:
+            row = self.conn.execute("SELECT row, metadata FROM records WHERE id = ?", (str(id),)).fetchone()
+            if row is None:
+                return {}
+            metadata = json.loads(row[1])
+            metadata.update(set_metadata or {})
+            if values is not None:
+                self.upsert([(str(id), values, metadata)])
+            else:
+                self.conn.execute("UPDATE records SET metadata = ? WHERE id = ?", (json.dumps(metadata), str(id)))
+                self.conn.commit()
+        return {}
+
+    def delete(self, ids, namespace=None):
+        ids = [str(vector_id) for vector_id in ids]
+        with self.lock:
+            rows = self._rows_of(ids)
+            self.conn.executemany("DELETE FROM records WHERE id = ?", [(vector_id,) for vector_id in rows])
+            self.conn.commit()
+            for row in rows.values():
+                self.alive[row] = False
+                self.row_ids[row] = None
+            self.inverted = None
+        return {}
+
+    ###########################
+    # Reads                   #
+    ###########################
+
+    def fetch(self, ids, namespace=None):
+        ids = [str(vector_id) for vector_id in ids]
+        vectors = {}
+        with self.lock:
+            matrix = self._matrix() if self.rows else None
+            for start in range(0, len(ids), LOOKUP_BATCH):
+                batch = ids[start:start + LOOKUP_BATCH]
+                for vector_id, row, metadata in self.conn.execute(
+                        f"SELECT id, row, metadata FROM records WHERE id IN ({','.join('?' * len(batch))})", batch):
+                    vectors[vector_id] = {"id": vector_id, "values": matrix[row].tolist(), "metadata": json.loads(metadata)}
+        return {"vectors": vectors}
+
+    def query(self, vector=None, id=None, top_k=10, filter=None, include_values=False, include_metadata=False,
+              namespace=None):
+        if vector is None:
+            found = self.fetch([id])["vectors"]
+            if not found:
+                return {"matches": []}
+            vector = found[str(id)]["values"]
+        matches = self.query_many([vector], top_k, filter, include_values, include_metadata)[0]
+        return {"matches": matches}
+
+    def query_many(self, vectors, top_k=10, filter=None, include_values=False, include_metadata=False):
+        """Returns a list of matches for each query vector, best first."""
+        queries = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        with self.lock:
+            if not self.rows or not len(queries):
+                return [[] for _ in queries]
+            if self.metric == "cosine":
+                queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+            allowed = self._filter_rows(filter) if filter else None
+            if allowed is not None and (len(allowed) <= SCAN_ROWS or self.centroids is None):
+                results = list(zip(*self._top_k(queries, allowed, top_k)))
+            elif self.centroids is not None:
+                probes = self._nearest_lists(queries, min(self.nprobe, len(self.centroids)))
+                results = []
+                for query, probe in zip(queries, probes):
+                    rows = self._probed_rows(probe)
+                    if allowed is not None:
+                        rows = np.intersect1d(rows, allowed, assume_unique=True)
+                    scores, rows = self._top_k(query[None, :], rows, top_k)
+                    results.append((scores[0], rows[0]))
+            else:
+                results = list(zip(*self._scan(queries, top_k)))
+            return [self._matches(scores, rows, include_values, include_metadata) for scores, rows in results]
+
+    def _filter_rows(self, filter):
+        clause, params = _filter_clause(filter)
+        rows = np.fromiter((row for row, in self.conn.execute(f"SELECT row FROM records WHERE {clause}", params)),
+                           dtype=np.int64)
+        rows.sort()
+        return rows
+
+    def _probed_rows(self, probe):
+        if self.inverted is None:
+            # Rows grouped by list, rebuilt after writes; dead rows are left out
+            lists = np.where(self.alive[:self.rows], self.lists[:self.rows], -2)
+            order = np.argsort(lists, kind="stable")
+            bounds = np.searchsorted(lists[order], np.arange(-1, len(self.centroids) + 1))
+            self.inverted = (order, bounds)
+        order, bounds = self.inverted
+        # Rows added before the lists were built (list -1) are always scored
+        chunks = [order[bounds[0]:bounds[1]]] + [order[bounds[p + 1]:bounds[p + 2]] for p in probe]
+        return np.sort(np.concatenate(chunks))
+
+    def _scores(self, queries, rows):
+        block = self._matrix()[rows]
+        scores = queries @ block.T
+        if self.metric == "cosine":
+            scores /= np.maximum(self.norms[rows], 1e-12)
+        return scores
+
+    def _top_k(self, queries, rows, top_k):
+        # Exact top-k over the given rows, scored SCAN_ROWS at a time
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(rows), SCAN_ROWS):
+            block_rows = rows[start:start + SCAN_ROWS]
+            best_scores, best_rows = self._merge(best_scores, best_rows, self._scores(queries, block_rows),
+                                                 np.broadcast_to(block_rows, (len(queries), len(block_rows))), top_k)
+        return best_scores, best_rows
+
+    def _scan(self, queries, top_k):
+        # Brute force over every live row, one contiguous block of the mapped file at a time
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        matrix = self._matrix()
+        for start in range(0, self.rows, SCAN_ROWS):
+            end = min(start + SCAN_ROWS, self.rows)
+            scores = queries @ matrix[start:end].T
+            if self.metric == "cosine":
+                scores /= np.maximum(self.norms[start:end], 1e-12)
+            scores[:, ~self.alive[start:end]] = -np.inf
+            block_rows = np.broadcast_to(np.arange(start, end), scores.shape)
+            best_scores, best_rows = self._merge(best_scores, best_rows, scores, block_rows, top_k)
+        return best_scores, best_rows
+
+    @staticmethod
+    def _merge(best_scores, best_rows, scores, rows, top_k):
+        scores = np.concatenate([best_scores, scores], axis=1)
+        rows = np.concatenate([best_rows, rows], axis=1)
+        if scores.shape[1] > top_k:
+            keep = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+            scores = np.take_along_axis(scores, keep, axis=1)
+            rows = np.take_along_axis(rows, keep, axis=1)
+        return scores, rows
+
+    def _matches(self, scores, rows, include_values, include_metadata):
+        order = np.argsort(-scores, kind="stable")
+        picked = [(float(scores[i]), int(rows[i])) for i in order if np.isfinite(scores[i])]
+        metadata = {}
+        if include_metadata and picked:
+            ids = [self.row_ids[row] for _, row in picked]
+            metadata = {vector_id: json.loads(data) for vector_id, data in self.conn.execute(
+                f"SELECT id, metadata FROM records WHERE id IN ({','.join('?' * len(ids))})", ids)}
+        matches = []
+        for score, row in picked:
+            match = {"id": self.row_ids[row], "score": score}
+            if include_values:
+                match["values"] = self._matrix()[row].tolist()
+            if include_metadata:
+                match["metadata"] = metadata.get(self.row_ids[row], {})
+            matches.append(match)
+        return matches
+
+    ###########################
+    # Maintenance             #
+    ###########################
+
+    def describe_index_stats(self):
+        count = len(self)
+        return {"dimension": self.dimension, "total_vector_count": count, "namespaces": {"": {"vector_count": count}}}
+
+    def build_ivf(self, lists=None, iterations=10, sample_size=100_000, seed=0):
+        """Partitions the live rows into `lists` k-means lists (default sqrt of the row count) for approximate search."""
+        with self.lock:
+            live = np.flatnonzero(self.alive[:self.rows])
+            if not len(live):
+                return 0
+            lists = min(lists or max(1, int(np.sqrt(len(live)))), len(live))
+            rng = np.random.default_rng(seed)
+            matrix = self._matrix()
+            sample = np.sort(rng.choice(live, min(sample_size, len(live)), replace=False))
+            points = matrix[sample] / np.maximum(self.norms[sample, None], 1e-12)
+            # Spherical k-means: lists are formed by direction, which matches cosine scoring
+            self.centroids = points[rng.choice(len(points), lists, replace=False)].copy()
+            for _ in range(iterations):
+                assigned = self._nearest_lists(points, 1)[:, 0]
+                for number in range(lists):
+                    members = points[assigned == number]
+                    if len(members):
+                        center = members.sum(axis=0)
+                        self.centroids[number] = center / max(np.linalg.norm(center), 1e-12)
+
+            for start in range(0, len(live), SCAN_ROWS):
+                rows = live[start:start + SCAN_ROWS]
+                self.lists[rows] = self._nearest_lists(np.asarray(matrix[rows]), 1)[:, 0]
+            self.conn.executemany("UPDATE records SET list = ? WHERE row = ?",
+                                  [(int(self.lists[row]), int(row)) for row in live])
+            self.conn.commit()
+            np.save(self.centroids_path, self.centroids)
+            self.inverted = None
+            return lists
+
+    def drop_ivf(self):
+        with self.lock:
+            self.centroids = None
+            if os.path.exists(self.centroids_path):
+                os.remove(self.centroids_path)
+            self.lists[:] = -1
+            self.conn.execute("UPDATE records SET list = -1")
+            self.conn.commit()
+            self.inverted = None
+
+    def compact(self):
+        """Rewrites the vector file without dead rows; returns how many rows were dropped."""
+        with self.lock:
+            live = np.flatnonzero(self.alive[:self.rows])
+            dropped = self.rows - len(live)
+            if not dropped:
+                return 0
+            matrix = self._matrix()
+            tmp_path = f"{self.vectors_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                for start in range(0, len(live), SCAN_ROWS):
+                    f.write(np.ascontiguousarray(matrix[live[start:start + SCAN_ROWS]]).tobytes())
+            # Live rows keep their order, so each new row number is free by the time it's assigned
+            self.conn.executemany("UPDATE records SET row = ? WHERE row = ?",
+                                  [(new_row, int(row)) for new_row, row in enumerate(live)])
+            self.matrix = None
+            os.replace(tmp_path, self.vectors_path)
+            self.conn.commit()
+            self._load()
+            return dropped
+
+    def __len__(self):
+        with self.lock:
+            return int(self.alive[:self.rows].sum())
+
+    def close(self):
+        with self.lock:
+            self.matrix = None
+            self.conn.commit()
+            self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and maintain a local vector index")
+    parser.add_argument("command", choices=["stats", "build-ivf", "drop-ivf", "compact"])
+    parser.add_argument("directory")
+    parser.add_argument("--lists", type=int, help="number of IVF lists (default: sqrt of the vector count)")
+    args = parser.parse_args()
+
+    index = LocalIndex(args.directory)
+    if args.command == "build-ivf":
+        print(f"Built {index.build_ivf(args.lists)} IVF lists")
+    elif args.command == "drop-ivf":
+        index.drop_ivf()
+    elif args.command == "compact":
+        print(f"Dropped {index.compact()} dead rows")
+    stats = index.describe_index_stats()
+    stats["ivf_lists"] = 0 if index.centroids is None else len(index.centroids)
+    stats["rows"] = index.rows
+    print(json.dumps(stats))
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
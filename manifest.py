@@ -0,0 +1,99 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+# Run modes: process everything, skip units whose stage already completed, or
+# skip only the ones whose stage completed for the same content
+MODES = ('all', 'resume', 'only-changed')
+
+# SQLite caps the number of host parameters per statement
+LOOKUP_BATCH = 500
+
+
+def content_hash(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class Manifest:
+    """Records which stages have completed for each unit (case, opinion, email, chunk).
+
+    A completed stage is stored with the content hash it was run on. In
+    'resume' mode any completed stage is skipped; in 'only-changed' mode a
+    stage is skipped only when the unit's content hash is unchanged.
+
+    Every `mark_many` commits on its own, so sharded worker processes sharing
+    the file never wait on another's open write transaction for long.
+    """
+
+    def __init__(self, path, mode='all'):
+        if mode not in MODES:
+            raise ValueError(f"Unknown manifest mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        # The timeout lets sharded worker processes wait for each other's writes
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # Keeps the per-call commits cheap; a crash can only lose the last few marks
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS stages ("
+            "kind TEXT NOT NULL, unit_id TEXT NOT NULL, stage TEXT NOT NULL, "
+            "content_hash TEXT NOT NULL, completed_at REAL NOT NULL, "
+            "PRIMARY KEY (kind, unit_id, stage))"
+        )
+        self.conn.commit()
+
+    def _completed(self, kind, stage, unit_ids):
+        found = {}
+        for start in range(0, len(unit_ids), LOOKUP_BATCH):
+            batch = unit_ids[start:start + LOOKUP_BATCH]
+            rows = self.conn.execute(
+                f"SELECT unit_id, content_hash FROM stages WHERE kind = ? AND stage = ? "
+                f"AND unit_id IN ({','.join('?' * len(batch))})",
+                [kind, stage] + batch,
+            )
+            found.update(rows)
+        return found
+
+    def needs(self, kind, unit_id, stage, content_hash):
+        return bool(self.needs_many(kind, stage, [(unit_id, content_hash)]))
+
+    def needs_many(self, kind, stage, units):
+        """Returns the set of unit ids, out of (unit_id, content_hash) pairs, that still need `stage`."""
+        units = [(str(unit_id), content_hash) for unit_id, content_hash in units]
+        if self.mode == 'all':
+            return {unit_id for unit_id, _ in units}
+        with self.lock:
+            completed = self._completed(kind, stage, [unit_id for unit_id, _ in units])
+        if self.mode == 'resume':
+            return {unit_id for unit_id, _ in units if unit_id not in completed}
+        return {unit_id for unit_id, content_hash in units if completed.get(unit_id) != content_hash}
+
+    def mark_done(self, kind, unit_id, stage, content_hash):
+        self.mark_many(kind, stage, [(unit_id, content_hash)])
+
+    def mark_many(self, kind, stage, units):
+        now = time.time()
+        rows = [(kind, str(unit_id), stage, content_hash, now) for unit_id, content_hash in units]
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO stages (kind, unit_id, stage, content_hash, completed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.conn.commit()
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        self.commit()
+        with self.lock:
+            self.conn.close()
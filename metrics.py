@@ -0,0 +1,296 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is +Inf
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Operation:
+    """Counts, item/byte totals and a latency histogram for one kind of call."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.items = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, seconds, items, nbytes, failed):
+        self.calls += 1
+        self.errors += failed
+        self.items += items
+        self.bytes += nbytes
+        self.seconds += seconds
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def quantile(self, fraction):
+        # Upper bound of the bucket holding the quantile, like Prometheus' histogram_quantile
+        target = fraction * self.calls
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), self.buckets):
+            seen += count
+            if seen >= target and count:
+                return bound
+        return 0.0
+
+    def snapshot(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "items": self.items,
+            "bytes": self.bytes,
+            "seconds": round(self.seconds, 6),
+            "p50_seconds": self.quantile(0.5),
+            "p99_seconds": self.quantile(0.99),
+            "buckets": dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], self.buckets)),
+        }
+
+
+class Metrics:
+    """Registry of per-operation metrics, shared between threads.
+
+    Calls are recorded with `observe`, or by wrapping a method with
+    `instrument`. Other components can expose their own counters with
+    `watch(name, fn)`, where `fn()` returns {key: {field: number}} (for
+    example Pipeline.stats); they are read at snapshot time.
+    """
+
+    def __init__(self):
+        self.operations = {}
+        self.watched = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name, seconds, items=1, nbytes=0, failed=False):
+        with self.lock:
+            operation = self.operations.get(name)
+            if operation is None:
+                operation = self.operations[name] = Operation()
+            operation.observe(seconds, items, nbytes, failed)
+
+    def instrument(self, obj, method_name, name, items=None, nbytes=None):
+        """Replaces `obj.method_name` with a timed wrapper.
+
+        `items` and `nbytes`, if given, are called with the method's arguments
+        and return how many items/bytes the call carried.
+        """
+        method = getattr(obj, method_name)
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = method(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                self.observe(
+                    name,
+                    time.perf_counter() - started,
+                    items(*args, **kwargs) if items else 1,
+                    nbytes(*args, **kwargs) if nbytes else 0,
+                    failed,
+                )
+
+        setattr(obj, method_name, timed)
+        return obj
+
+    def watch(self, name, fn):
+        self.watched[name] = fn
+
+    def snapshot(self):
+        with self.lock:
+            operations = {name: operation.snapshot() for name, operation in self.operations.items()}
+        watched = {}
+        for name, fn in list(self.watched.items()):
+            try:
+                watched[name] = fn()
+            except Exception:
+                # A watched component may be mid-update or already closed
+                continue
+        return {"time": time.time(), "operations": operations, "watched": watched}
+
+    def prometheus(self, prefix="ingest"):
+        snapshot = self.snapshot()
+        lines = []
+        counters = [("calls", "calls_total"), ("errors", "errors_total"), ("items", "items_total"), ("bytes", "bytes_total")]
+        for field, metric in counters:
+            lines.append(f"# TYPE {prefix}_{metric} counter")
+            for name, operation in snapshot["operations"].items():
+                lines.append(f'{prefix}_{metric}{{op="{name}"}} {operation[field]}')
+
+        lines.append(f"# TYPE {prefix}_latency_seconds histogram")
+        for name, operation in snapshot["operations"].items():
+            cumulative = 0
+            for bound, count in operation["buckets"].items():
+                cumulative += count
+                lines.append(f'{prefix}_latency_seconds_bucket{{op="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_latency_seconds_sum{{op="{name}"}} {operation["seconds"]}')
+            lines.append(f'{prefix}_latency_seconds_count{{op="{name}"}} {operation["calls"]}')
+
+        for source, groups in snapshot["watched"].items():
+            for key, fields in groups.items():
+                for field, value in fields.items():
+                    if isinstance(value, (int, float)):
+                        lines.append(f'{prefix}_{source}_{field}{{key="{key}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """Writes periodic snapshots of `metrics` from a background thread.
+
+    Each interval appends one JSON line to `jsonl_path` and rewrites the
+    Prometheus text file at `prom_path` (atomically, so a textfile collector
+    never reads a half-written file). Either path may be None.
+    """
+
+    def __init__(self, metrics, jsonl_path=None, prom_path=None, interval=15.0):
+        self.metrics = metrics
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="metrics-exporter", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.export()
+
+    def export(self):
+        if self.jsonl_path:
+            with open(self.jsonl_path, "a") as f:
+                f.write(json.dumps(self.metrics.snapshot()) + "\n")
+        if self.prom_path:
+            tmp_path = f"{self.prom_path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(self.metrics.prometheus())
+            os.replace(tmp_path, self.prom_path)
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        # Final snapshot so the end of the run is always recorded
+        self.export()
+
+
+def metrics_from_env(suffix=""):
+    """Returns (Metrics, MetricsExporter) if METRICS_JSONL or METRICS_PROM is set, else (None, None).
+
+    With neither set nothing is wrapped, so instrumentation costs nothing.
+    `suffix` is appended to both paths (sharded runs export one set per shard).
+    """
+    jsonl_path = os.getenv('METRICS_JSONL')
+    prom_path = os.getenv('METRICS_PROM')
+    if not jsonl_path and not prom_path:
+        return None, None
+    jsonl_path = jsonl_path and jsonl_path + suffix
+    prom_path = prom_path and prom_path + suffix
+    metrics = Metrics()
+    exporter = MetricsExporter(metrics, jsonl_path, prom_path, float(os.getenv('METRICS_INTERVAL', 15)))
+    return metrics, exporter
+
+
+###########################
+# Client wrappers         #
+###########################
+
+def _text_bytes(texts):
+    texts = [texts] if isinstance(texts, str) else texts
+    return sum(len(text.encode()) for text in texts)
+
+
+def instrument_openai(metrics, client):
+    metrics.instrument(
+        client.embeddings, "create", "openai.embeddings",
+        items=lambda input, **kwargs: 1 if isinstance(input, str) else len(input),
+        nbytes=lambda input, **kwargs: _text_bytes(input),
+    )
+    return client
+
+
+def instrument_index(metrics, index):
+    from vector_sink import estimate_vector_bytes
+    metrics.instrument(
+        index, "upsert", "pinecone.upsert",
+        items=lambda vectors, **kwargs: len(vectors),
+        nbytes=lambda vectors, **kwargs: sum(estimate_vector_bytes(*vector) for vector in vectors),
+    )
+    return index
+
+
+def instrument_models(metrics, tagger, extractor):
+    sentence_count = lambda sentences, *args, **kwargs: len(sentences)
+    if tagger is not None:
+        metrics.instrument(tagger, "predict", "flair.ner", items=sentence_count)
+    if extractor is not None:
+        metrics.instrument(extractor, "predict", "flair.relations", items=sentence_count)
+    return tagger, extractor
+
+
+def instrument_collection(metrics, collection):
+    prefix = f"docstore.{collection.name}"
+    metrics.instrument(collection, "get", f"{prefix}.get")
+    metrics.instrument(collection, "get_many", f"{prefix}.get_many", items=lambda ids: len(ids))
+    metrics.instrument(collection, "sample", f"{prefix}.sample", items=lambda n, *args, **kwargs: n)
+    return collection
+
+
+def _row_count(query, parameters=None, **kwargs):
+    rows = (parameters or {}).get("rows", kwargs.get("rows"))
+    return len(rows) if rows is not None else 1
+
+
+class InstrumentedTransaction:
+    def __init__(self, metrics, tx):
+        self.metrics = metrics
+        self.tx = tx
+        metrics.instrument(self, "run", "neo4j.run", items=_row_count)
+
+    def run(self, *args, **kwargs):
+        return self.tx.run(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.tx, name)
+
+
+class InstrumentedSession:
+    def __init__(self, metrics, session):
+        self.metrics = metrics
+        self.session = session
+        metrics.instrument(self, "run", "neo4j.run", items=_row_count)
+        metrics.instrument(self, "execute_write", "neo4j.write_transaction")
+
+    def run(self, *args, **kwargs):
+        return self.session.run(*args, **kwargs)
+
+    def execute_write(self, fn, *args, **kwargs):
+        return self.session.execute_write(lambda tx, *a, **kw: fn(InstrumentedTransaction(self.metrics, tx), *a, **kw),
+                                          *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def __enter__(self):
+        self.session.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.session.__exit__(exc_type, exc_value, traceback)
+
+
+class InstrumentedDriver:
+    """Wraps a Neo4j driver so every session.run / tx.run / execute_write is timed."""
+
+    def __init__(self, metrics, driver):
+        self.metrics = metrics
+        self.driver = driver
+
+    def session(self, **kwargs):
+        return InstrumentedSession(self.metrics, self.driver.session(**kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
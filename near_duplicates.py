@@ -0,0 +1,248 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Chunks are compared as sets of overlapping word shingles. Two chunks whose
+# shingle sets have a Jaccard similarity of at least the threshold are near
+# duplicates, and only the first one seen (the canonical chunk) is embedded.
+SHINGLE_WORDS = 5
+NUM_PERM = 64
+# 8 bands of 8 rows: pairs at 0.9 similarity share a band ~99% of the time,
+# pairs at 0.5 well under 5%, so few candidates need checking
+BANDS = 8
+THRESHOLD = 0.9
+# Pinecone caps metadata at 40KB per vector, so only this many duplicate ids are copied onto it
+MAX_METADATA_IDS = 500
+
+# Universal hash family h(x) = (a*x + b) mod P over 32-bit shingle hashes.
+# a stays below 2^32 so a*x fits in 64 bits; the seed is fixed because the
+# signatures are stored and compared across runs.
+_PRIME = np.uint64((1 << 32) + 15)
+_rng = np.random.RandomState(1)
+_A = _rng.randint(1, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+_B = _rng.randint(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+
+WORD = re.compile(r"\w+")
+
+
+def shingles(text, size=SHINGLE_WORDS):
+    # Case, punctuation and quoting (">" prefixes, re-wrapped lines) don't matter
+    words = WORD.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash(text):
+    """Returns the MinHash signature of `text` (uint64 array of NUM_PERM), or None if it has no words."""
+    found = shingles(text)
+    if not found:
+        return None
+    hashes = np.fromiter((zlib.crc32(shingle.encode()) for shingle in found), dtype=np.uint64, count=len(found))
+    return ((np.outer(_A, hashes) % _PRIME + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def similarity(a, b):
+    # Fraction of matching signature slots estimates the Jaccard similarity
+    return float(np.count_nonzero(a == b)) / len(a)
+
+
+def band_keys(signature, bands=BANDS):
+    rows = len(signature) // bands
+    keys = []
+    for band in range(bands):
+        digest = hashlib.blake2b(signature[band * rows:(band + 1) * rows].tobytes(), digest_size=8,
+                                 person=band.to_bytes(2, "little")).digest()
+        keys.append(int.from_bytes(digest, "little", signed=True))
+    return keys
+
+
+class NearDuplicateIndex:
+    """Persistent MinHash LSH index mapping near-duplicate chunks onto a canonical chunk.
+
+    `assign` is given the chunks about to be embedded, as (chunk_id, text,
+    owner_id) where the owner is the email or case the chunk came from. A
+    chunk with no near duplicate becomes a canonical candidate and is
+    embedded as usual; any other chunk is a duplicate of its canonical chunk
+    and is not embedded. A candidate is only indexed once `register` is
+    called with it after its vector was upserted (the sink's
+    `on_upserted`), and duplicates of a candidate are only recorded then, so
+    nothing points at a vector that was never stored. Duplicates of a
+    candidate that is never registered are forgotten and get assigned again
+    by the next run.
+
+    `sync_metadata` copies the owners of each canonical chunk's duplicates
+    onto its vector (as `duplicate_<owner_field>s`); it runs once the
+    canonical vectors are upserted, and anything not yet synced is picked up
+    by the next run. Signatures and LSH buckets are kept in SQLite, so
+    duplicates are found across runs as well as within one.
+    """
+
+    def __init__(self, path, owner_field, threshold=THRESHOLD, bands=BANDS):
+        self.path = path
+        self.owner_field = owner_field
+        self.threshold = threshold
+        self.bands = bands
+        self.duplicates_found = 0
+        self.lock = threading.Lock()
+        # Canonical candidates of this run that aren't upserted yet: chunk_id -> (signature, band keys),
+        # their band keys, and the (chunk_id, owner_id) duplicates waiting on each of them
+        self.candidates = {}
+        self.candidate_buckets = {}
+        self.waiting = {}
+        # The timeout lets sharded worker processes wait for each other's writes
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # Losing the last commits on a crash only means those chunks get embedded again
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS signatures (chunk_id TEXT PRIMARY KEY, signature BLOB NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS buckets (key INTEGER NOT NULL, chunk_id TEXT NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS buckets_key ON buckets (key)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS duplicates ("
+            "chunk_id TEXT PRIMARY KEY, canonical_id TEXT NOT NULL, owner_id TEXT NOT NULL, synced INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS duplicates_canonical ON duplicates (canonical_id)")
+        self.conn.commit()
+
+    def _find(self, chunk_id, signature, keys):
+        placeholders = ','.join('?' * len(keys))
+        candidates = list(self.conn.execute(
+            f"SELECT DISTINCT s.chunk_id, s.signature FROM buckets b JOIN signatures s ON s.chunk_id = b.chunk_id "
+            f"WHERE b.key IN ({placeholders})", keys,
+        ))
+        candidates += [(candidate_id, self.candidates[candidate_id][0])
+                       for candidate_id in set().union(*(self.candidate_buckets.get(key, ()) for key in keys))]
+        best, best_score = None, self.threshold
+        for candidate_id, stored in candidates:
+            if candidate_id == chunk_id:
+                continue
+            if isinstance(stored, bytes):
+                stored = np.frombuffer(stored, dtype=np.uint64)
+            score = similarity(signature, stored)
+            if score >= best_score:
+                best, best_score = candidate_id, score
+        return best
+
+    def _forget(self, chunk_id, signature):
+        """Drops what the index knows about a chunk being reprocessed, unless it is canonical with the same signature.
+
+        Returns True when the chunk stays canonical.
+        """
+        row = self.conn.execute("SELECT signature FROM signatures WHERE chunk_id = ?", (chunk_id,)).fetchone()
+        if row is not None and signature is not None and np.array_equal(np.frombuffer(row[0], dtype=np.uint64), signature):
+            return True
+        if row is not None:
+            # Its content changed, so its duplicates no longer match it; they are assigned again on the next run
+            self.conn.execute("DELETE FROM buckets WHERE chunk_id = ?", (chunk_id,))
+            self.conn.execute("DELETE FROM signatures WHERE chunk_id = ?", (chunk_id,))
+            self.conn.execute("DELETE FROM duplicates WHERE canonical_id = ?", (chunk_id,))
+        if chunk_id in self.candidates:
+            for key in self.candidates.pop(chunk_id)[1]:
+                self.candidate_buckets[key].discard(chunk_id)
+            self.waiting.pop(chunk_id, None)
+        return False
+
+    def assign(self, chunks):
+        """Returns {chunk_id: canonical_id} for the chunks, out of (chunk_id, text, owner_id), that are near duplicates."""
+        signed = [(str(chunk_id), minhash(text), str(owner_id)) for chunk_id, text, owner_id in chunks]
+        duplicates = {}
+        with self.lock:
+            for chunk_id, signature, owner_id in signed:
+                if self._forget(chunk_id, signature) or signature is None:
+                    continue
+                keys = band_keys(signature, self.bands)
+                canonical_id = self._find(chunk_id, signature, keys)
+                if canonical_id is None:
+                    # Kept in memory, so later chunks of this run can match it before it is registered
+                    self.candidates[chunk_id] = (signature, keys)
+                    for key in keys:
+                        self.candidate_buckets.setdefault(key, set()).add(chunk_id)
+                    self.conn.execute("DELETE FROM duplicates WHERE chunk_id = ?", (chunk_id,))
+                    continue
+                duplicates[chunk_id] = canonical_id
+                if canonical_id in self.candidates:
+                    self.conn.execute("DELETE FROM duplicates WHERE chunk_id = ?", (chunk_id,))
+                    self.waiting.setdefault(canonical_id, []).append((chunk_id, owner_id))
+                else:
+                    # An unchanged row keeps its synced flag, so a rerun doesn't update the canonical vector again
+                    self.conn.execute(
+                        "INSERT INTO duplicates (chunk_id, canonical_id, owner_id) VALUES (?, ?, ?) "
+                        "ON CONFLICT (chunk_id) DO UPDATE SET canonical_id = excluded.canonical_id, "
+                        "owner_id = excluded.owner_id, synced = 0 "
+                        "WHERE canonical_id != excluded.canonical_id OR owner_id != excluded.owner_id",
+                        (chunk_id, canonical_id, owner_id))
+            self.conn.commit()
+            self.duplicates_found += len(duplicates)
+        return duplicates
+
+    def register(self, chunk_ids):
+        """Indexes the canonical candidates among `chunk_ids`, whose vectors are now upserted, with their duplicates."""
+        with self.lock:
+            chunk_ids = [str(chunk_id) for chunk_id in chunk_ids]
+            for chunk_id in chunk_ids:
+                if chunk_id not in self.candidates:
+                    continue
+                signature, keys = self.candidates.pop(chunk_id)
+                for key in keys:
+                    self.candidate_buckets[key].discard(chunk_id)
+                self.conn.execute("INSERT OR REPLACE INTO signatures VALUES (?, ?)", (chunk_id, signature.tobytes()))
+                self.conn.executemany("INSERT INTO buckets VALUES (?, ?)", [(key, chunk_id) for key in keys])
+                self.conn.executemany("INSERT OR REPLACE INTO duplicates (chunk_id, canonical_id, owner_id) VALUES (?, ?, ?)",
+                                      [(duplicate_id, chunk_id, owner_id)
+                                       for duplicate_id, owner_id in self.waiting.pop(chunk_id, [])])
+            # An upsert replaces the vector's metadata, so its duplicate owners have to be copied onto it again
+            self.conn.executemany("UPDATE duplicates SET synced = 0 WHERE canonical_id = ?",
+                                  [(chunk_id,) for chunk_id in chunk_ids])
+            self.conn.commit()
+
+    def owners(self, canonical_id):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT DISTINCT owner_id FROM duplicates WHERE canonical_id = ? ORDER BY owner_id", (canonical_id,)
+            )
+            return [owner_id for owner_id, in rows]
+
+    def sync_metadata(self, index, max_workers=4):
+        """Copies duplicate owners onto every canonical vector with unsynced duplicates; returns how many were updated.
+
+        `index` needs Pinecone's `update(id=..., set_metadata=...)`. A failed
+        update stays unsynced and is retried by the next call.
+        """
+        with self.lock:
+            # Duplicates added while the updates run (by another thread or shard) stay unsynced
+            pending = dict(self.conn.execute(
+                "SELECT canonical_id, MAX(rowid) FROM duplicates WHERE synced = 0 GROUP BY canonical_id"))
+        field = f"duplicate_{self.owner_field}s"
+
+        def update(canonical_id):
+            owners = self.owners(canonical_id)[:MAX_METADATA_IDS]
+            index.update(id=canonical_id, set_metadata={field: owners})
+            return canonical_id
+
+        synced = []
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for future in [pool.submit(update, canonical_id) for canonical_id in pending]:
+                try:
+                    synced.append(future.result())
+                except Exception as e:
+                    print(f"Updating duplicate metadata failed: {e}")
+        with self.lock:
+            self.conn.executemany("UPDATE duplicates SET synced = 1 WHERE canonical_id = ? AND rowid <= ?",
+                                  [(canonical_id, pending[canonical_id]) for canonical_id in synced])
+            self.conn.commit()
+        return len(synced)
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM signatures").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
@@ -0,0 +1,152 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from flair.data import Sentence
+
+MINI_BATCH_SIZE = 32
+
+
+class Entity:
+    def __init__(self, text, label):
+        self.text = text
+        self.label = label
+
+
+class Relation:
+    def __init__(self, label, head, tail):
+        self.label = label
+        self.head = head
+        self.tail = tail
+
+
+def sentence_entities_and_relations(sentence: Sentence):
+    """Reads the Entity/Relation objects off a sentence both models have predicted on."""
+    entities = [Entity(entity.data_point.text, entity.value) for entity in sentence.get_labels('ner')]
+
+    relations = []
+    for relation in sentence.get_labels('relation'):
+        head_text = relation.data_point.first.text
+        head_type = relation.data_point.first.get_label('ner').value
+        tail_text = relation.data_point.second.text
+        tail_type = relation.data_point.second.get_label('ner').value
+
+        head_entity = Entity(head_text, head_type)
+        tail_entity = Entity(tail_text, tail_type)
+        relations.append(Relation(relation.value, head_entity, tail_entity))
+
+    return entities, relations
+
+
+def extract_batch(sentence_texts, tagger, extractor, mini_batch_size=MINI_BATCH_SIZE):
+    """Runs NER and relation extraction over many sentences at once.
+
+    Sentences are sorted by length before being cut into mini-batches, so each
+    batch holds sentences of similar length and wastes little on padding.
+    Returns one (entities, relations) pair per input text, in input order;
+    empty texts get empty results without going through the models. Only
+    sentences in which the tagger found at least two entities go through
+    the relation extractor, since a relation needs two.
+    """
+    results = [([], []) for _ in sentence_texts]
+    sentences = {i: Sentence(text) for i, text in enumerate(sentence_texts) if text and text.strip()}
+    order = sorted(sentences, key=lambda i: len(sentences[i]))
+
+    for start in range(0, len(order), mini_batch_size):
+        batch = [sentences[i] for i in order[start:start + mini_batch_size]]
+        # Flair drops sentences without tokens; they can't yield anything anyway
+        batch = [sentence for sentence in batch if len(sentence)]
+        if not batch:
+            continue
+        tagger.predict(batch, mini_batch_size=mini_batch_size)
+        related = [sentence for sentence in batch if len(sentence.get_labels('ner')) >= 2]
+        if related:
+            extractor.predict(related, mini_batch_size=mini_batch_size)
+
+    for i, sentence in sentences.items():
+        if len(sentence):
+            results[i] = sentence_entities_and_relations(sentence)
+    return results
+
+
+###########################
+# Process pool            #
+###########################
+
+def load_models():
+    from flair.nn import Classifier
+    return Classifier.load('ner'), Classifier.load('relations')
+
+
+def compact_results(results):
+    """Turns per-sentence Entity/Relation objects into plain tuples for cheap pickling."""
+    return [
+        (
+            [(entity.text, entity.label) for entity in entities],
+            [(relation.label, relation.head.text, relation.head.label, relation.tail.text, relation.tail.label)
+             for relation in relations],
+        )
+        for entities, relations in results
+    ]
+
+
+def expand_results(compact):
+    return [
+        (
+            [Entity(text, label) for text, label in entities],
+            [Relation(label, Entity(head_text, head_label), Entity(tail_text, tail_label))
+             for label, head_text, head_label, tail_text, tail_label in relations],
+        )
+        for entities, relations in compact
+    ]
+
+
+_worker_models = None
+
+
+def _init_worker(torch_threads):
+    global _worker_models
+    import torch
+    torch.set_num_threads(torch_threads)
+    _worker_models = load_models()
+
+
+def _extract_in_worker(key, sentence_texts, mini_batch_size):
+    tagger, extractor = _worker_models
+    return key, compact_results(extract_batch(sentence_texts, tagger, extractor, mini_batch_size))
+
+
+class ParallelExtractor:
+    """Spreads per-document extraction over a pool of worker processes.
+
+    Each worker loads the NER and relation models once, in its initializer,
+    and limits torch to `torch_threads` intra-op threads so the workers don't
+    oversubscribe the cores between them. `max_pending` is how many documents
+    a caller should keep in flight (the SCOTUS pipeline runs that many NER
+    workers), so a long input stream isn't queued up all at once.
+    """
+
+    def __init__(self, workers=None, torch_threads=None, mini_batch_size=MINI_BATCH_SIZE, max_pending=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // self.workers)
+        self.mini_batch_size = mini_batch_size
+        self.max_pending = max_pending or self.workers * 2
+        # Forking a parent that already has torch threads (or the models) loaded can deadlock the workers
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.torch_threads,),
+        )
+
+    def submit(self, key, sentence_texts):
+        """Queues one document; the future resolves to (key, compact results)."""
+        return self.pool.submit(_extract_in_worker, key, list(sentence_texts), self.mini_batch_size)
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Marks the end of a queue's input
+_DONE = object()
+
+
+class Stage:
+    """One step of a Pipeline.
+
+    `fn` takes an item and returns the item for the next stage, or None to
+    drop it; with `fan_out` it returns an iterable of items instead.
+    Coroutine functions run on the event loop. Plain functions are treated as
+    blocking and run in `executor`, or in a thread pool of `concurrency`
+    threads owned by the stage, so a stage with concurrency 1 always runs on
+    the same thread.
+    """
+
+    def __init__(self, name, fn, concurrency=1, executor=None, fan_out=False):
+        self.name = name
+        self.fn = fn
+        self.concurrency = concurrency
+        self.executor = executor
+        self.fan_out = fan_out
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+
+
+class Pipeline:
+    """Runs items through a chain of stages connected by bounded queues.
+
+    Every stage runs `concurrency` workers, so blocking I/O in one stage
+    overlaps with work in the others. A full queue blocks the stage feeding
+    it, which keeps a fast stage from racing ahead of a slow one. A failure
+    is logged and counted against its stage, and the item is dropped.
+    """
+
+    def __init__(self, stages, queue_size=64):
+        self.stages = stages
+        self.queue_size = queue_size
+
+    async def _feed(self, source, queue):
+        loop = asyncio.get_running_loop()
+        if hasattr(source, '__aiter__'):
+            async for item in source:
+                await queue.put(item)
+        else:
+            # The source may block (e.g. reading the next record batch), so pull it off the loop
+            iterator = iter(source)
+            while (item := await loop.run_in_executor(None, next, iterator, _DONE)) is not _DONE:
+                await queue.put(item)
+        await queue.put(_DONE)
+
+    async def _call(self, stage, executor, item):
+        if asyncio.iscoroutinefunction(stage.fn):
+            return await stage.fn(item)
+        return await asyncio.get_running_loop().run_in_executor(executor, stage.fn, item)
+
+    async def _work(self, stage, executor, inbox, outbox, remaining):
+        while True:
+            item = await inbox.get()
+            if item is _DONE:
+                # Let sibling workers see the end too; the last one to stop tells the next stage
+                await inbox.put(_DONE)
+                remaining[stage.name] -= 1
+                if remaining[stage.name] == 0 and outbox is not None:
+                    await outbox.put(_DONE)
+                return
+
+            started = time.perf_counter()
+            try:
+                result = await self._call(stage, executor, item)
+            except Exception:
+                stage.failed += 1
+                logging.exception(f"Stage {stage.name} failed")
+                continue
+            finally:
+                stage.busy_seconds += time.perf_counter() - started
+            stage.processed += 1
+
+            if outbox is None or result is None:
+                continue
+            for next_item in (result if stage.fan_out else [result]):
+                await outbox.put(next_item)
+
+    async def run(self, source):
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        remaining = {stage.name: stage.concurrency for stage in self.stages}
+        owned = []
+        tasks = [asyncio.create_task(self._feed(source, queues[0]))]
+        for i, stage in enumerate(self.stages):
+            executor = stage.executor
+            if executor is None and not asyncio.iscoroutinefunction(stage.fn):
+                executor = ThreadPoolExecutor(max_workers=stage.concurrency, thread_name_prefix=stage.name)
+                owned.append(executor)
+            outbox = queues[i + 1] if i + 1 < len(self.stages) else None
+            for _ in range(stage.concurrency):
+                tasks.append(asyncio.create_task(self._work(stage, executor, queues[i], outbox, remaining)))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for executor in owned:
+                executor.shutdown()
+        return self.stats()
+
+    def run_sync(self, source):
+        return asyncio.run(self.run(source))
+
+    def stats(self):
+        return {
+            stage.name: {"processed": stage.processed, "failed": stage.failed, "busy_seconds": round(stage.busy_seconds, 3)}
+            for stage in self.stages
+        }
@@ -1,33 +1,48 @@
-import pandas as pd
 import logging
-import email
 import os
+import argparse
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
 from neo4j import GraphDatabase
-import textwrap
+from graph_writer import ensure_constraints
+from bulk_export import CsvGraphExporter
 from pinecone import Pinecone
 from openai import OpenAI
 from dotenv import load_dotenv, find_dotenv
+from embeddings import EmbeddingBatcher
+from embedding_cache import EmbeddingCache
+from near_duplicates import NearDuplicateIndex
+from vector_sink import UpsertSink
+from local_index import LocalIndex
+from chunker import iter_chunks
+from manifest import Manifest, content_hash
+from email_staging import is_staged, stage_emails, iter_staged_emails
+from pipeline import Pipeline, Stage
+from metrics import metrics_from_env, InstrumentedDriver, instrument_openai, instrument_index
 
 
-# Read the first 10 rows of "emails.csv"
-emails_df = pd.read_csv("emails.csv", skiprows=range(1, 10), nrows=40000)
-print(emails_df.count())
-
 # print(find_dotenv())
 # Load environment variables from .env file
 load_dotenv(find_dotenv())
 
 
-# Read Neo4j credentials from environment variables
-neo4j_username = os.getenv('NEO4J_USERNAME')
-neo4j_password = os.getenv('NEO4J_PASSWORD')
-neo4j_uri = os.getenv('NEO4J_URI')
-
-# print(neo4j_password)
-
-# Create a Neo4j driver instance
-driver = GraphDatabase.driver(neo4j_uri, auth=(neo4j_username, neo4j_password))
+# Clients are created by init() rather than at import, so the functions below
+# can also be driven with stand-ins (see benchmark.py)
+driver = None
+pindex = None
+upsert_sink = None
+manifest = None
+client = None
+embedding_cache = None
+embedder = None
+# Maps near-duplicate chunks (quoted and forwarded copies) onto one embedded chunk
+near_duplicates = None
+# Set in export mode; the graph then goes to neo4j-admin import CSVs instead of Neo4j
+graph_exporter = None
+# Set from METRICS_JSONL / METRICS_PROM; None leaves the clients unwrapped
+metrics = None
+metrics_exporter = None
 
 # Verify the connection
 def verify_connection(driver):
@@ -41,24 +56,104 @@ def verify_connection(driver):
     except Exception as e:
         print(f"An error occurred: {e}")
 
-# verify_connection(driver)
+def init(neo4j_driver=None, vector_index=None, openai_client=None, manifest_path=None, embedding_cache_path=None,
+         graph_export_dir=None, near_duplicates_path=None, metrics_suffix=""):
+    """Creates the Neo4j, Pinecone and OpenAI clients, unless they are passed in.
+
+    With `graph_export_dir` the graph is written as neo4j-admin import CSVs
+    there instead of to Neo4j, and no Neo4j connection is made.
+    `metrics_suffix` is appended to the METRICS_JSONL / METRICS_PROM paths.
+    """
+    global driver, pindex, upsert_sink, manifest, client, embedding_cache, embedder, metrics, metrics_exporter
+    global graph_exporter, near_duplicates
+    metrics, metrics_exporter = metrics_from_env(metrics_suffix)
+
+    if graph_export_dir:
+        graph_exporter = CsvGraphExporter(graph_export_dir, id_properties={"EmailAddress": "address"})
+        # An export keeps its own manifest, so it doesn't mark live graph stages done
+        manifest_path = manifest_path or os.path.join(graph_export_dir, 'manifest.sqlite')
+    else:
+        if neo4j_driver is None:
+            # Read Neo4j credentials from environment variables
+            neo4j_username = os.getenv('NEO4J_USERNAME')
+            neo4j_password = os.getenv('NEO4J_PASSWORD')
+            neo4j_uri = os.getenv('NEO4J_URI')
+            neo4j_driver = GraphDatabase.driver(neo4j_uri, auth=(neo4j_username, neo4j_password))
+        driver = InstrumentedDriver(metrics, neo4j_driver) if metrics else neo4j_driver
+        # verify_connection(driver)
+
+        # Uniqueness constraints back the MERGEs below with an index lookup
+        ensure_constraints(driver, [("EmailAddress", "address"), ("Email", "id")])
+
+    if vector_index is None and os.getenv('LOCAL_INDEX_DIR'):
+        # Offline runs keep the vectors in a local index instead of Pinecone
+        vector_index = LocalIndex(os.getenv('LOCAL_INDEX_DIR'))
+    if vector_index is None:
+        # Load Pinecone API key from environment variables
+        pinecone_api_key = os.getenv('PINECONE_API_KEY')
+        print(pinecone_api_key)
+
+        # Initialize Pinecone client
+        pc = Pinecone(api_key=pinecone_api_key)
 
+        # Create a Pinecone index
+        index_name = "enron"
+        vector_index = pc.Index(index_name)
+    pindex = instrument_index(metrics, vector_index) if metrics else vector_index
 
+    # Collects vectors across emails and upserts them in batches
+    upsert_sink = UpsertSink(pindex)
 
+    # Records which emails and chunks have finished each stage, so runs can
+    # resume or only reprocess changed emails (the mode is set from the CLI below)
+    manifest = Manifest(manifest_path or os.getenv('MANIFEST_PATH', 'enron.manifest.sqlite'))
 
+    client = openai_client or OpenAI()
+    if metrics:
+        instrument_openai(metrics, client)
+    embedding_cache = EmbeddingCache(
+        embedding_cache_path or os.getenv('EMBEDDING_CACHE_PATH', 'embeddings.cache.sqlite'),
+        max_bytes=int(os.getenv('EMBEDDING_CACHE_MAX_BYTES', 1024 ** 3)),
+    )
+    embedder = EmbeddingBatcher(client, cache=embedding_cache)
 
-# Load Pinecone API key from environment variables
-pinecone_api_key = os.getenv('PINECONE_API_KEY')
-print(pinecone_api_key)
+    # Set NEAR_DUPLICATES_PATH to an empty string to embed every chunk
+    near_duplicates_path = near_duplicates_path or os.getenv('NEAR_DUPLICATES_PATH', 'enron.near_duplicates.sqlite')
+    if near_duplicates_path:
+        near_duplicates = NearDuplicateIndex(near_duplicates_path, "transaction_id",
+                                             threshold=float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.9)))
 
-# Initialize Pinecone client
-pc = Pinecone(api_key=pinecone_api_key)
+    if metrics:
+        # Cache hits never reach OpenAI, so the embedder is timed as a whole too
+        metrics.instrument(embedder, "embed", "embed", items=lambda texts: len(texts))
+        metrics.watch("sink", lambda: {"upsert": {"upserted": upsert_sink.upserted, "failed_batches": len(upsert_sink.failures), "errors": len(upsert_sink.errors)}})
 
-# Create a Pinecone index
-index_name = "enron"
-pindex = pc.Index(index_name)
+def close():
+    if graph_exporter:
+        graph_exporter.close()
+    upsert_sink.join()
+    remaining = 0
+    if upsert_sink.failures:
+        logging.warning(f"Retrying {len(upsert_sink.failures)} failed upsert batches")
+        remaining = upsert_sink.retry_failed()
+        if remaining:
+            logging.error(f"{remaining} upsert batches still failed")
+    if upsert_sink.errors:
+        logging.error(f"{len(upsert_sink.errors)} upsert batches raised errors after being stored; see the log above")
+    if near_duplicates is not None:
+        # The canonical vectors are stored now, so their duplicate ids can be added
+        updated = near_duplicates.sync_metadata(pindex)
+        logging.info(f"Skipped {near_duplicates.duplicates_found} near-duplicate chunks, updated {updated} canonical vectors")
+        near_duplicates.close()
+    upsert_sink.close()
+    embedding_cache.close()
+    manifest.close()
+    if metrics_exporter:
+        metrics_exporter.close()
+    return remaining
 
 def save_transaction_graph(sender, recipient, subject, body, sent_date, transaction_id):
+    # Everything is MERGEd, so rewriting a changed or half-recorded email leaves one edge of each kind
     if not sender or not recipient:
         print("Error: Sender or recipient address is null.")
         return
@@ -68,9 +163,10 @@ def save_transaction_graph(sender, recipient, subject, body, sent_date, transact
             """
             MERGE (from:EmailAddress {address: $sender})
             MERGE (to:EmailAddress {address: $recipient})
-            MERGE (email:Email {id: $transaction_id, body: $body, subject: $subject, sent_date: $sent_date})
-            CREATE (from)-[:EMAIL_FROM]->(email)
-            CREATE (email)-[:EMAIL_TO]->(to)
+            MERGE (email:Email {id: $transaction_id})
+            SET email.body = $body, email.subject = $subject, email.sent_date = $sent_date
+            MERGE (from)-[:EMAIL_FROM]->(email)
+            MERGE (email)-[:EMAIL_TO]->(to)
             """,
             sender=sender,
             recipient=recipient,
@@ -80,38 +176,35 @@ def save_transaction_graph(sender, recipient, subject, body, sent_date, transact
             transaction_id=transaction_id
         )
 
-def recursive_text_splitter(document, max_chunk_size):
-    # Use textwrap to initially split the text into lines of max_chunk_size
-    chunks = textwrap.wrap(document, width=max_chunk_size)
-    
-    final_chunks = []
-    
-    for chunk in chunks:
-        if len(chunk) > max_chunk_size:
-            # If a chunk is still larger than max_chunk_size, split it further
-            final_chunks.extend(recursive_text_splitter(chunk, max_chunk_size))
-        else:
-            final_chunks.append(chunk)
-    
-    return final_chunks
-
-
-client = OpenAI()
-
-def get_embedding(text):
-    response = client.embeddings.create(
-        input=text,
-        model="text-embedding-3-small"
-    )
-    return response.data[0].embedding
+def export_transaction_graph(sender, recipient, subject, body, sent_date, transaction_id):
+    # Same graph as save_transaction_graph; repeated sends become one edge with a count
+    if not sender or not recipient:
+        print("Error: Sender or recipient address is null.")
+        return
+    graph_exporter.write_node("EmailAddress", sender, {})
+    graph_exporter.write_node("EmailAddress", recipient, {})
+    properties = {"body": body, "subject": subject, "sent_date": sent_date}
+    graph_exporter.write_node("Email", transaction_id, {key: value for key, value in properties.items() if value is not None})
+    graph_exporter.write_edge("EMAIL_FROM", "EmailAddress", sender, "Email", transaction_id, {})
+    graph_exporter.write_edge("EMAIL_TO", "Email", transaction_id, "EmailAddress", recipient, {})
+
+def drop_near_duplicates(chunks, owner_id):
+  # Near duplicates aren't embedded; their owner is added to the canonical vector's metadata at close()
+  if near_duplicates is None or not chunks:
+    return chunks
+  # Duplicates aren't marked in the manifest: a rerun assigns them again, and one whose canonical chunk changed gets embedded
+  duplicates = near_duplicates.assign([(chunk_id, chunk, owner_id) for chunk_id, chunk in chunks])
+  return [(chunk_id, chunk) for chunk_id, chunk in chunks if chunk_id not in duplicates]
 
-def save_transaction_embedding(email_from, email_to, email_subject, email_body, email_sent_date, transaction_id):
-  chunks = recursive_text_splitter(email_body, 512)
+def transaction_chunk_vectors(email_from, email_to, email_subject, email_body, email_sent_date, transaction_id):
+  chunks = [(f"{transaction_id}_{ordinal}", chunk) for ordinal, _, chunk in iter_chunks(email_body)]
+  needed = manifest.needs_many('chunk', 'embedding', [(chunk_id, content_hash(chunk)) for chunk_id, chunk in chunks])
+  chunks = [(chunk_id, chunk) for chunk_id, chunk in chunks if chunk_id in needed]
+  chunks = drop_near_duplicates(chunks, transaction_id)
+  embeddings = embedder.embed([chunk for _, chunk in chunks])
   
-  # Create an index if it doesn't exist  
-  for chunk in chunks:
-      chunk_id = transaction_id + "_" + str(chunks.index(chunk))
-      embedding = get_embedding(chunk)
+  vectors = []
+  for (chunk_id, chunk), embedding in zip(chunks, embeddings):
       metadata = {
           "email_from": email_from,
           "email_to": email_to,
@@ -125,40 +218,132 @@ def save_transaction_embedding(email_from, email_to, email_subject, email_body,
             if value is None:
                 metadata[key] = "null" 
 
-      pindex.upsert([(chunk_id, embedding, metadata)])
-  
+      vectors.append((chunk_id, embedding, metadata))
+  return vectors
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+def record_upserted_chunks(vectors):
+    manifest.mark_many('chunk', 'embedding', [(chunk_id, content_hash(metadata["chunk"])) for chunk_id, _, metadata in vectors])
+    if near_duplicates is not None:
+        near_duplicates.register([chunk_id for chunk_id, _, _ in vectors])
+  
 
+# Each staged email goes through graph -> embed -> upsert; the graph and
+# embedding stages wait on the network, so several emails are in flight at once.
 batch_size = 1000
-batch_count = 0
+processed = 0
 
-for index, row in emails_df.iterrows():
-    try:
-        msg = email.message_from_string(row['message'])
-        email_from = msg['From']
-        email_to = msg['To']
-        email_subject = msg['Subject']
-        email_body = msg.get_payload()
-        email_sent_date = msg['Date']
-        
-        logging.info(f"Processing email {index + 1}")
-        
-        import hashlib
-
-        hash_input = f"{email_from}{email_to}{email_subject}{email_sent_date}"
-        transaction_id = hashlib.sha256(hash_input.encode()).hexdigest()
-
-        save_transaction_graph(email_from, email_to, email_subject, email_body, email_sent_date, transaction_id)
-        save_transaction_embedding(email_from, email_to, email_subject, email_body, email_sent_date, transaction_id)
-        
-        # Batch processing
-        if (index + 1) % batch_size == 0:
-            batch_count += 1
-            logging.info(f"Processed {batch_count * batch_size} emails so far.")
-            
-    except Exception as e:
-        logging.error(f"Error processing email {index + 1}: {e}")
+def graph_stage(row):
+    email_hash = content_hash(row['email_from'], row['email_to'], row['email_subject'], row['email_sent_date'], row['email_body'])
+    if manifest.needs('email', row['transaction_id'], 'graph', email_hash):
+        save_graph = export_transaction_graph if graph_exporter else save_transaction_graph
+        save_graph(row['email_from'], row['email_to'], row['email_subject'], row['email_body'], row['email_sent_date'], row['transaction_id'])
+        try:
+            manifest.mark_done('email', row['transaction_id'], 'graph', email_hash)
+        except sqlite3.Error as e:
+            # The graph is written; unmarked, it is only rewritten on the next run, so the email still gets embedded
+            logging.warning(f"Recording the graph stage of {row['transaction_id']} failed: {e}")
+    return row
+
+def embed_stage(row):
+    row['vectors'] = transaction_chunk_vectors(row['email_from'], row['email_to'], row['email_subject'], row['email_body'], row['email_sent_date'], row['transaction_id'])
+    return row
+
+def upsert_stage(row):
+    global processed
+    upsert_sink.add_many(row.pop('vectors'))
+    processed += 1
+    if processed % batch_size == 0:
+        logging.info(f"Processed {processed} emails so far.")
+
+def email_pipeline():
+    return Pipeline([
+        Stage("graph", graph_stage, concurrency=int(os.getenv('GRAPH_CONCURRENCY', 4))),
+        Stage("embed", embed_stage, concurrency=int(os.getenv('EMBED_CONCURRENCY', 4))),
+        Stage("upsert", upsert_stage),
+    ])
+
+def ingest(staging_dir, shard=None, shards=1):
+    """Runs the staged emails (or one shard of them) through the pipeline and returns its stats."""
+    pipeline = email_pipeline()
+    if metrics:
+        metrics.watch("stage", pipeline.stats)
+    return pipeline.run_sync(iter_staged_emails(staging_dir, shard=shard, shards=shards))
+
+def run_shard(shard, shards, manifest_mode, staging_dir):
+    """Ingests one shard with its own clients, in a worker process; returns its summary."""
+    # A pool worker can run more than one shard, so nothing set up for the previous one is reused
+    logging.basicConfig(level=logging.INFO, format=f'%(asctime)s - shard {shard} - %(levelname)s - %(message)s', force=True)
+    # Each shard exports its own metrics files
+    init(metrics_suffix=f".shard{shard}")
+    manifest.mode = manifest_mode
+    upsert_sink.on_upserted = record_upserted_chunks
+    stats = ingest(staging_dir, shard, shards)
+    remaining = close()
+    return {"stages": stats, "failed_upsert_batches": remaining, "upsert_errors": len(upsert_sink.errors)}
+
+def merge_summaries(summaries):
+    merged = {"shards": len(summaries), "processed": 0, "failed": 0, "failed_upsert_batches": 0, "upsert_errors": 0, "stages": {}}
+    for summary in summaries:
+        merged["failed_upsert_batches"] += summary["failed_upsert_batches"]
+        merged["upsert_errors"] += summary["upsert_errors"]
+        for name, stats in summary["stages"].items():
+            totals = merged["stages"].setdefault(name, {})
+            for key, value in stats.items():
+                totals[key] = round(totals.get(key, 0) + value, 3)
+    stages = list(merged["stages"].values())
+    if stages:
+        merged["processed"] = stages[-1]["processed"]
+        merged["failed"] = sum(stats["failed"] for stats in stages)
+    return merged
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest Enron emails into Neo4j and Pinecone")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--resume", action="store_true", help="skip emails and chunks whose stages already completed")
+    mode.add_argument("--only-changed", action="store_true", help="only reprocess emails whose content changed since they completed")
+    mode.add_argument("--export-csv", metavar="DIR", help="write the graph as neo4j-admin import CSVs to DIR instead of Neo4j")
+    parser.add_argument("--shards", type=int, default=int(os.getenv('EMAIL_SHARDS', 1)),
+                        help="split the emails by transaction_id across this many worker processes")
+    args = parser.parse_args()
+    if args.export_csv and args.shards > 1:
+        parser.error("--export-csv writes one set of files and can't be combined with --shards")
+    if os.getenv('LOCAL_INDEX_DIR') and args.shards > 1:
+        parser.error("a local index (LOCAL_INDEX_DIR) is written by one process and can't be combined with --shards")
+    manifest_mode = 'resume' if args.resume else 'only-changed' if args.only_changed else 'all'
+
+    # Configure logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    # emails.csv is parsed once into a Parquet staging dataset; later runs read
+    # the staged columns directly and skip the raw CSV parse.
+    staging_dir = os.getenv('EMAIL_STAGING_DIR', 'emails_staged')
+    if not is_staged(staging_dir):
+        email_nrows = os.getenv('EMAIL_NROWS', '40000')
+        staged = stage_emails(
+            "emails.csv",
+            staging_dir,
+            workers=args.shards,
+            skiprows=range(1, 10),
+            nrows=int(email_nrows) if email_nrows else None,
+        )
+        logging.info(f"Staged {staged} emails in {staging_dir}")
+
+    if args.shards > 1:
+        # Every email of a transaction_id lands on the same shard, and each
+        # shard runs with its own Neo4j driver, Pinecone sink and manifest connection
+        with ProcessPoolExecutor(max_workers=args.shards) as pool:
+            futures = [pool.submit(run_shard, shard, args.shards, manifest_mode, staging_dir) for shard in range(args.shards)]
+            summary = merge_summaries([future.result() for future in futures])
+        logging.info(f"Sharded run finished: {summary}")
+        return
+
+    init(graph_export_dir=args.export_csv)
+    manifest.mode = manifest_mode
+    upsert_sink.on_upserted = record_upserted_chunks
+    stats = ingest(staging_dir)
+    logging.info(f"Pipeline finished: {stats}")
+    close()
 
 
+if __name__ == "__main__":
+    main()
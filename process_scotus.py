@@ -1,63 +1,229 @@
-from tinydb import TinyDB, where
 import os
+import json
+import argparse
 from dotenv import load_dotenv
 from neo4j import GraphDatabase
-import textwrap
 from openai import OpenAI
 import os
 from pinecone import Pinecone
-import re
 from datetime import datetime
-from flair.data import Sentence
-from flair.nn import Classifier
-import hashlib
 from tqdm import tqdm
-import random
+from graph_writer import GraphWriter, node_rows_query, edge_rows_query, ensure_constraints
+from bulk_export import CsvGraphExporter
+from embeddings import EmbeddingBatcher
+from embedding_cache import EmbeddingCache
+from near_duplicates import NearDuplicateIndex
+from vector_sink import UpsertSink
+from local_index import LocalIndex
+from chunker import iter_chunks
+from doc_store import DocumentStore, import_tinydb
+from manifest import Manifest, content_hash
+from ner import Entity, Relation, extract_batch, load_models, expand_results, ParallelExtractor
+from sentences import ner_sentences
+from entity_index import EntityIndex
+from pipeline import Pipeline, Stage
+import asyncio
+import threading
+from metrics import metrics_from_env, InstrumentedDriver, instrument_openai, instrument_index, instrument_models, instrument_collection
 load_dotenv()
 ###########################
 # Databases               #
 ###########################
-# Load Pinecone API key from environment variables
-pinecone_api_key = os.getenv('PINECONE_API_KEY')
-print(pinecone_api_key)
-
-# Initialize Pinecone client
-pc = Pinecone(api_key=pinecone_api_key)
-
-# Create a Pinecone index
-index_name = "scotus"
-pindex = pc.Index(index_name)
-
-# Load the NER and relation classifiers
-tagger = Classifier.load('ner')
-extractor = Classifier.load('relations')
-
-client = OpenAI()
-
-# Read Neo4j credentials from environment variables
-neo4j_username = os.getenv('NEO4J_USERNAME')
-neo4j_password = os.getenv('NEO4J_PASSWORD')
-neo4j_uri = os.getenv('NEO4J_URI')
-
-# Create a Neo4j driver instance
-driver = GraphDatabase.driver(neo4j_uri, auth=(neo4j_username, neo4j_password))
+# Clients and stores are created by init() rather than at import, so the
+# functions below can also be driven with stand-ins (see benchmark.py)
+pindex = None
+upsert_sink = None
+client = None
+embedding_cache = None
+embedder = None
+# Maps near-duplicate chunks onto one embedded chunk
+near_duplicates = None
+driver = None
+graph_writer = None
+doc_store = None
+opinions_db = None
+cases_db = None
+manifest = None
+# Canonical ids for NER entities, shared by every opinion of every run
+entity_index = None
+# Set from METRICS_JSONL / METRICS_PROM; None leaves the clients unwrapped
+metrics = None
+metrics_exporter = None
+
+# NER settings. With NER_WORKERS set, extraction runs in a process pool whose
+# workers load their own copies of the models instead.
+ner_mini_batch_size = int(os.getenv('NER_MINI_BATCH_SIZE', 32))
+ner_workers = int(os.getenv('NER_WORKERS', 0))
+ner_torch_threads = int(os.getenv('NER_TORCH_THREADS', 0)) or None
+# How many opinion sentences were segmented, dropped by the pre-filter, run
+# through NER, and left out of relation extraction (fewer than two entities)
+ner_counts = {"sentences": 0, "prefiltered": 0, "tagged": 0, "relations_skipped": 0}
+ner_counts_lock = threading.Lock()
+tagger = extractor = None
+
+# Every label the graph MATCHes/MERGEs on by id; each gets a uniqueness constraint at startup
+GRAPH_LABELS = ["Case", "Opinion", "Party", "Advocate", "Justice", "PER", "LOC", "ORG", "MISC"]
+# The TinyDB exports process_raw.ipynb writes, by the collection they're imported into
+TINYDB_EXPORTS = {"opinions": "opinions.db.json", "cases": "cases.db.json"}
+
+def init(neo4j_driver=None, vector_index=None, openai_client=None, ner_models=None,
+         doc_store_path=None, manifest_path=None, embedding_cache_path=None, graph_export_dir=None,
+         near_duplicates_path=None, entity_index_path=None, tinydb_paths=None):
+  """Creates the Neo4j, Pinecone and OpenAI clients, the NER models and the
+  local stores; any client or (tagger, extractor) pair passed in is used as is.
+
+  With `graph_export_dir` the graph is written as neo4j-admin import CSVs
+  there instead of to Neo4j, and no Neo4j connection is made.
+  `tinydb_paths` maps "opinions"/"cases" to the TinyDB exports to import
+  (TINYDB_EXPORTS by default); pass {} to import nothing.
+  """
+  global pindex, upsert_sink, tagger, extractor, client, embedding_cache, embedder, near_duplicates
+  global driver, graph_writer, doc_store, opinions_db, cases_db, manifest, metrics, metrics_exporter, entity_index
+  metrics, metrics_exporter = metrics_from_env()
+
+  if vector_index is None and os.getenv('LOCAL_INDEX_DIR'):
+    # Offline runs keep the vectors in a local index instead of Pinecone
+    vector_index = LocalIndex(os.getenv('LOCAL_INDEX_DIR'))
+  if vector_index is None:
+    # Load Pinecone API key from environment variables
+    pinecone_api_key = os.getenv('PINECONE_API_KEY')
+    print(pinecone_api_key)
+
+    # Initialize Pinecone client
+    pc = Pinecone(api_key=pinecone_api_key)
+
+    # Create a Pinecone index
+    index_name = "scotus"
+    vector_index = pc.Index(index_name)
+  pindex = instrument_index(metrics, vector_index) if metrics else vector_index
+
+  # Collects vectors across chunks and opinions and upserts them in batches
+  upsert_sink = UpsertSink(pindex)
+
+  # Load the NER and relation classifiers, unless the process pool does it
+  if ner_models is not None:
+    tagger, extractor = ner_models
+  elif not ner_workers:
+    tagger, extractor = load_models()
+  if metrics:
+    # Pooled workers run their own models in other processes and aren't covered
+    instrument_models(metrics, tagger, extractor)
+
+  client = openai_client or OpenAI()
+  if metrics:
+    instrument_openai(metrics, client)
+  embedding_cache = EmbeddingCache(
+      embedding_cache_path or os.getenv('EMBEDDING_CACHE_PATH', 'embeddings.cache.sqlite'),
+      max_bytes=int(os.getenv('EMBEDDING_CACHE_MAX_BYTES', 1024 ** 3)),
+  )
+  embedder = EmbeddingBatcher(client, cache=embedding_cache)
+  # Syllabus and boilerplate passages repeat across opinions; only the first copy is embedded.
+  # Set NEAR_DUPLICATES_PATH to an empty string to embed every chunk.
+  near_duplicates_path = near_duplicates_path or os.getenv('NEAR_DUPLICATES_PATH', 'scotus.near_duplicates.sqlite')
+  if near_duplicates_path:
+    near_duplicates = NearDuplicateIndex(near_duplicates_path, "case_id",
+                                         threshold=float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.9)))
+  if metrics:
+    # Cache hits never reach OpenAI, so the embedder is timed as a whole too
+    metrics.instrument(embedder, "embed", "embed", items=lambda texts: len(texts))
+
+  if graph_export_dir:
+    # Same add_node/add_edge interface, but streamed to CSV files for neo4j-admin
+    graph_writer = CsvGraphExporter(graph_export_dir)
+  else:
+    if neo4j_driver is None:
+      # Read Neo4j credentials from environment variables
+      neo4j_username = os.getenv('NEO4J_USERNAME')
+      neo4j_password = os.getenv('NEO4J_PASSWORD')
+      neo4j_uri = os.getenv('NEO4J_URI')
+      neo4j_driver = GraphDatabase.driver(neo4j_uri, auth=(neo4j_username, neo4j_password))
+    driver = InstrumentedDriver(metrics, neo4j_driver) if metrics else neo4j_driver
+    ensure_constraints(driver, [(label, "id") for label in GRAPH_LABELS])
+
+    # Buffers node/edge writes and flushes them as batched UNWIND transactions.
+    # Repeated nodes are skipped and repeated edges are summed into one write, so
+    # a larger buffer (more rows, longer delay) collapses more of them.
+    graph_writer = GraphWriter(
+        driver,
+        max_rows=int(os.getenv('GRAPH_MAX_ROWS', 5000)),
+        max_delay=float(os.getenv('GRAPH_MAX_DELAY', 5.0)),
+        max_seen_nodes=int(os.getenv('GRAPH_MAX_SEEN_NODES', 1_000_000)),
+    )
 
-opinions_db = TinyDB('opinions.db.json')
-cases_db = TinyDB('cases.db.json')
+  # Cases and opinions live in an indexed SQLite store; the TinyDB exports are
+  # imported into it until an import has completed (and again if a file changes).
+  doc_store = DocumentStore(doc_store_path or os.getenv('DOC_STORE_PATH', 'scotus.sqlite'))
+  opinions_db = doc_store.collection('opinions', 'id')
+  cases_db = doc_store.collection('cases', 'ID')
+  if metrics:
+    instrument_collection(metrics, opinions_db)
+    instrument_collection(metrics, cases_db)
+  tinydb_paths = TINYDB_EXPORTS if tinydb_paths is None else tinydb_paths
+  for collection, tinydb_path in [(opinions_db, tinydb_paths.get("opinions")), (cases_db, tinydb_paths.get("cases"))]:
+    if tinydb_path and os.path.exists(tinydb_path) and not collection.imported(tinydb_path):
+      print(f"Imported {import_tinydb(tinydb_path, collection)} documents from {tinydb_path}")
+
+  # Records which cases, opinions and chunks have finished each stage, so runs
+  # can resume or only reprocess changed content (the mode is set in main).
+  # An export keeps its own manifest, so it doesn't mark live graph stages done.
+  if graph_export_dir and not manifest_path:
+    manifest_path = os.path.join(graph_export_dir, 'manifest.sqlite')
+  manifest = Manifest(manifest_path or os.getenv('MANIFEST_PATH', 'scotus.manifest.sqlite'))
+  upsert_sink.on_upserted = record_upserted_chunks
+  # "Justice Scalia", "SCALIA, J." and "Scalia" all resolve to one entity node
+  entity_index = EntityIndex(entity_index_path or os.getenv('ENTITY_INDEX_PATH', 'scotus.entities.sqlite'))
+  if metrics:
+    metrics.watch("sink", lambda: {
+      "upsert": {"upserted": upsert_sink.upserted, "failed_batches": len(upsert_sink.failures), "errors": len(upsert_sink.errors)},
+      "graph": {"skipped_nodes": graph_writer.skipped_nodes, "merged_edges": graph_writer.merged_edges},
+    })
+    metrics.watch("ner", lambda: {"sentences": dict(ner_counts)})
+
+def close():
+  graph_writer.close()
+  print(f"Skipped {graph_writer.skipped_nodes} repeated nodes, merged {graph_writer.merged_edges} repeated edges")
+  upsert_sink.join()
+  if upsert_sink.failures:
+    print(f"Retrying {len(upsert_sink.failures)} failed upsert batches")
+    remaining = upsert_sink.retry_failed()
+    if remaining:
+      print(f"{remaining} upsert batches still failed")
+  if upsert_sink.errors:
+    print(f"{len(upsert_sink.errors)} upsert batches raised errors after being stored; see the log above")
+  if near_duplicates is not None:
+    # The canonical vectors are stored now, so their duplicate ids can be added
+    updated = near_duplicates.sync_metadata(pindex)
+    print(f"Skipped {near_duplicates.duplicates_found} near-duplicate chunks, updated {updated} canonical vectors")
+    near_duplicates.close()
+  upsert_sink.close()
+  print(f"NER ran on {ner_counts['tagged']} of {ner_counts['sentences']} sentences "
+        f"({ner_counts['prefiltered']} skipped by the pre-filter), "
+        f"relation extraction skipped on {ner_counts['relations_skipped']}")
+  print(f"Resolved {entity_index.lookups} entity mentions to {len(entity_index)} entities ({entity_index.aliased} new aliases)")
+  entity_index.close()
+  embedding_cache.close()
+  manifest.close()
+  doc_store.close()
+  if metrics_exporter:
+    metrics_exporter.close()
 
 ###########################
 # Classes                 #
 ###########################
 
+# Node/Edge are written through parameterized query templates that only
+# depend on labels and property keys (see graph_writer).
 class Node:
     def __init__(self, id, label, properties):
-        self.id = escape_neo4j_string(id)
-        self.label = escape_neo4j_string(label)
-        self.properties = {k: escape_neo4j_string(v) if isinstance(v, str) else v for k, v in properties.items()}
+        self.id = id
+        self.label = label
+        self.properties = dict(properties)
+
+    def row(self):
+        return {"id": str(self.id), "properties": self.properties}
 
     def create_node_query(self):
-        props = ', '.join([f"{key}: ${key}" for key in self.properties.keys()])
-        return f"MERGE (n:{self.label} {{id: '{self.id}', {props}}})"
+        return node_rows_query(self.label, tuple(sorted(self.properties.keys())))
 
     def create_node(self):
         if not self.id or not self.label or any(value is None for value in self.properties.values()):
@@ -65,22 +231,25 @@ class Node:
             return
         query = self.create_node_query()
         with driver.session() as session:
-            session.run(query, **self.properties)
+            session.run(query, rows=[self.row()])
 
 class Edge:
-    def __init__(self, from_node_id, to_node_id, relationship_type, properties, increment_property):
-        self.from_node_id = escape_neo4j_string(from_node_id)
-        self.to_node_id = escape_neo4j_string(to_node_id)
-        self.relationship_type = escape_neo4j_string(relationship_type)
-        self.properties = {k: escape_neo4j_string(v) if isinstance(v, str) else v for k, v in properties.items()}
+    def __init__(self, from_node_id, to_node_id, relationship_type, properties, increment_property, from_label=None, to_label=None):
+        self.from_node_id = from_node_id
+        self.to_node_id = to_node_id
+        self.relationship_type = relationship_type
+        self.properties = dict(properties)
         self.increment_property = increment_property
+        # Endpoint labels let the MATCH use the label's id index instead of scanning all nodes
+        self.from_label = from_label
+        self.to_label = to_label
+
+    def row(self):
+        return {"from_id": str(self.from_node_id), "to_id": str(self.to_node_id), "properties": self.properties, "delta": 1}
 
     def create_edge_query(self):
-        props = ', '.join([f"{key}: ${key}" for key in self.properties.keys()])
-        return (f"MATCH (a {{id: '{self.from_node_id}'}}), (b {{id: '{self.to_node_id}'}}) "
-                f"MERGE (a)-[r:{self.relationship_type} {{{props}}}]->(b) "
-                f"ON CREATE SET r.{self.increment_property} = 1 "
-                f"ON MATCH SET r.{self.increment_property} = r.{self.increment_property} + 1")
+        return edge_rows_query(self.relationship_type, tuple(sorted(self.properties.keys())), self.increment_property,
+                               self.from_label, self.to_label)
 
     def create_edge(self):
         if any(value is None for value in self.properties.values()):
@@ -88,9 +257,13 @@ class Edge:
             return
         query = self.create_edge_query()
         with driver.session() as session:
-            session.run(query, **self.properties)
+            session.run(query, rows=[self.row()])
 
+# The model classes use __slots__ and keep their raw dict, so nested lists
+# (votes, advocates, opinions, roles) are only built when first accessed.
 class Citation:
+    __slots__ = ('volume', 'page', 'year')
+
     def __init__(self, data):
         self.volume = data.get('volume')
         self.page = data.get('page')
@@ -100,6 +273,8 @@ class Citation:
         return f"{self.volume} U.S. {self.page} ({self.year})"
 
 class Advocate:
+    __slots__ = ('name', 'description')
+
     def __init__(self, data):
         advocate_data = data.get('advocate', {})
         self.name = advocate_data.get('name') if advocate_data else None
@@ -109,16 +284,27 @@ class Advocate:
         return f"{self.name}: {self.description}"
 
 class Decision:
+    __slots__ = ('data', 'description', 'winning_party', 'decision_type', '_votes')
+
     def __init__(self, data):
+        self.data = data
         self.description = data.get('description')
         self.winning_party = data.get('winning_party')
         self.decision_type = data.get('decision_type')
-        self.votes = [Vote(v) for v in data.get('votes', []) if v]
+        self._votes = None
+
+    @property
+    def votes(self):
+        if self._votes is None:
+            self._votes = [Vote(v) for v in self.data.get('votes', []) if v]
+        return self._votes
 
     def __str__(self):
         return f"{self.description} - Winner: {self.winning_party}"
 
 class Vote:
+    __slots__ = ('member', 'vote', 'opinion_type', 'href')
+
     def __init__(self, data):
         self.member = Justice(data.get('member', {}))
         self.vote = data.get('vote')
@@ -129,15 +315,26 @@ class Vote:
         return f"{self.member.name}: {self.vote}"
 
 class Justice:
+    __slots__ = ('data', 'id', 'name', '_roles')
+
     def __init__(self, data):
+        self.data = data
         self.id = data.get('ID')
         self.name = data.get('name')
-        self.roles = [Role(r) for r in data.get('roles', []) if r]
+        self._roles = None
+
+    @property
+    def roles(self):
+        if self._roles is None:
+            self._roles = [Role(r) for r in self.data.get('roles', []) if r]
+        return self._roles
 
     def __str__(self):
         return self.name
 
 class Role:
+    __slots__ = ('type', 'date_start', 'date_end', 'role_title')
+
     def __init__(self, data):
         self.type = data.get('type')
         self.date_start = datetime.fromtimestamp(data.get('date_start', 0))
@@ -148,11 +345,23 @@ class Role:
         return f"{self.role_title} ({self.date_start.year}-{self.date_end.year})"
 
 class DecidedBy:
+    __slots__ = ('data', 'name', '_members')
+
     def __init__(self, data):
+        self.data = data
         self.name = data.get('name')
-        self.members = [Justice(j) for j in data.get('members', []) if j]
+        self._members = None
+
+    @property
+    def members(self):
+        if self._members is None:
+            self._members = [Justice(j) for j in self.data.get('members', []) if j]
+        return self._members
 
 class WrittenOpinion:
+    __slots__ = ('id', 'title', 'author', 'type_value', 'type_label', 'justia_opinion_id', 'justia_opinion_url',
+                 'judge_full_name', 'judge_last_name', 'title_overwrite', 'href')
+
     def __init__(self, data):
         self.id = data.get('id')
         self.title = data.get('title')
@@ -170,7 +379,12 @@ class WrittenOpinion:
         return f"{self.title} ({self.type_label})"
 
 class Case:
+    __slots__ = ('data', 'id', 'name', 'href', 'docket_number', 'first_party', 'first_party_label', 'second_party',
+                 'second_party_label', 'term', 'justia_url', '_decided_date', '_citation', '_advocates', '_decisions',
+                 '_decided_by', '_written_opinion')
+
     def __init__(self, data):
+        self.data = data
         self.id = data.get('ID')
         self.name = data.get('name')
         self.href = data.get('href')
@@ -179,15 +393,51 @@ class Case:
         self.first_party_label = data.get('first_party_label')
         self.second_party = data.get('second_party')
         self.second_party_label = data.get('second_party_label')
-        self.decided_date = datetime.fromtimestamp(data.get('timeline', [{}])[0].get('dates', [0])[0])
-        self.citation = Citation(data.get('citation', {}))
-        self.advocates = [Advocate(a) for a in data.get('advocates', []) if a] if data.get('advocates') else []
-        self.decisions = [Decision(d) for d in data.get('decisions', []) if d] if data.get('decisions') else []
-        self.decided_by = DecidedBy(data.get('decided_by', {})) if data.get('decided_by') else None
         self.term = data.get('term')
         self.justia_url = data.get('justia_url')
-        self.written_opinion = [WrittenOpinion(o) for o in data.get('written_opinion', []) if o] if data.get('written_opinion') else []
-
+        self._decided_date = None
+        self._citation = None
+        self._advocates = None
+        self._decisions = None
+        self._decided_by = None
+        self._written_opinion = None
+
+    @property
+    def decided_date(self):
+        if self._decided_date is None:
+            self._decided_date = datetime.fromtimestamp(self.data.get('timeline', [{}])[0].get('dates', [0])[0])
+        return self._decided_date
+
+    @property
+    def citation(self):
+        if self._citation is None:
+            self._citation = Citation(self.data.get('citation', {}))
+        return self._citation
+
+    @property
+    def advocates(self):
+        if self._advocates is None:
+            self._advocates = [Advocate(a) for a in self.data.get('advocates') or [] if a]
+        return self._advocates
+
+    @property
+    def decisions(self):
+        if self._decisions is None:
+            self._decisions = [Decision(d) for d in self.data.get('decisions') or [] if d]
+        return self._decisions
+
+    @property
+    def decided_by(self):
+        # False marks "looked up, not present", since None means "not parsed yet"
+        if self._decided_by is None:
+            self._decided_by = DecidedBy(self.data['decided_by']) if self.data.get('decided_by') else False
+        return self._decided_by or None
+
+    @property
+    def written_opinion(self):
+        if self._written_opinion is None:
+            self._written_opinion = [WrittenOpinion(o) for o in self.data.get('written_opinion') or [] if o]
+        return self._written_opinion
 
     def __str__(self):
         return f"{self.name} ({self.term})"
@@ -208,50 +458,29 @@ class Case:
             for vote in decision.votes:
                 print(f"    {vote}")
 
-class Entity:
-    def __init__(self, text, label):
-        self.text = text
-        self.label = label
-
-class Relation:
-    def __init__(self, label, head, tail):
-        self.label = label
-        self.head = head
-        self.tail = tail
-
 ###########################
 # Functions               #
 ###########################
 
-def recursive_text_splitter(document, max_chunk_size):
-    # Use textwrap to initially split the text into lines of max_chunk_size
-    chunks = textwrap.wrap(document, width=max_chunk_size)
-    
-    final_chunks = []
-    
-    for chunk in chunks:
-        if len(chunk) > max_chunk_size:
-            # If a chunk is still larger than max_chunk_size, split it further
-            final_chunks.extend(recursive_text_splitter(chunk, max_chunk_size))
-        else:
-            final_chunks.append(chunk)
-    
-    return final_chunks
-  
-def get_embedding(text):
-    response = client.embeddings.create(
-        input=text,
-        model="text-embedding-3-small"
-    )
-    return response.data[0].embedding  
+def drop_near_duplicates(chunks, case_id):
+    # Near duplicates aren't embedded; their case is added to the canonical vector's metadata at close()
+    if near_duplicates is None or not chunks:
+        return chunks
+    # Duplicates aren't marked in the manifest: a rerun assigns them again, and one whose canonical chunk changed gets embedded
+    duplicates = near_duplicates.assign([(chunk_id, chunk, case_id) for chunk_id, chunk in chunks])
+    return [(chunk_id, chunk) for chunk_id, chunk in chunks if chunk_id not in duplicates]
   
-def save_opinion_embedding(case_id, opinion_text):
-    chunks = recursive_text_splitter(opinion_text, 512)
+def opinion_chunk_vectors(case_id, opinion_text, opinion_id=None):
+    # A case can have several opinions, so the opinion id keeps their chunk ids apart
+    id_prefix = f"{case_id}_{opinion_id}" if opinion_id is not None else str(case_id)
+    chunks = [(f"{id_prefix}_{ordinal}", chunk) for ordinal, _, chunk in iter_chunks(opinion_text)]
+    needed = manifest.needs_many('chunk', 'embedding', [(chunk_id, content_hash(chunk)) for chunk_id, chunk in chunks])
+    chunks = [(chunk_id, chunk) for chunk_id, chunk in chunks if chunk_id in needed]
+    chunks = drop_near_duplicates(chunks, case_id)
+    embeddings = embedder.embed([chunk for _, chunk in chunks])
     
-    # Create an index if it doesn't exist  
-    for chunk in chunks:
-        chunk_id = str(case_id) + "_" + str(chunks.index(chunk))
-        embedding = get_embedding(chunk)        
+    vectors = []
+    for (chunk_id, chunk), embedding in zip(chunks, embeddings):
         metadata = {
             "case_id": str(case_id),
             "chunk": chunk
@@ -261,178 +490,269 @@ def save_opinion_embedding(case_id, opinion_text):
             if value is None:
                 metadata[key] = "null" 
 
-        pindex.upsert([(chunk_id, embedding, metadata)])  
-
-def escape_neo4j_string(value):
-    if isinstance(value, str):
-        return re.sub(r"(['\"\\])", r"\\\1", value)
-    return value
-
-def extract_entities_and_relations(sentence_text):
-    if not sentence_text:
-        return [], []
-    
-    sentence = Sentence(sentence_text)
-    
-    entities = []
-
-    tagger.predict(sentence)
-    for entity in sentence.get_labels('ner'):
-        entities.append(Entity(entity.data_point.text, entity.value))
-    
-    extractor.predict(sentence)
-    
-    relations = []
-
+        vectors.append((chunk_id, embedding, metadata))
+    return vectors
 
-# Process relations (edges)
-    for relation in sentence.get_labels('relation'):
-        
-        head_text = relation.data_point.first.text
-        head_type = relation.data_point.first.get_label('ner').value
-        tail_text = relation.data_point.second.text
-        tail_type = relation.data_point.second.get_label('ner').value
-        
-        head_entity = Entity(head_text, head_type)
-        tail_entity = Entity(tail_text, tail_type)
-        relations.append(Relation(relation.value, head_entity, tail_entity))
-            
-    return entities, relations
+def canonical_entity(entity: Entity):
+    # (id, name) of the entity node; the raw text when no index is loaded
+    if entity_index is None:
+        return entity.text, entity.text
+    return entity_index.canonical(entity.text, entity.label)
 
 def entity_to_node(entity: Entity):
-    return Node(entity.text, entity.label, {"name": entity.text})  
-
-def relation_to_nodes_and_edges(relation: Relation):
-    head_node = entity_to_node(relation.head)
-    tail_node = entity_to_node(relation.tail)      
-    relation_edge = Edge(head_node.id, tail_node.id, relation.label, {}, "count")    
-    return [[head_node, tail_node], relation_edge]
-
-def calculate_hash(text):
-    return hashlib.md5(text.encode()).hexdigest()
-
-def process_scotus_opinion(writtenOpinion: WrittenOpinion, case_node: Node):
-    opinion = opinions_db.get(where('id') == writtenOpinion.id)
-    if not opinion or "content" not in opinion:
-        return [], []
-    
-    save_opinion_embedding(case_node.id, opinion["content"])
-    sentences = opinion['content'].split('. ')
-    
+    entity_id, name = canonical_entity(entity)
+    return Node(entity_id, entity.label, {"name": name})  
+
+def relation_to_edge(relation: Relation, head_node: Node, tail_node: Node):
+    return Edge(head_node.id, tail_node.id, relation.label, {}, "count", head_node.label, tail_node.label)
+
+def record_upserted_chunks(vectors):
+    manifest.mark_many('chunk', 'embedding', [(chunk_id, content_hash(metadata["chunk"])) for chunk_id, _, metadata in vectors])
+    if near_duplicates is not None:
+        near_duplicates.register([chunk_id for chunk_id, _, _ in vectors])
+
+def count_ner(**counts):
+    with ner_counts_lock:
+        for name, count in counts.items():
+            ner_counts[name] += count
+
+def opinion_sentences(writtenOpinion: WrittenOpinion, opinion):
+    # Returns (sentences, content hash) for NER; the sentences are empty if
+    # NER already ran on this content. Sentences that can't contain an entity
+    # (headings, citations, short or lowercase fragments) are left out.
+    opinion_hash = content_hash(opinion["content"])
+    if not manifest.needs('opinion', writtenOpinion.id, 'ner', opinion_hash):
+        return [], opinion_hash
+    sentences, skipped = ner_sentences(opinion["content"])
+    count_ner(sentences=len(sentences) + skipped, prefiltered=skipped)
+    if not sentences:
+        # Nothing left to tag, so NER is done for this content
+        manifest.mark_done('opinion', writtenOpinion.id, 'ner', opinion_hash)
+    return sentences, opinion_hash
+
+def merge_extractions(results):
+    # Each mention is resolved once; returns the opinion's distinct entity
+    # nodes and its distinct relations as [[head_node, tail_node], edge]
+    count_ner(tagged=len(results), relations_skipped=sum(len(entities) < 2 for entities, _ in results))
     all_entities = {}
     all_relations = {}
     
-    for sentence in sentences:
-        entities, relations = extract_entities_and_relations(sentence)
-        
+    for entities, relations in results:
+        # A relation's endpoints are entities of the same sentence, so they reuse those nodes
+        sentence_nodes = {}
         for entity in entities:
             if entity and entity.text:
-                entity_hash = calculate_hash(entity.text)
-                if entity_hash not in all_entities:
-                    all_entities[entity_hash] = entity
+                node = entity_to_node(entity)
+                sentence_nodes[(entity.text, entity.label)] = node
+                all_entities.setdefault((node.id, node.label), node)
         
+        # Keyed on both endpoints, so every distinct relation of a type is kept
         for relation in relations:
             if relation and relation.label:
-                relation_hash = calculate_hash(relation.label)
-                if relation_hash not in all_relations:
-                    all_relations[relation_hash] = relation
+                head_node = sentence_nodes.get((relation.head.text, relation.head.label)) or entity_to_node(relation.head)
+                tail_node = sentence_nodes.get((relation.tail.text, relation.tail.label)) or entity_to_node(relation.tail)
+                key = (head_node.id, head_node.label, relation.label, tail_node.id, tail_node.label)
+                if key not in all_relations:
+                    all_relations[key] = [[head_node, tail_node], relation_to_edge(relation, head_node, tail_node)]
     
     return list(all_entities.values()), list(all_relations.values())
+
+def save_opinion_node(opinion: WrittenOpinion, case_node: Node):
+    opinion_node = Node(opinion.id, "Opinion", {"title": opinion.title, "case_id": case_node.id})
+    graph_writer.add_node(opinion_node)
+    case_opinion_edge = Edge(case_node.id, opinion_node.id, "case_opinion", {}, "count", "Case", "Opinion")
+    graph_writer.add_edge(case_opinion_edge)
+
+def save_opinion_entities(entities_nodes, relations, case_node: Node):
+  # Takes the resolved nodes and relations from merge_extractions
+  if entities_nodes:
+    for relation in relations:
+      if relation:
+        relation_nodes, relation_edge = relation
+        head_node, tail_node = relation_nodes
+        if head_node and tail_node:
+          graph_writer.add_node(head_node)
+          graph_writer.add_node(tail_node)
+          graph_writer.add_edge(relation_edge)
+          # print(f"head_node: {head_node}, tail_node: {tail_node}, relation_edge: {relation_edge}")
+
+    for node in entities_nodes:
+      if node:
+        graph_writer.add_node(node)
+        mentioned_in_edge = Edge(case_node.id, node.id, "mentioned_in", {}, "count", "Case", node.label)
+        graph_writer.add_edge(mentioned_in_edge)
+
+  print(".", end="")  
+
+def mark_done_after_flush(kind, unit_id, stage, unit_hash):
+  # Only recorded once the graph writes queued so far are committed
+  graph_writer.after_flush(lambda: manifest.mark_done(kind, unit_id, stage, unit_hash))
   
-def process_scotus_opinions(written_opinions: list[WrittenOpinion], case_node: Node): 
-  if written_opinions:
-    for opinion in written_opinions:
-      if opinion:
-        
-        opinion_node = Node(opinion.id, "Opinion", {"title": opinion.title, "case_id": case_node.id})
-        opinion_node.create_node()
-        case_opinion_edge = Edge(case_node.id, opinion_node.id, "case_opinion", {}, "count")
-        case_opinion_edge.create_edge()
-        
-        entities, relations = process_scotus_opinion(opinion, case_node)
-        if entities:
-          entities_nodes = [entity_to_node(entity) for entity in entities if entity]
-          for relation in relations:
-            if relation:
-              relation_nodes, relation_edge = relation_to_nodes_and_edges(relation)
-              head_node, tail_node = relation_nodes
-              if head_node and tail_node:
-                head_node.create_node()
-                tail_node.create_node()
-                relation_edge.create_edge()
-                # print(f"head_node: {head_node}, tail_node: {tail_node}, relation_edge: {relation_edge}")
-
-          for node in entities_nodes:
-            if node:
-              node.create_node()
-              mentioned_in_edge = Edge(case_node.id, node.id, "mentioned_in", {}, "count")
-              mentioned_in_edge.create_edge()
-
-        print(".", end="")  
-        
-def process_scotus_case(case: Case):
+def case_to_node(case: Case):
+  return Node(case.id, "Case", {"name": case.name, "docket_number": case.docket_number, "term": case.term, "decided_date": case.decided_date.strftime('%Y-%m-%d')})
+
+def save_case_graph(case: Case, case_node: Node):
   first_party = case.first_party
   second_party = case.second_party
   advocates = case.advocates if case.advocates else []
   decisions = case.decisions if case.decisions else []
   justices = case.decided_by.members if case.decided_by and case.decided_by.members else []
   
-  case_node = Node(case.id, "Case", {"name": case.name, "docket_number": case.docket_number, "term": case.term, "decided_date": case.decided_date.strftime('%Y-%m-%d')})
-  case_node.create_node()
+  graph_writer.add_node(case_node)
   
   if first_party:
       first_party_node = Node(first_party,"Party", {"name": first_party})
-      first_party_node.create_node()
+      graph_writer.add_node(first_party_node)
       first_party_node_name = case.first_party_label      
-      case_party_edge_1 = Edge(case_node.id, first_party_node.id, first_party_node_name, {}, "count")
-      case_party_edge_1.create_edge()
+      case_party_edge_1 = Edge(case_node.id, first_party_node.id, first_party_node_name, {}, "count", "Case", "Party")
+      graph_writer.add_edge(case_party_edge_1)
   
   if second_party:
       second_party_node = Node(second_party, "Party", {"name": second_party})
-      second_party_node.create_node()
+      graph_writer.add_node(second_party_node)
       second_party_node_name = case.second_party_label
-      case_party_edge_2 = Edge(case_node.id, second_party_node.id, second_party_node_name, {}, "count")
-      case_party_edge_2.create_edge()  
+      case_party_edge_2 = Edge(case_node.id, second_party_node.id, second_party_node_name, {}, "count", "Case", "Party")
+      graph_writer.add_edge(case_party_edge_2)  
   
   for advocate in advocates:
     advocate_node = Node(advocate.name, "Advocate", {"name": advocate.name, "description": advocate.description})
-    advocate_node.create_node()
-    advocate_edge = Edge(case_node.id, advocate_node.id, "advocated_by", {}, "count")
-    advocate_edge.create_edge()
+    graph_writer.add_node(advocate_node)
+    advocate_edge = Edge(case_node.id, advocate_node.id, "advocated_by", {}, "count", "Case", "Advocate")
+    graph_writer.add_edge(advocate_edge)
   
   for justice in justices:
     justice_node = Node(justice.id, "Justice", {"name": justice.name})
-    justice_node.create_node()
-    justice_edge = Edge(case_node.id, justice_node.id, "decided_by", {}, "count")
-    justice_edge.create_edge()
+    graph_writer.add_node(justice_node)
+    justice_edge = Edge(case_node.id, justice_node.id, "decided_by", {}, "count", "Case", "Justice")
+    graph_writer.add_edge(justice_edge)
     
   for decision in decisions:
     if decision.winning_party:
         decision_node = Node(decision.winning_party, "Party", { "name": decision.winning_party})
-        decision_node.create_node()
+        graph_writer.add_node(decision_node)
         if decision.decision_type:  # Check if decision_type is not None
             decision_edge = Edge(case_node.id, decision_node.id, "won_by", {
                 "decision_type": decision.decision_type
-            }, "count")
-            decision_edge.create_edge()
+            }, "count", "Case", "Party")
+            graph_writer.add_edge(decision_edge)
     for vote in decision.votes:
       justice_node = Node(vote.member.id, "Justice", {"name": vote.member.name})
-      justice_node.create_node()
+      graph_writer.add_node(justice_node)
       vote_edge = Edge(case_node.id, justice_node.id, vote.vote, {
         "opinion_type": vote.opinion_type
-      }, "count")
-      vote_edge.create_edge()
+      }, "count", "Case", "Justice")
+      graph_writer.add_edge(vote_edge)
   
-  # print(len(case.written_opinion))  
-  process_scotus_opinions(case.written_opinion, case_node)        
+  for opinion in case.written_opinion:
+    if opinion:
+      save_opinion_node(opinion, case_node)
+
+###########################
+# Pipeline                #
+###########################
+# Each stage passes a dict along: cases fan out into one item per opinion,
+# which is then embedded, upserted, run through NER and written to the graph.
+
+def load_case_stage(case_data):
+  case = Case(case_data)
+  records = opinions_db.get_many([opinion.id for opinion in case.written_opinion if opinion])
+  return {"case": case, "case_hash": content_hash(json.dumps(case_data, sort_keys=True)), "records": records}
+
+def case_graph_stage(item):
+  case = item["case"]
+  case_node = case_to_node(case)
+  if manifest.needs('case', case.id, 'graph', item["case_hash"]):
+    save_case_graph(case, case_node)
+    mark_done_after_flush('case', case.id, 'graph', item["case_hash"])
+  
+  opinions = []
+  for opinion in case.written_opinion:
+    record = item["records"].get(opinion.id) if opinion else None
+    if record and "content" in record:
+      opinions.append({"case_node": case_node, "opinion": opinion, "record": record})
+  return opinions
+
+def embed_stage(item):
+  item["vectors"] = opinion_chunk_vectors(item["case_node"].id, item["record"]["content"], item["opinion"].id)
+  return item
+
+def upsert_stage(item):
+  upsert_sink.add_many(item.pop("vectors"))
+  return item
+
+def ner_stage(item):
+  sentences, item["opinion_hash"] = opinion_sentences(item["opinion"], item.pop("record"))
+  if not sentences:
+    return None
+  item["results"] = extract_batch(sentences, tagger, extractor, ner_mini_batch_size)
+  return item
+
+def pooled_ner_stage(extractor_pool: ParallelExtractor):
+  async def run(item):
+    sentences, item["opinion_hash"] = opinion_sentences(item["opinion"], item.pop("record"))
+    if not sentences:
+      return None
+    _, compact = await asyncio.wrap_future(extractor_pool.submit(item["opinion"].id, sentences))
+    item["results"] = expand_results(compact)
+    return item
+  return run
+
+def entity_graph_stage(item):
+  entities, relations = merge_extractions(item["results"])
+  save_opinion_entities(entities, relations, item["case_node"])
+  mark_done_after_flush('opinion', item["opinion"].id, 'ner', item["opinion_hash"])
+
+def scotus_pipeline(extractor_pool=None):
+  embed_concurrency = int(os.getenv('EMBED_CONCURRENCY', 4))
+  if extractor_pool:
+    ner = Stage("ner", pooled_ner_stage(extractor_pool), concurrency=extractor_pool.max_pending)
+  else:
+    ner = Stage("ner", ner_stage)
+  return Pipeline([
+    Stage("load", load_case_stage, concurrency=2),
+    Stage("case_graph", case_graph_stage, fan_out=True),
+    Stage("embed", embed_stage, concurrency=embed_concurrency),
+    Stage("upsert", upsert_stage),
+    ner,
+    Stage("entity_graph", entity_graph_stage),
+  ])
+
+def run_pipeline(pipeline, cases):
+  if metrics:
+    metrics.watch("stage", pipeline.stats)
+  return pipeline.run_sync(tqdm(cases))
 
 ###########################
 # Main                    #
 ###########################
 
-expanded_cases = cases_db.all()
-sampled_cases = random.sample(expanded_cases, 150)
+def main():
+  parser = argparse.ArgumentParser(description="Ingest a sample of SCOTUS cases into Neo4j and Pinecone")
+  mode = parser.add_mutually_exclusive_group()
+  mode.add_argument("--resume", action="store_true", help="skip cases, opinions and chunks whose stages already completed")
+  mode.add_argument("--only-changed", action="store_true", help="only reprocess units whose content changed since they completed")
+  mode.add_argument("--export-csv", metavar="DIR", help="write the graph as neo4j-admin import CSVs to DIR instead of Neo4j")
+  parser.add_argument("--sample-size", type=int, default=150)
+  parser.add_argument("--all-cases", action="store_true", help="process every case instead of a sample")
+  parser.add_argument("--seed", type=int, help="seed for a reproducible sample")
+  args = parser.parse_args()
+
+  init(graph_export_dir=args.export_csv)
+  manifest.mode = 'resume' if args.resume else 'only-changed' if args.only_changed else 'all'
+
+  sampled_cases = cases_db if args.all_cases else cases_db.sample(args.sample_size, args.seed)
+
+  if ner_workers:
+    with ParallelExtractor(ner_workers, ner_torch_threads, ner_mini_batch_size) as extractor_pool:
+      stats = run_pipeline(scotus_pipeline(extractor_pool), sampled_cases)
+  else:
+    stats = run_pipeline(scotus_pipeline(), sampled_cases)
+  print(stats)
+
+  close()
+  if args.export_csv:
+    print(f"Wrote {graph_writer.nodes_written} nodes and the import script to {args.export_csv}")
+
 
-for case_data in tqdm(sampled_cases):
-    case = Case(case_data)
-    process_scotus_case(case)
\ No newline at end of file
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,82 @@
+import re
+
+# Sentence segmentation and a cheap pre-filter for the NER models. Opinions
+# are full of "v.", "U.S." and reporter citations, so a period only ends a
+# sentence when the word before it isn't a known abbreviation or an initial
+# and the next word doesn't start in lowercase.
+
+# Lowercased, without the final period
+ABBREVIATIONS = {
+    "v", "vs", "u.s", "u.s.c", "no", "nos", "inc", "co", "corp", "ltd", "bros", "assn", "dept", "ass'n", "dep't",
+    "mr", "mrs", "ms", "dr", "jr", "sr", "st", "hon", "rev", "gen", "gov", "sen", "rep", "atty", "prof",
+    "j", "jj", "c.j", "ct", "cir", "app", "supp", "cert", "f", "f.2d", "f.3d", "f.4th", "l", "ed", "l.ed", "s.ct",
+    "stat", "const", "art", "amend", "cl", "sec", "ch", "pt", "para", "pp", "p", "n", "nn", "ibid", "id", "cf",
+    "e.g", "i.e", "etc", "al", "seq", "ann", "cong", "sess", "h.r", "res", "fed", "reg", "cal", "tex",
+    "fla", "ill", "mass", "mich", "pa", "va", "wash", "wis", "n.y", "d.c", "jan", "feb", "mar", "apr", "jun",
+    "jul", "aug", "sep", "sept", "oct", "nov", "dec",
+}
+# A candidate boundary: terminal punctuation, any closing quotes/brackets, then whitespace
+BOUNDARY = re.compile(r"[.!?][\"')\]]*\s+")
+PARAGRAPH = re.compile(r"\n[ \t]*\n|\n(?=[ \t]*#)")
+WORD_BEFORE = re.compile(r"([\w.'’]+)[.!?][\"')\]]*\s+$")
+TOKEN = re.compile(r"[A-Za-z][\w'’.-]*")
+
+MIN_SENTENCE_CHARS = 20
+# Capitalized words that start ordinary sentences and are never entities on their own
+STARTERS = {
+    "the", "a", "an", "it", "its", "this", "that", "these", "those", "there", "we", "i", "in", "on", "at", "for",
+    "but", "and", "or", "if", "when", "because", "as", "to", "of", "by", "with", "our", "such", "no", "not", "nor",
+    "accordingly", "however", "moreover", "thus", "here", "so", "finally", "first", "second", "third", "see",
+}
+
+
+def _ends_sentence(text, end):
+    # `end` is just past the boundary match; look at the word before it and the one after
+    match = WORD_BEFORE.search(text, max(0, end - 40), end)
+    if match:
+        word = match.group(1).lower().lstrip("(\"'")
+        if word in ABBREVIATIONS or (len(word) == 1 and word.isalpha()):
+            return False
+    # A lowercase next word continues the sentence after an abbreviation not listed above
+    following = text[end:end + 1]
+    return bool(following) and not following.islower()
+
+
+def split_sentences(text):
+    """Splits `text` into sentences, also breaking at blank lines and before markdown headings."""
+    sentences = []
+    for paragraph in PARAGRAPH.split(text or ""):
+        start = 0
+        for match in BOUNDARY.finditer(paragraph):
+            if _ends_sentence(paragraph, match.end()):
+                sentences.append(paragraph[start:match.end()].strip())
+                start = match.end()
+        sentences.append(paragraph[start:].strip())
+    return [sentence for sentence in sentences if sentence]
+
+
+def worth_tagging(sentence, min_chars=MIN_SENTENCE_CHARS):
+    """False for sentences the NER models can't get an entity from.
+
+    That is headings, short fragments, citation strings that are mostly
+    digits and punctuation, and sentences without a capitalized word other
+    than an ordinary sentence starter.
+    """
+    if len(sentence) < min_chars or sentence.lstrip().startswith("#"):
+        return False
+    # Reporter citations ("505 U.S. 833, 846.") are mostly digits and punctuation
+    letters = sum(character.isalpha() for character in sentence)
+    if letters * 3 < len(sentence) - sentence.count(" "):
+        return False
+    tokens = TOKEN.findall(sentence)
+    for i, token in enumerate(tokens):
+        if token[0].isupper() and (i or token.lower() not in STARTERS):
+            return True
+    return False
+
+
+def ner_sentences(text, min_chars=MIN_SENTENCE_CHARS):
+    """Returns (sentences worth tagging, number of sentences skipped)."""
+    sentences = split_sentences(text)
+    kept = [sentence for sentence in sentences if worth_tagging(sentence, min_chars)]
+    return kept, len(sentences) - len(kept)
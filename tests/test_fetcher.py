@@ -0,0 +1,137 @@
+import asyncio
+import unittest
+
+from pymongo import UpdateOne
+
+from fakes import MemoryCollection, MemoryDatabase, StubHTTPServer
+from fetcher import Fetcher, MongoBuffer, crawl_cases, known_validators
+
+# Runs offline against fakes.StubHTTPServer:
+#   python -m unittest discover tests
+
+
+def fetch(url, **kwargs):
+    async def run():
+        async with Fetcher(rate=1000.0, backoff=0.01) as fetcher:
+            return fetcher, await fetcher.fetch(url, **kwargs)
+    return asyncio.run(run())
+
+
+class FetcherTest(unittest.TestCase):
+    def test_etag_makes_an_unchanged_page_a_304(self):
+        with StubHTTPServer({"/case": (b'{"id": 1}', '"v1"')}) as server:
+            fetcher, result = fetch(server.url("/case"))
+            self.assertTrue(result.ok)
+            self.assertEqual(result.etag, '"v1"')
+            self.assertEqual(result.json(), {"id": 1})
+
+            fetcher, result = fetch(server.url("/case"), etag=result.etag)
+            self.assertTrue(result.not_modified)
+            self.assertIsNone(result.body)
+            self.assertEqual(fetcher.not_modified, 1)
+
+            # A changed page is served again with its new etag
+            server.pages["/case"] = (b'{"id": 2}', '"v2"')
+            fetcher, result = fetch(server.url("/case"), etag='"v1"')
+            self.assertTrue(result.ok)
+            self.assertEqual(result.etag, '"v2"')
+            self.assertEqual(fetcher.not_modified, 0)
+
+    def test_503_is_retried(self):
+        with StubHTTPServer({"/case": (b"body", None)}, failures={"/case": 2}) as server:
+            fetcher, result = fetch(server.url("/case"))
+            self.assertTrue(result.ok)
+            self.assertEqual(result.body, b"body")
+            self.assertEqual(fetcher.retries, 2)
+            self.assertEqual(fetcher.requests, 3)
+            self.assertEqual(server.requests, ["/case"] * 3)
+
+    def test_503_is_returned_once_retries_run_out(self):
+        with StubHTTPServer({"/case": (b"body", None)}, failures={"/case": 5}) as server:
+            async def run():
+                async with Fetcher(rate=1000.0, max_retries=1, backoff=0.01) as fetcher:
+                    return fetcher, await fetcher.fetch(server.url("/case"))
+            fetcher, result = asyncio.run(run())
+            self.assertEqual(result.status, 503)
+            self.assertEqual(fetcher.retries, 1)
+
+
+class MongoBufferTest(unittest.TestCase):
+    def test_keyed_documents_are_upserted(self):
+        collection = MemoryCollection()
+        buffer = MongoBuffer(collection, key="href", batch_size=2)
+        buffer.add({"href": "a", "etag": '"v1"'})
+        self.assertEqual(collection.bulk_operations, [])
+        buffer.add({"href": "b", "etag": '"v2"'})
+        self.assertEqual(collection.bulk_operations, [
+            UpdateOne({"href": "a"}, {"$set": {"href": "a", "etag": '"v1"'}}, upsert=True),
+            UpdateOne({"href": "b"}, {"$set": {"href": "b", "etag": '"v2"'}}, upsert=True),
+        ])
+        self.assertEqual(buffer.written, 2)
+        self.assertEqual(known_validators(collection, "href"), {"a": ('"v1"', None), "b": ('"v2"', None)})
+
+        # Upserting the same key again updates the stored document
+        buffer.add({"href": "a", "etag": '"v3"'})
+        buffer.flush()
+        self.assertEqual(collection.count_documents({"href": "a"}), 1)
+        self.assertEqual(collection.find_one({"href": "a"})["etag"], '"v3"')
+
+    def test_unkeyed_documents_are_inserted(self):
+        collection = MemoryCollection()
+        buffer = MongoBuffer(collection)
+        buffer.add({"href": "a", "etag": '"v1"', "last_modified": None})
+        buffer.add({"name": "no href"})
+        buffer.flush()
+        self.assertEqual(collection.bulk_operations, [])
+        self.assertEqual(known_validators(collection, "href"), {"a": ('"v1"', None)})
+
+
+class CrawlTest(unittest.TestCase):
+    def crawl(self, db):
+        async def run():
+            async with Fetcher(rate=1000.0, backoff=0.01) as fetcher:
+                return fetcher, await crawl_cases(fetcher, db)
+        return asyncio.run(run())
+
+    def test_a_second_crawl_only_revalidates_unchanged_cases(self):
+        pages = {"/cases/1": (b'{"name": "Roe"}', '"r1"'), "/cases/2": (b'{"name": "Doe"}', '"d1"')}
+        with StubHTTPServer(pages) as server:
+            db = MemoryDatabase()
+            db.cases.insert_many([{"href": server.url(path)} for path in pages])
+
+            fetcher, _ = self.crawl(db)
+            self.assertEqual(fetcher.not_modified, 0)
+            self.assertEqual(known_validators(db.expanded_cases, "href"), {
+                server.url("/cases/1"): ('"r1"', None),
+                server.url("/cases/2"): ('"d1"', None),
+            })
+            self.assertEqual(db.processed_cases.find_one({"href": server.url("/cases/1")})["name"], "Roe")
+            self.assertTrue(all("If-None-Match" not in headers for headers in server.headers))
+
+            expanded = len(db.expanded_cases.bulk_operations)
+            processed = len(db.processed_cases.bulk_operations)
+            server.headers.clear()
+            fetcher, _ = self.crawl(db)
+            self.assertEqual(fetcher.not_modified, 2)
+            self.assertEqual(sorted(headers["If-None-Match"] for headers in server.headers), ['"d1"', '"r1"'])
+            self.assertEqual(len(db.expanded_cases.bulk_operations), expanded)
+            self.assertEqual(len(db.processed_cases.bulk_operations), processed)
+            self.assertEqual(len(db.expanded_cases.documents), 2)
+
+    def test_a_changed_case_is_stored_again(self):
+        pages = {"/cases/1": (b'{"name": "Roe"}', '"r1"')}
+        with StubHTTPServer(pages) as server:
+            db = MemoryDatabase()
+            db.cases.insert_one({"href": server.url("/cases/1")})
+            self.crawl(db)
+
+            pages["/cases/1"] = (b'{"name": "Roe v. Wade"}', '"r2"')
+            fetcher, _ = self.crawl(db)
+            self.assertEqual(fetcher.not_modified, 0)
+            self.assertEqual(db.expanded_cases.count_documents({}), 1)
+            self.assertEqual(known_validators(db.expanded_cases, "href"), {server.url("/cases/1"): ('"r2"', None)})
+            self.assertEqual(db.processed_cases.find_one({})["name"], "Roe v. Wade")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+from fakes import RecordingDriver
+from graph_writer import GraphWriter, edge_rows_query, node_rows_query
+
+
+class Node:
+    def __init__(self, label, id, properties):
+        self.label = label
+        self.id = id
+        self.properties = properties
+
+    def row(self):
+        return {"id": self.id, "properties": self.properties}
+
+
+class QueryTest(unittest.TestCase):
+    def test_property_keys_are_quoted_on_both_sides(self):
+        self.assertEqual(
+            node_rows_query("Case", ("decided on", "a`b")),
+            "UNWIND $rows AS row MERGE (n:`Case` {id: row.id})"
+            " SET n.`decided on` = row.properties.`decided on`"
+            " SET n.`a``b` = row.properties.`a``b`",
+        )
+        self.assertEqual(
+            edge_rows_query("CITES", ("first-cited",), "count"),
+            "UNWIND $rows AS row MATCH (a {id: row.from_id}) MATCH (b {id: row.to_id}) "
+            "MERGE (a)-[r:`CITES` {`first-cited`: row.properties.`first-cited`}]->(b) "
+            "ON CREATE SET r.`count` = row.delta ON MATCH SET r.`count` = r.`count` + row.delta",
+        )
+
+    def test_key_text_is_not_inlined_as_cypher(self):
+        key = "x} DETACH DELETE n //"
+        query = node_rows_query("Case", (key,))
+        self.assertEqual(query.count(f"`{key}`"), 2)
+        self.assertNotIn(f".{key}", query)
+
+    def test_writer_passes_properties_as_parameters(self):
+        driver = RecordingDriver()
+        writer = GraphWriter(driver)
+        writer.add_node(Node("Case", "1", {"decided on": "1973-01-22"}))
+        writer.flush()
+        (query, parameters), = driver.statements
+        self.assertIn("row.properties.`decided on`", query)
+        self.assertEqual(parameters["rows"], [{"id": "1", "properties": {"decided on": "1973-01-22"}}])
+
+
+if __name__ == "__main__":
+    unittest.main()
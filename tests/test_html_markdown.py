@@ -0,0 +1,25 @@
+import unittest
+
+from html_markdown import html_to_markdown
+
+PAGE = '<div class="primary-content"><h2>Roe v. Wade</h2><p>Justice Blackmun’s opinion, café</p></div>'
+
+
+class HtmlToMarkdownTest(unittest.TestCase):
+    def test_html_page(self):
+        self.assertEqual(html_to_markdown(f"<html><body>{PAGE}</body></html>"),
+                         "## Roe v. Wade\n\nJustice Blackmun’s opinion, café\n\n")
+
+    def test_xhtml_page_with_an_encoding_declaration(self):
+        # lxml raises ValueError on a str that starts with an encoding declaration
+        page = ('<?xml version="1.0" encoding="ISO-8859-1"?>\n'
+                f'<html xmlns="http://www.w3.org/1999/xhtml"><body>{PAGE}</body></html>')
+        self.assertEqual(html_to_markdown(page), "## Roe v. Wade\n\nJustice Blackmun’s opinion, café\n\n")
+
+    def test_page_without_primary_content(self):
+        self.assertIsNone(html_to_markdown("<html><body><p>Not found</p></body></html>"))
+        self.assertIsNone(html_to_markdown("  "))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import re
+import tempfile
+import unittest
+
+import process
+from fakes import RecordingDriver
+from manifest import Manifest
+
+EDGE = re.compile(r"(CREATE|MERGE) \((\w+)\)-\[:(\w+)\]->\((\w+)\)")
+
+
+class GraphStageTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.saved = process.driver, process.manifest, process.graph_exporter
+        process.driver = RecordingDriver()
+        process.manifest = Manifest(os.path.join(self.directory.name, "manifest.sqlite"), mode="only-changed")
+        process.graph_exporter = None
+
+    def tearDown(self):
+        process.manifest.close()
+        process.driver, process.manifest, process.graph_exporter = self.saved
+        self.directory.cleanup()
+
+    def test_rewriting_a_changed_email_merges_its_edges(self):
+        row = {"transaction_id": "t1", "email_from": "a@enron.com", "email_to": "b@enron.com",
+               "email_subject": "Hi", "email_sent_date": "2001-05-14", "email_body": "First draft"}
+        process.graph_stage(dict(row))
+        process.graph_stage(dict(row))
+        process.graph_stage(dict(row, email_body="Second draft"))
+
+        # The unchanged rerun is skipped; the changed one writes the email again
+        statements = process.driver.statements
+        self.assertEqual(len(statements), 2)
+        self.assertEqual(statements[1][1]["body"], "Second draft")
+        for query, _ in statements:
+            # Only MERGE matches the existing edge instead of adding a parallel one
+            self.assertEqual(EDGE.findall(query), [
+                ("MERGE", "from", "EMAIL_FROM", "email"),
+                ("MERGE", "email", "EMAIL_TO", "to"),
+            ])
+            self.assertNotIn("CREATE", query)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Pinecone rejects upsert requests over 2MB and recommends ~100 vectors per call
+MAX_BATCH_VECTORS = 100
+MAX_BATCH_BYTES = 2 * 1024 * 1024
+
+
+def estimate_vector_bytes(vector_id, values, metadata):
+    return len(vector_id.encode()) + 4 * len(values) + len(json.dumps(metadata or {}).encode())
+
+
+class UpsertSink:
+    """Collects vectors and upserts them into `index` in size-capped batches.
+
+    Any object with an `upsert(vectors=...)` method works as the index, so an
+    in-memory stand-in can be passed in place of a Pinecone index. Batches are
+    sent from a small thread pool; a batch that fails is kept in `failures`
+    as (vectors, exception) and can be resent with `retry_failed`.
+    `on_upserted`, if set, is called from the worker with each batch that
+    was stored successfully. An exception from it, or anything else raised
+    in a worker, is logged and kept in `errors`; those vectors are stored.
+    """
+
+    def __init__(self, index, max_batch_vectors=MAX_BATCH_VECTORS, max_batch_bytes=int(MAX_BATCH_BYTES * 0.9),
+                 max_workers=4, max_pending=None, on_upserted=None):
+        self.index = index
+        self.on_upserted = on_upserted
+        self.max_batch_vectors = max_batch_vectors
+        self.max_batch_bytes = max_batch_bytes
+        self.max_workers = max_workers
+        self.max_pending = max_pending or max_workers * 2
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = set()
+        self.batch = []
+        self.batch_bytes = 0
+        self.upserted = 0
+        self.failures = []
+        self.errors = []
+        self.lock = threading.Lock()
+
+    def add(self, vector_id, values, metadata=None):
+        size = estimate_vector_bytes(vector_id, values, metadata)
+        if self.batch and (len(self.batch) >= self.max_batch_vectors or self.batch_bytes + size > self.max_batch_bytes):
+            self.flush()
+        self.batch.append((vector_id, values, metadata or {}))
+        self.batch_bytes += size
+
+    def add_many(self, vectors):
+        for vector_id, values, metadata in vectors:
+            self.add(vector_id, values, metadata)
+
+    def _upsert(self, vectors):
+        try:
+            self.index.upsert(vectors=vectors)
+        except Exception as e:
+            logging.warning(f"Upsert of {len(vectors)} vectors failed: {e}")
+            with self.lock:
+                self.failures.append((vectors, e))
+            return
+        with self.lock:
+            self.upserted += len(vectors)
+        if self.on_upserted:
+            try:
+                self.on_upserted(vectors)
+            except Exception as e:
+                logging.exception(f"on_upserted failed for {len(vectors)} stored vectors")
+                with self.lock:
+                    self.errors.append(e)
+
+    def _reap(self, done):
+        # A worker that raised anyway would otherwise only leave its exception on a discarded future
+        for future in done:
+            error = future.exception()
+            if error is not None:
+                logging.error("Upsert worker failed", exc_info=error)
+                with self.lock:
+                    self.errors.append(error)
+
+    def _submit(self, vectors):
+        # Keep the number of in-flight batches bounded so memory stays flat
+        while len(self.pending) >= self.max_pending:
+            done, self.pending = wait(self.pending, return_when=FIRST_COMPLETED)
+            self._reap(done)
+        self.pending.add(self.pool.submit(self._upsert, vectors))
+
+    def flush(self):
+        if self.batch:
+            self._submit(self.batch)
+            self.batch = []
+            self.batch_bytes = 0
+
+    def join(self):
+        """Flushes the current batch and waits for all in-flight upserts."""
+        self.flush()
+        done, _ = wait(self.pending)
+        self._reap(done)
+        self.pending = set()
+
+    def retry_failed(self):
+        with self.lock:
+            failed, self.failures = self.failures, []
+        for vectors, _ in failed:
+            self._submit(vectors)
+        self.join()
+        return len(self.failures)
+
+    def close(self):
+        self.join()
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()